@@ -0,0 +1,169 @@
+"""
+Champion lists: for every term, the INDEXER_CHAMPION_LIST_SIZE postings with the highest
+normalized weight (the term's weight in the document vector divided by the document's norm,
+a document's share of its cosine with a one-term query) are kept as ChampionPosting rows.
+
+Approximate top-k retrieval scores only the documents in the union of the query terms'
+champion lists, so a query of very common terms reads a bounded number of postings rather
+than all of them. Indexing a document adds it to the lists it outscores; lists are rebuilt
+from scratch whenever norms are refreshed, or with the build_champion_lists command.
+"""
+
+import heapq
+from itertools import groupby
+from django.conf import settings
+from django.db.models import Count, Min, Q
+from indexer.models import ChampionPosting, Document, TermLexicon
+from indexer.postings import iter_postings
+from indexer.retrieve import (accumulate_top_scores, compute_idf_query_terms, get_retrieval_engine, get_term_idfs,
+                              rank_shards, read_database_postings, term_weight, weight_query_terms)
+from indexer.segments import segments_enabled
+from indexer.shards import atomic, get_shard_aliases
+from indexer.utils import batched
+
+DEFAULT_CHAMPION_LIST_SIZE = 500
+# champion lists are read and written in batches of this many terms
+CHAMPION_BATCH_SIZE = 250
+
+
+def champion_lists_enabled():
+    """Returns True if the write path maintains ChampionPosting rows (INDEXER_CHAMPION_LISTS)"""
+    return getattr(settings, 'INDEXER_CHAMPION_LISTS', False)
+
+
+def get_champion_list_size():
+    return getattr(settings, 'INDEXER_CHAMPION_LIST_SIZE', DEFAULT_CHAMPION_LIST_SIZE)
+
+
+def update_champion_lists(doc_id, scores):
+    """
+    Replaces a (re)indexed document's entries in the champion lists of its terms. The
+    document enters every list that is not full or whose lowest score it beats, and the
+    lowest scoring entry of each list it overfills is evicted. Lists that lose entries
+    to a reindexed document are only topped up by the next rebuild.
+
+    doc_id: Document id
+    scores: dict mapping TermLexicon id to the document's normalized weight of the term
+
+    returns:
+        None
+    """
+    list_size = get_champion_list_size()
+    ChampionPosting.objects.filter(context_id=doc_id).delete()
+    for score_batch in batched(scores.items(), CHAMPION_BATCH_SIZE):
+        list_stats = {
+            row['term_id']: (row['size'], row['min_score'])
+            for row in ChampionPosting.objects.filter(term_id__in=[term_id for term_id, _ in score_batch]).values(
+                'term_id').annotate(size=Count('id'), min_score=Min('score'))}
+
+        champions = []
+        evictions = Q()
+        for term_id, score in score_batch:
+            size, min_score = list_stats.get(term_id, (0, 0.0))
+            if size >= list_size:
+                if score <= min_score:
+                    continue
+                evictions |= Q(term_id=term_id, score=min_score)
+            champions.append(ChampionPosting(term_id=term_id, context_id=doc_id, score=score))
+
+        if evictions:
+            # exactly one entry leaves each list, the first by (score, id) when scores tie
+            evicted_ids = ChampionPosting.objects.filter(evictions).values('term_id').annotate(
+                evicted_id=Min('id')).values_list('evicted_id', flat=True)
+            ChampionPosting.objects.filter(pk__in=list(evicted_ids)).delete()
+        ChampionPosting.objects.bulk_create(champions)
+
+
+@atomic
+def rebuild_champion_lists():
+    """
+    Rebuilds every champion list in one pass over the postings ordered by term (see
+    indexer.postings.iter_postings), with the current IDF statistics and document norms
+
+    returns:
+        int: number of champion postings written
+    """
+    list_size = get_champion_list_size()
+    ChampionPosting.objects.all().delete()
+    # the global IDF of a sharded index, the scale its norms and rankings are on
+    term_idfs = get_term_idfs()
+    # documents without a norm are never ranked
+    norms = dict(Document.objects.filter(norm__gt=0).values_list('id', 'norm').iterator())
+
+    champions = []
+    written = 0
+    for term_id, term_postings in groupby(iter_postings(), key=lambda posting: posting[0]):
+        scored_postings = (
+            (term_weight(frequency, term_idfs[term_id]) / norms[doc_id], doc_id)
+            for _, doc_id, frequency in term_postings if doc_id in norms)
+        for score, doc_id in heapq.nlargest(list_size, scored_postings):
+            champions.append(ChampionPosting(term_id=term_id, context_id=doc_id, score=score))
+        if len(champions) >= CHAMPION_BATCH_SIZE:
+            ChampionPosting.objects.bulk_create(champions, batch_size=CHAMPION_BATCH_SIZE)
+            written += len(champions)
+            champions = []
+    ChampionPosting.objects.bulk_create(champions, batch_size=CHAMPION_BATCH_SIZE)
+    return written + len(champions)
+
+
+def champion_postings(term_ids, depth):
+    """
+    Reads the union of the given terms' champion lists
+
+    term_ids: iterable of TermLexicon ids
+    depth:    number of documents the ranking needs
+
+    returns:
+        read_postings function (see indexer.retrieve.read_database_postings) that only reads
+        the postings of the documents in the union, None when fewer than depth documents are in it
+    """
+    union = set()
+    for term_id_batch in batched(term_ids, CHAMPION_BATCH_SIZE):
+        union.update(ChampionPosting.objects.filter(term_id__in=term_id_batch).values_list('context_id', flat=True))
+    if len(union) < depth:
+        return None
+
+    def read_postings(term_id, candidates=None):
+        candidates = union if candidates is None else candidates
+        for posting in read_database_postings(term_id, candidates):
+            if posting[0] in candidates:
+                yield posting
+
+    return read_postings
+
+
+def count_champion_union(query_term_frequency_map):
+    """
+    Counts the documents in the union of the query terms' champion lists, the candidates
+    rank_champions scores when k is at most their number
+
+    query_term_frequency_map: dict mapping parsed query term to its frequency in the query
+
+    returns:
+        number of documents in the union, None when rank_champions does not rank the union of
+        one set of lists (champion lists are disabled, or the index is segmented or sharded)
+    """
+    if not champion_lists_enabled() or segments_enabled() or get_shard_aliases():
+        return None
+    term_ids = TermLexicon.objects.filter(term__in=list(query_term_frequency_map)).values_list('id', flat=True)
+    return ChampionPosting.objects.filter(term_id__in=list(term_ids)).values('context_id').distinct().count()
+
+
+def rank_champions(query_term_frequency_map, k=None, offset=0):
+    """
+    Approximate retrieval engine scoring only the documents in the union of the query terms'
+    champion lists, see indexer.retrieve.rank_in_database for the arguments. The documents
+    are scored exactly, but documents outside every champion list are never considered.
+    Falls back to the configured engine when fewer than offset + k documents are in the
+    union, when every document is requested or when champion lists are not maintained.
+    """
+    if k is None or not champion_lists_enabled() or segments_enabled():
+        return get_retrieval_engine()(query_term_frequency_map, k=k, offset=offset)
+    if get_shard_aliases():
+        return rank_shards(query_term_frequency_map, k=k, offset=offset, select_postings=champion_postings)
+
+    idf_terms, term_ids, max_scores = compute_idf_query_terms(query_term_frequency_map.keys())
+    tf_idf_query = weight_query_terms(query_term_frequency_map, idf_terms)
+    read_postings = champion_postings(term_ids.values(), offset + k) or read_database_postings
+    ranked = accumulate_top_scores(tf_idf_query, idf_terms, term_ids, max_scores, offset + k, read_postings)
+    return tuple(doc_id for doc_id, _ in ranked[offset:])
@@ -0,0 +1,217 @@
+"""
+Concurrent crawler: pages are fetched by up to INDEXER_CRAWL_CONCURRENCY threads at once,
+while each host gets at most INDEXER_CRAWL_HOST_CONCURRENCY requests in flight, started at
+least INDEXER_CRAWL_HOST_DELAY seconds apart. The fetching threads analyze their pages and
+hand them to an indexer.writer.IndexWriter, whose bounded queue holds back the fetchers when
+indexing falls behind. Links to the same host are followed up to a given depth.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.db import connections
+from indexer.index import get_document_validators
+from indexer.scraper import NOT_MODIFIED, scrape
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_HOST_CONCURRENCY = 2
+DEFAULT_HOST_DELAY = 1.0
+# most URLs waiting to be fetched, links found past it are dropped
+DEFAULT_FRONTIER_SIZE = 100000
+
+
+def read_seed_file(path):
+    """Returns the URLs listed one per line in a file, skipping blank lines and # comments"""
+    with open(path) as seed_file:
+        return [line.strip() for line in seed_file if line.strip() and not line.lstrip().startswith('#')]
+
+
+def get_host(url):
+    """Returns the host politeness limits apply to, with its port"""
+    return urlsplit(url).netloc.lower()
+
+
+class CrawlStats:
+    """Counts of a crawl, updated by the fetching threads"""
+    def __init__(self):
+        self.started = time.monotonic()
+        self.fetched = 0  # pages downloaded successfully
+        self.failed = 0  # pages that could not be downloaded
+        self.bytes = 0  # response bodies of the pages fetched
+        self.indexed = 0
+        self.not_modified = 0  # pages the server reported unchanged since they were last indexed
+        self.unchanged = 0  # pages downloaded again whose text had not changed
+        self.index_errors = 0
+        self.lock = threading.Lock()
+
+    def add(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def elapsed(self):
+        return max(time.monotonic() - self.started, 1e-9)
+
+    def pages_per_second(self):
+        return self.fetched / self.elapsed()
+
+    def bytes_per_second(self):
+        return self.bytes / self.elapsed()
+
+    def __str__(self):
+        return (f'{self.fetched} pages fetched ({self.pages_per_second():.1f} pages/sec, '
+                f'{self.bytes_per_second() / 1024:.1f} KiB/sec), {self.failed} failed, '
+                f'{self.not_modified} not modified, {self.indexed} indexed, {self.unchanged} unchanged, '
+                f'{self.index_errors} indexing errors')
+
+
+class Crawler:
+    """
+    Fetches pages from a frontier of URLs with per-host politeness and indexes them
+
+    writer:           indexer.writer.IndexWriter the fetched pages are handed to
+    concurrency:      most pages fetched at once, INDEXER_CRAWL_CONCURRENCY by default
+    host_concurrency: most pages fetched at once from one host, INDEXER_CRAWL_HOST_CONCURRENCY by default
+    host_delay:       least seconds between two requests to one host, INDEXER_CRAWL_HOST_DELAY by default
+    max_depth:        links followed from a seed, 0 to only fetch the seeds
+    max_pages:        most pages fetched, no limit when None
+    frontier_size:    most URLs waiting to be fetched
+    """
+    def __init__(self, writer, concurrency=None, host_concurrency=None, host_delay=None, max_depth=0,
+                 max_pages=None, frontier_size=DEFAULT_FRONTIER_SIZE):
+        self.writer = writer
+        self.concurrency = max(1, concurrency or getattr(settings, 'INDEXER_CRAWL_CONCURRENCY', DEFAULT_CONCURRENCY))
+        self.host_concurrency = max(1, host_concurrency or getattr(
+            settings, 'INDEXER_CRAWL_HOST_CONCURRENCY', DEFAULT_HOST_CONCURRENCY))
+        self.host_delay = getattr(settings, 'INDEXER_CRAWL_HOST_DELAY', DEFAULT_HOST_DELAY) \
+            if host_delay is None else host_delay
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.frontier_size = frontier_size
+        self.stats = CrawlStats()
+
+        self.host_queues = {}  # host: deque of its (url, depth) waiting to be fetched, in the order found
+        self.queued = 0
+        self.seen = set()
+        self.host_active = {}  # host: requests in flight
+        self.host_next_start = {}  # host: monotonic time its next request may start
+        self.in_flight = 0
+        self.started_pages = 0
+        self.condition = threading.Condition()
+
+    def add_url(self, url, depth):
+        """Queues a URL unless it was seen before, call with the condition held"""
+        if url in self.seen or self.queued >= self.frontier_size:
+            return
+        self.seen.add(url)
+        self.host_queues.setdefault(get_host(url), deque()).append((url, depth))
+        self.queued += 1
+
+    def next_url(self, now):
+        """
+        Takes the next queued URL of the first host that may be fetched now, call with the
+        condition held
+
+        returns:
+            tuple of the (url, depth) taken, or None, and the seconds until a delayed host frees up
+        """
+        wait = None
+        for host, urls in self.host_queues.items():
+            if self.host_active.get(host, 0) >= self.host_concurrency:
+                continue
+            next_start = self.host_next_start.get(host, now)
+            if next_start > now:
+                wait = next_start - now if wait is None else min(wait, next_start - now)
+                continue
+            url_depth = urls.popleft()
+            if not urls:
+                del self.host_queues[host]
+            self.queued -= 1
+            self.host_active[host] = self.host_active.get(host, 0) + 1
+            self.host_next_start[host] = now + self.host_delay
+            return url_depth, wait
+        return None, wait
+
+    def crawl(self, seeds, report=None, report_interval=10.0):
+        """
+        Crawls from the seed URLs until the frontier is empty or max_pages were fetched
+
+        seeds:           iterable of URLs
+        report:          function called with the CrawlStats every report_interval seconds
+        report_interval: seconds between reports
+
+        returns:
+            CrawlStats of the crawl, once every fetched page is committed
+        """
+        with self.condition:
+            for url in seeds:
+                self.add_url(url, 0)
+        next_report = time.monotonic() + report_interval
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            with self.condition:
+                while True:
+                    now = time.monotonic()
+                    if report is not None and now >= next_report:
+                        report(self.stats)
+                        next_report = now + report_interval
+                    page_limit_reached = self.max_pages is not None and self.started_pages >= self.max_pages
+                    if (not self.queued or page_limit_reached) and not self.in_flight:
+                        break
+                    url_depth, wait = None, None
+                    if self.in_flight < self.concurrency and not page_limit_reached:
+                        url_depth, wait = self.next_url(now)
+                    if url_depth is None:
+                        timeout = next_report - now if report is not None else None
+                        if wait is not None:
+                            timeout = wait if timeout is None else min(timeout, wait)
+                        self.condition.wait(timeout)
+                        continue
+                    self.in_flight += 1
+                    self.started_pages += 1
+                    executor.submit(self.fetch, *url_depth)
+        self.writer.flush()
+        return self.stats
+
+    def fetch(self, url, depth):
+        """Fetches a page in a worker thread, hands it to the writer and queues its links"""
+        links = []
+        try:
+            # a page indexed before is requested conditionally, and not downloaded again if unchanged
+            page_is_scraped_successfully, scrape_results = scrape(url, *get_document_validators(url))
+            if page_is_scraped_successfully and scrape_results['status_code'] == NOT_MODIFIED:
+                self.stats.add(not_modified=1)
+            elif page_is_scraped_successfully and scrape_results['status_code'] == 200:
+                self.stats.add(fetched=1, bytes=scrape_results['page_bytes'])
+                # blocks while the writer's queue is full
+                self.writer.submit(
+                    scrape_results['word_list'], scrape_results['page_title'], url, scrape_results['page_full_text'],
+                    scrape_results['etag'], scrape_results['last_modified']).add_done_callback(self.count_indexed)
+                if depth < self.max_depth:
+                    host = get_host(url)
+                    links = [link for link in scrape_results['links'] if get_host(link) == host]
+            else:
+                self.stats.add(failed=1)
+        except Exception:  # one bad page does not stop the crawl
+            self.stats.add(failed=1)
+        finally:
+            # database connections are per thread, the fetcher's would otherwise leak
+            connections.close_all()
+            with self.condition:
+                host = get_host(url)
+                self.host_active[host] -= 1
+                self.in_flight -= 1
+                for link in links:
+                    self.add_url(link, depth + 1)
+                self.condition.notify()
+
+    def count_indexed(self, future):
+        if future.exception() is not None:
+            self.stats.add(index_errors=1)
+        elif future.result():
+            self.stats.add(indexed=1)
+        else:
+            self.stats.add(unchanged=1)
@@ -0,0 +1,175 @@
+"""
+HTML extractors pull a page's title, visible text and links out of its body. scrape() calls
+the one named by the INDEXER_HTML_EXTRACTOR setting:
+'indexer.extractors.extract_streaming' reads the page in a single pass of html.parser
+callbacks, keeping only the text it emits, and is the default;
+'indexer.extractors.extract_with_soup' builds a BeautifulSoup tree of the page, and is kept as
+a fallback for pages the streaming extractor reads differently.
+Both are called as extractor(chunks, encoding, page_url), chunks being the page's bytes in the
+order they are read from the response, and return a (page_title, page_full_text, links)
+tuple; benchmark_extractors compares them.
+"""
+
+import codecs
+from html.parser import HTMLParser
+import re
+from urllib.parse import urldefrag, urljoin
+from bs4 import BeautifulSoup
+from indexer.scraper import get_full_page_text
+
+# elements whose content is not part of the page's visible text
+HIDDEN_ELEMENTS = ('script', 'style', 'template')
+# a <meta> charset declaration is looked for in this many bytes at the start of the page
+CHARSET_SNIFF_BYTES = 1024
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+
+
+def absolute_link(page_url, href):
+    """Returns the absolute URL of a link without its fragment, None unless it is an http(s) URL"""
+    try:
+        link = urldefrag(urljoin(page_url, href.strip()))[0]
+    except ValueError:  # a malformed URL, such as an unclosed IPv6 host
+        return None
+    return link if link.startswith(('http://', 'https://')) else None
+
+
+def extract_with_soup(chunks, encoding, page_url):
+    """
+    Extracts a page's title, text and links from a BeautifulSoup tree of the whole page
+
+    chunks:   iterable of the page's bytes, joined before the page is parsed
+    encoding: character encoding of the page, detected from its content when None
+    page_url: URL the page was fetched from, links are resolved against it
+
+    returns:
+        tuple of the page's title, its text with every run of whitespace collapsed into a single
+        space, and the absolute URLs of its links without fragments, in document order
+    """
+    soup = BeautifulSoup(b''.join(chunks), 'html.parser', from_encoding=encoding)
+    for script in soup(['script', 'style']):
+        script.decompose()
+
+    page_title = soup.title.text.strip() if soup.title is not None else ''
+    links = [absolute_link(page_url, anchor['href']) for anchor in soup.find_all('a', href=True)]
+    page_full_text = get_full_page_text(soup.get_text())
+    return page_title, page_full_text, [link for link in links if link is not None]
+
+
+class StreamingExtractor(HTMLParser):
+    """
+    html.parser callbacks collecting a page's title, visible text and links as the page is fed
+    to it. Whitespace is collapsed as the text arrives, so no tree and no uncollapsed copy of
+    the text are built.
+    """
+    def __init__(self, page_url):
+        super().__init__(convert_charrefs=True)
+        self.page_url = page_url
+        self.text = []
+        self.pending_space = False  # whitespace seen since the last word emitted
+        self.title = None  # pieces of the first title's text while it is read
+        self.title_done = False
+        self.hidden = None  # hidden element being skipped
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.hidden is not None:
+            return
+        if tag in HIDDEN_ELEMENTS:
+            self.hidden = tag
+        elif tag == 'title' and not self.title_done and self.title is None:
+            self.title = []
+        elif tag == 'a':
+            # the last of repeated attributes wins, as in BeautifulSoup
+            href = dict(attrs).get('href', False)
+            if href is not False:
+                link = absolute_link(self.page_url, href or '')
+                if link is not None:
+                    self.links.append(link)
+
+    def handle_endtag(self, tag):
+        if self.hidden is not None:
+            if tag == self.hidden:
+                self.hidden = None
+        elif tag == 'title' and self.title is not None:
+            self.title_done = True
+
+    def handle_data(self, data):
+        if self.hidden is not None or not data:
+            return
+        if self.title is not None and not self.title_done:
+            self.title.append(data)
+        words = data.split()
+        if data[0].isspace():
+            self.pending_space = True
+        if words:
+            if self.pending_space and self.text:
+                self.text.append(' ')
+            self.text.append(' '.join(words))
+            self.pending_space = data[-1].isspace()
+
+    def unknown_decl(self, data):
+        # BeautifulSoup keeps the text of CDATA sections
+        if data.startswith('CDATA['):
+            self.handle_data(data[len('CDATA['):])
+
+    def result(self):
+        page_title = ''.join(self.title).strip() if self.title is not None else ''
+        return page_title, ''.join(self.text), self.links
+
+
+def sniff_encoding(body):
+    """
+    Returns the character encoding of a page served without one, read from its byte order mark
+    or a <meta> charset declaration near its start, UTF-8 otherwise
+    """
+    for bom, encoding in BOMS:
+        if body.startswith(bom):
+            return encoding
+    declared = META_CHARSET_PATTERN.search(body[:CHARSET_SNIFF_BYTES])
+    if declared is not None:
+        try:
+            return codecs.lookup(declared.group(1).decode('ascii')).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
+
+def get_decoder(encoding):
+    """Returns an incremental decoder of the encoding, of UTF-8 when the encoding is unknown"""
+    try:
+        return codecs.getincrementaldecoder(encoding)(errors='replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+def extract_streaming(chunks, encoding, page_url):
+    """
+    Extracts a page's title, text and links in one pass of html.parser callbacks, decoding and
+    feeding each chunk to the parser as it is read, so the page is never held whole
+
+    chunks:   iterable of the page's bytes
+    encoding: character encoding of the page, sniffed from its first CHARSET_SNIFF_BYTES when None
+    page_url: URL the page was fetched from, links are resolved against it
+
+    returns:
+        tuple of the page's title, its text with every run of whitespace collapsed into a single
+        space, and the absolute URLs of its links without fragments, in document order
+    """
+    parser = StreamingExtractor(page_url)
+    decoder = None if encoding is None else get_decoder(encoding)
+    head = bytearray()  # start of a page without an encoding, held back until it is sniffed
+    for chunk in chunks:
+        if decoder is None:
+            head += chunk
+            if len(head) < CHARSET_SNIFF_BYTES:
+                continue
+            decoder = get_decoder(sniff_encoding(head))
+            chunk, head = head, None
+        parser.feed(decoder.decode(chunk))
+    if decoder is None:  # the page is shorter than CHARSET_SNIFF_BYTES
+        decoder = get_decoder(sniff_encoding(head))
+        parser.feed(decoder.decode(head))
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    return parser.result()
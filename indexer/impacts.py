@@ -0,0 +1,303 @@
+"""
+Impact-ordered postings: each posting's normalized weight (the term's weight in the document
+vector divided by the document's norm, never more than 1) is precomputed and quantized
+linearly to an integer impact of INDEXER_IMPACT_BITS bits. A term's ImpactList row groups
+its postings into segments of equal impact, highest impact first, each segment holding its
+document ids delta + varint encoded. A separate directory holds every segment's impact,
+size and byte offset, so segments are decoded only when evaluation reaches them.
+
+Queries are evaluated score-at-a-time: the query terms' segments are processed in
+decreasing order of impact times quantized query weight, adding integers into per-document
+accumulators, and evaluation stops as soon as the remaining segments can no longer change
+the top offset + k. The quantization scale is fixed when the lists are rebuilt, which
+happens whenever norms are refreshed (see INDEXER_NORM_DRIFT_THRESHOLD), or with the
+build_impact_lists command; documents indexed in between are quantized with that scale.
+"""
+
+from collections import defaultdict
+import heapq
+from itertools import groupby
+from django.conf import settings
+from indexer.models import CORPUS_STATISTICS_ID, CorpusStatistics, Document, ImpactList
+from indexer.postings import decode_varints, encode_varint, iter_postings
+from indexer.retrieve import compute_idf_query_terms, get_term_idfs, rank_key, term_weight, weight_query_terms
+from indexer.shards import atomic
+from indexer.utils import batched
+
+DEFAULT_IMPACT_BITS = 8
+# impact lists are read and written in batches of this many terms
+IMPACT_BATCH_SIZE = 250
+# share of the postings above the quantization scale, clamped to the highest impact so the
+# few very large weights of tiny documents do not squeeze every other weight into low impacts
+IMPACT_CLAMPED_SHARE = 0.001
+# the termination test scans the accumulators, it runs each time the bound on what the
+# remaining segments can add has shrunk by this factor
+TERMINATION_CHECK_FACTOR = 0.75
+
+
+def impact_ordered_enabled():
+    """Returns True if the write path maintains ImpactList rows (INDEXER_IMPACT_ORDERED)"""
+    return getattr(settings, 'INDEXER_IMPACT_ORDERED', False)
+
+
+def get_impact_levels():
+    """Returns the highest impact, 2 ** INDEXER_IMPACT_BITS - 1"""
+    return 2 ** getattr(settings, 'INDEXER_IMPACT_BITS', DEFAULT_IMPACT_BITS) - 1
+
+
+def quantize(weight, scale, levels):
+    """Maps a weight to an integer impact between 1 and levels, linearly up to scale"""
+    if scale <= 0:
+        scale = 1.0  # normalized weights never exceed 1
+    return min(levels, max(1, round(weight / scale * levels)))
+
+
+def encode_impacts(impact_doc_ids):
+    """
+    Encodes a term's postings into an impact list blob and its segment directory
+
+    impact_doc_ids: dict mapping impact to an iterable of Document ids
+
+    returns:
+        tuple of the data blob, the segment directory blob and the number of postings
+    """
+    data = bytearray()
+    segments = bytearray()
+    doc_count = 0
+    for impact in sorted(impact_doc_ids, reverse=True):
+        doc_ids = sorted(impact_doc_ids[impact])
+        if not doc_ids:
+            continue
+        encode_varint(impact, segments)
+        encode_varint(len(doc_ids), segments)
+        encode_varint(len(data), segments)
+        last_doc_id = 0
+        for doc_id in doc_ids:
+            encode_varint(doc_id - last_doc_id, data)
+            last_doc_id = doc_id
+        doc_count += len(doc_ids)
+    return bytes(data), bytes(segments), doc_count
+
+
+class ImpactReader:
+    """Decoder over one term's impact list, segment by segment"""
+    def __init__(self, data, segments):
+        self.data = bytes(data)
+        directory = list(decode_varints(bytes(segments)))
+        self.impacts = directory[0::3]  # highest first
+        self.doc_counts = directory[1::3]
+        self.offsets = directory[2::3]
+
+    def iter_segment(self, segment):
+        """Decodes the Document ids of a single segment, in id order"""
+        end = self.offsets[segment + 1] if segment + 1 < len(self.offsets) else len(self.data)
+        doc_id = 0
+        for delta in decode_varints(self.data, self.offsets[segment], end):
+            doc_id += delta
+            yield doc_id
+
+    def __iter__(self):
+        for segment, impact in enumerate(self.impacts):
+            for doc_id in self.iter_segment(segment):
+                yield doc_id, impact
+
+
+def load_impact_readers(term_ids):
+    """
+    Reads the impact lists of the given terms
+
+    term_ids: iterable of TermLexicon ids
+
+    returns:
+        dict mapping TermLexicon id to an ImpactReader
+    """
+    readers = {}
+    for term_id_batch in batched(term_ids, IMPACT_BATCH_SIZE):
+        for term_id, data, segments in ImpactList.objects.filter(term_id__in=term_id_batch).values_list(
+                'term_id', 'data', 'segments'):
+            readers[term_id] = ImpactReader(data, segments)
+    return readers
+
+
+def set_impacts(impact_list, impact_doc_ids):
+    """Re-encodes an ImpactList row from a dict mapping impact to Document ids"""
+    impact_list.data, impact_list.segments, impact_list.doc_count = encode_impacts(impact_doc_ids)
+
+
+def document_impacts(scores):
+    """
+    Quantizes a document's normalized term weights with the scale of the last rebuild
+
+    scores: dict mapping TermLexicon id to the document's normalized weight of the term
+
+    returns:
+        dict mapping TermLexicon id to the document's impact for the term
+    """
+    scale = CorpusStatistics.get().impact_scale
+    levels = get_impact_levels()
+    return {term_id: quantize(score, scale, levels) for term_id, score in scores.items()}
+
+
+def update_impact_lists(doc_id, impacts):
+    """
+    Moves one document's postings to the segments of their new impacts, re-encoding the
+    ImpactList rows of its terms
+
+    doc_id:  Document id
+    impacts: dict mapping TermLexicon id to the document's new impact for the term,
+             0 to remove the document from the term's list
+
+    returns:
+        None
+    """
+    for impact_batch in batched(impacts.items(), IMPACT_BATCH_SIZE):
+        batch_impacts = dict(impact_batch)
+        impact_lists = ImpactList.objects.in_bulk(batch_impacts.keys())
+        changed_lists = []
+        new_lists = []
+        empty_term_ids = []
+        for term_id, impact in batch_impacts.items():
+            impact_list = impact_lists.get(term_id)
+            if impact_list is None:
+                if impact:
+                    impact_list = ImpactList(term_id=term_id)
+                    set_impacts(impact_list, {impact: [doc_id]})
+                    new_lists.append(impact_list)
+                continue
+
+            impact_doc_ids = defaultdict(list)
+            for posting_doc_id, posting_impact in ImpactReader(impact_list.data, impact_list.segments):
+                if posting_doc_id != doc_id:
+                    impact_doc_ids[posting_impact].append(posting_doc_id)
+            if impact:
+                impact_doc_ids[impact].append(doc_id)
+            set_impacts(impact_list, impact_doc_ids)
+            if impact_list.doc_count:
+                changed_lists.append(impact_list)
+            else:
+                empty_term_ids.append(term_id)
+
+        ImpactList.objects.bulk_create(new_lists)
+        ImpactList.objects.bulk_update(changed_lists, ['data', 'segments', 'doc_count'])
+        ImpactList.objects.filter(term_id__in=empty_term_ids).delete()
+
+
+@atomic
+def rebuild_impact_lists():
+    """
+    Requantizes every posting with the current IDF statistics and document norms and
+    rebuilds every ImpactList row, in three passes over the postings (see
+    indexer.postings.iter_postings): the first two count them and pick the quantization
+    scale, the third groups each term's postings by impact
+
+    returns:
+        int: number of impact lists written
+    """
+    levels = get_impact_levels()
+    ImpactList.objects.all().delete()
+    # the global IDF of a sharded index, the scale its norms and rankings are on
+    term_idfs = get_term_idfs()
+    # documents without a norm are never ranked
+    norms = dict(Document.objects.filter(norm__gt=0).values_list('id', 'norm').iterator())
+
+    def normalized_weights():
+        for term_id, doc_id, frequency in iter_postings():
+            if doc_id in norms:
+                yield term_id, doc_id, term_weight(frequency, term_idfs[term_id]) / norms[doc_id]
+
+    posting_count = sum(1 for _ in normalized_weights())
+    clamped_weights = heapq.nlargest(
+        int(posting_count * IMPACT_CLAMPED_SHARE) + 1, (weight for _, _, weight in normalized_weights()))
+    scale = clamped_weights[-1] if clamped_weights else 0.0
+
+    impact_lists = []
+    written = 0
+    for term_id, term_postings in groupby(normalized_weights(), key=lambda posting: posting[0]):
+        impact_doc_ids = defaultdict(list)
+        for _, doc_id, weight in term_postings:
+            impact_doc_ids[quantize(weight, scale, levels)].append(doc_id)
+        impact_list = ImpactList(term_id=term_id)
+        set_impacts(impact_list, impact_doc_ids)
+        impact_lists.append(impact_list)
+        if len(impact_lists) == IMPACT_BATCH_SIZE:
+            ImpactList.objects.bulk_create(impact_lists)
+            written += len(impact_lists)
+            impact_lists = []
+    ImpactList.objects.bulk_create(impact_lists)
+
+    CorpusStatistics.get()
+    CorpusStatistics.objects.filter(pk=CORPUS_STATISTICS_ID).update(impact_scale=scale)
+    return written + len(impact_lists)
+
+
+def rank_impacts(query_term_frequency_map, k=None, offset=0):
+    """
+    Retrieval engine evaluating the impact lists score-at-a-time, see
+    indexer.retrieve.rank_in_database for the arguments. Documents are ranked by the sum of
+    their quantized impacts times the quantized query term weights.
+
+    Segments are processed from the largest product to the smallest while new documents
+    may still enter the top offset + k. Once the k-th best accumulator beats the next one
+    by more than the remaining segments could add, only the accumulators of the top
+    documents are updated, and evaluation stops once their order is settled as well.
+    """
+    idf_terms, term_ids, _ = compute_idf_query_terms(query_term_frequency_map.keys())
+    tf_idf_query = weight_query_terms(query_term_frequency_map, idf_terms)
+    readers = load_impact_readers(term_ids.values())
+    if not readers:
+        return ()
+
+    levels = get_impact_levels()
+    top_query_weight = max(tf_idf_query[term] for term in term_ids)
+    segments = []
+    products_by_term = {}
+    for term, term_id in term_ids.items():
+        reader = readers.get(term_id)
+        if reader is None:
+            continue
+        query_impact = quantize(tf_idf_query[term], top_query_weight, levels)
+        products_by_term[term_id] = [query_impact * impact for impact in reader.impacts]
+        segments.extend((product, term_id, segment) for segment, product in enumerate(products_by_term[term_id]))
+    # the sort is stable, so each term's segments stay in decreasing impact order
+    segments.sort(key=lambda segment: -segment[0])
+
+    depth = None if k is None else offset + k
+    positions = dict.fromkeys(products_by_term, 0)
+    remaining_bound = sum(products[0] for products in products_by_term.values())
+    next_check = remaining_bound
+    scores = {}
+    refining = False
+    for product, term_id, segment in segments:
+        positions[term_id] += 1
+        term_products = products_by_term[term_id]
+        remaining_bound += (term_products[positions[term_id]] if positions[term_id] < len(term_products) else 0) \
+            - product
+
+        doc_ids = readers[term_id].iter_segment(segment)
+        if refining:
+            for doc_id in doc_ids:
+                if doc_id in scores:
+                    scores[doc_id] += product
+        else:
+            for doc_id in doc_ids:
+                scores[doc_id] = scores.get(doc_id, 0) + product
+
+        if depth is None or remaining_bound > next_check or remaining_bound == 0:
+            continue
+        next_check = remaining_bound * TERMINATION_CHECK_FACTOR
+        ranked = heapq.nsmallest(depth + 1, scores.items(), key=rank_key)
+        if not refining:
+            if len(ranked) < depth:
+                continue
+            # documents outside the top depth, seen or not, score at most this
+            outside_bound = (ranked[depth][1] if len(ranked) > depth else 0) + remaining_bound
+            if ranked[depth - 1][1] <= outside_bound:
+                continue
+            refining = True
+            scores = dict(ranked[:depth])
+        ranked = ranked[:depth]
+        if all(ranked[i][1] - ranked[i + 1][1] > remaining_bound for i in range(len(ranked) - 1)):
+            break
+
+    ranked = sorted(scores.items(), key=rank_key)
+    return tuple(doc_id for doc_id, _ in ranked[offset:depth])
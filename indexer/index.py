@@ -1,26 +1,35 @@
 """This module handles indexing documents"""
 
-from indexer.models import Document, DocumentLexicon, TermLexicon
-from indexer.utils import is_alpha, is_stopword, stem
+from collections import defaultdict
+import math
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest
+from indexer.champions import champion_lists_enabled, rebuild_champion_lists, update_champion_lists
+from indexer.impacts import document_impacts, impact_ordered_enabled, rebuild_impact_lists, update_impact_lists
+from indexer.models import CorpusStatistics, Document, DocumentLexicon, TermLexicon
+from indexer.postings import compressed_postings_enabled, iter_postings, read_document_terms, update_postings_lists
+from indexer.retrieve import get_global_statistics, get_term_idfs, get_total_documents, idf, term_weight
+from indexer.segments import add_document, delete_document, segments_enabled
+from indexer.shards import atomic, get_current_database, get_shard_aliases, map_shards, shard_for_url, use_shard
+from indexer.utils import batched, fingerprint, get_analyzer
+
+# SQLite caps the number of parameters bound to a single statement,
+# so set-based statements over terms are issued in batches of this size
+TERM_BATCH_SIZE = 250
+DEFAULT_NORM_DRIFT_THRESHOLD = 0.1
 
 class ParsedDocument:
     """
-    This class normalizes a set of input words and sums their frequencies
+    This class normalizes a set of input words and sums their frequencies.
+    The input words may be any iterable, e.g. a generator of tokens from indexer.utils.tokenize
     """
     def __process_word_list(self, word_list):
-        # processing wordFreqMap and wordList separately would require iterating twice
-        # so let's do it in the same loop
-        term_frequency_map = {}
-        processed_word_list = []
-        for word in word_list:
-            word = word.lower()
-            if is_alpha(word) and not is_stopword(word):
-                stemmed_word = stem(word)
-                if stemmed_word not in term_frequency_map.keys():
-                    term_frequency_map[stemmed_word] = 1
-                    processed_word_list.append(stemmed_word)
-                else:
-                    term_frequency_map[stemmed_word] += 1
+        # the analyzer builds the frequency map in a single pass, its keys are the
+        # unique terms in order of first occurrence
+        term_frequency_map = get_analyzer().analyze(word_list)
+        processed_word_list = list(term_frequency_map.keys())
 
         return processed_word_list, term_frequency_map
 
@@ -31,10 +40,313 @@ class ParsedDocument:
     def __init__(self, input_words):
         self.words, self.term_frequency_map = self.__process_word_list(input_words)
 
+def get_compressed_postings(doc):
+    """
+    Reads a document's postings from its DocumentTermList row, with their terms' TermLexicon fields
+
+    doc: Document object
+
+    returns:
+        list of (TermLexicon id, term, frequency, document frequency) tuples
+    """
+    term_frequencies = read_document_terms([doc.pk]).get(doc.pk, {})
+    postings = []
+    for term_id_batch in batched(list(term_frequencies), TERM_BATCH_SIZE):
+        terms = TermLexicon.objects.filter(pk__in=term_id_batch).values_list('id', 'term', 'document_frequency')
+        postings.extend((term_id, term, term_frequencies[term_id], N_t) for term_id, term, N_t in terms)
+    return postings
+
+
+def get_indexed_postings(doc):
+    """
+    Reads the postings currently stored for a document
+
+    doc: Document object
+
+    returns:
+        dict mapping term to a tuple of (DocumentLexicon id, TermLexicon id, frequency), the
+        DocumentLexicon id is None when compressed postings replace the DocumentLexicon table
+    """
+    if compressed_postings_enabled():
+        return {term: (None, term_id, frequency) for term_id, term, frequency, _ in get_compressed_postings(doc)}
+    postings = DocumentLexicon.objects.filter(context=doc).values_list(
+        'term__term', 'id', 'term_id', 'frequency')
+    return {term: (posting_id, term_id, frequency)
+            for term, posting_id, term_id, frequency in postings}
+
+
+def resolve_term_ids(terms):
+    """
+    Looks up the TermLexicon ids of a collection of terms with term__in queries
+
+    terms: list of term strings
+
+    returns:
+        dict mapping each term present in the TermLexicon to its id
+    """
+    term_ids = {}
+    for term_batch in batched(terms, TERM_BATCH_SIZE):
+        term_ids.update(TermLexicon.objects.filter(term__in=term_batch).values_list('term', 'id'))
+    return term_ids
+
+
+def adjust_term_frequencies(frequency_deltas, document_frequency_delta):
+    """
+    Adds per-term deltas to TermLexicon frequencies with set-based UPDATE statements
+
+    frequency_deltas:         dict mapping TermLexicon id to the change in its corpus frequency
+    document_frequency_delta: change applied to the document frequency of every term, or a dict
+                              mapping TermLexicon id to the change in its document frequency
+
+    returns:
+        None
+    """
+    for delta_batch in batched(frequency_deltas.items(), TERM_BATCH_SIZE):
+        frequency_delta = Case(
+            *[When(pk=term_id, then=Value(delta)) for term_id, delta in delta_batch],
+            output_field=IntegerField())
+        if isinstance(document_frequency_delta, dict):
+            term_document_frequency_delta = Case(
+                *[When(pk=term_id, then=Value(document_frequency_delta[term_id])) for term_id, _ in delta_batch],
+                output_field=IntegerField())
+        else:
+            term_document_frequency_delta = document_frequency_delta
+        TermLexicon.objects.filter(pk__in=[term_id for term_id, _ in delta_batch]).update(
+            frequency=F('frequency') + frequency_delta,
+            document_frequency=F('document_frequency') + term_document_frequency_delta)
+
+
+def insert_postings(doc, term_frequency_map):
+    """
+    Adds postings for terms the document has no posting for yet, creating missing terms
+    and incrementing the frequencies of existing ones
+
+    doc:                Document object the postings belong to
+    term_frequency_map: dict mapping term to its frequency within the document
+
+    returns:
+        None
+    """
+    if not term_frequency_map:
+        return
+
+    term_ids = resolve_term_ids(list(term_frequency_map.keys()))
+    adjust_term_frequencies(
+        {term_ids[term]: term_frequency_map[term] for term in term_ids}, 1)
+
+    new_terms = [term for term in term_frequency_map if term not in term_ids]
+    TermLexicon.validate_terms(new_terms)
+    TermLexicon.objects.bulk_create(
+        [TermLexicon(term=term, frequency=term_frequency_map[term], document_frequency=1, max_score=0.0)
+         for term in new_terms],
+        batch_size=TERM_BATCH_SIZE)
+    term_ids.update(resolve_term_ids(new_terms))
+
+    if compressed_postings_enabled():
+        update_postings_lists(
+            doc.pk, {term_ids[term]: frequency for term, frequency in term_frequency_map.items()})
+    else:
+        DocumentLexicon.objects.bulk_create(
+            [DocumentLexicon(context=doc, term_id=term_ids[term], frequency=frequency)
+             for term, frequency in term_frequency_map.items()],
+            batch_size=TERM_BATCH_SIZE)
+
+
+def delete_postings(doc, postings):
+    """
+    Deletes postings and subtracts their frequencies from the TermLexicon
+
+    doc:      Document object the postings belong to
+    postings: dict mapping term to a tuple of (DocumentLexicon id, TermLexicon id, frequency)
+
+    returns:
+        None
+    """
+    adjust_term_frequencies(
+        {term_id: -frequency for _, term_id, frequency in postings.values()}, -1)
+    if compressed_postings_enabled():
+        update_postings_lists(doc.pk, {term_id: 0 for _, term_id, _ in postings.values()})
+    else:
+        for posting_batch in batched(postings.values(), TERM_BATCH_SIZE):
+            DocumentLexicon.objects.filter(
+                pk__in=[posting_id for posting_id, _, _ in posting_batch]).delete()
+    if impact_ordered_enabled():
+        update_impact_lists(doc.pk, {term_id: 0 for _, term_id, _ in postings.values()})
+
+
+def update_postings(doc, postings, term_frequency_map):
+    """
+    Overwrites the frequencies of existing postings and applies the difference to the TermLexicon
+
+    doc:                Document object the postings belong to
+    postings:           dict mapping term to a tuple of (DocumentLexicon id, TermLexicon id, frequency)
+    term_frequency_map: dict mapping each term in postings to its new frequency within the document
+
+    returns:
+        None
+    """
+    adjust_term_frequencies(
+        {term_id: term_frequency_map[term] - frequency
+         for term, (_, term_id, frequency) in postings.items()}, 0)
+    if compressed_postings_enabled():
+        update_postings_lists(
+            doc.pk, {term_id: term_frequency_map[term] for term, (_, term_id, _) in postings.items()})
+        return
+    for posting_batch in batched(postings.items(), TERM_BATCH_SIZE):
+        new_frequency = Case(
+            *[When(pk=posting_id, then=Value(term_frequency_map[term]))
+              for term, (posting_id, _, _) in posting_batch],
+            output_field=IntegerField())
+        DocumentLexicon.objects.filter(
+            pk__in=[posting_id for _, (posting_id, _, _) in posting_batch]).update(
+                frequency=new_frequency)
+
+
+def get_document_weights(doc):
+    """
+    Computes a document's tf-idf vector from its postings and the current IDF statistics,
+    global ones when the index is sharded
+
+    doc: Document object
+
+    returns:
+        dict mapping TermLexicon id to a tuple of the term's tf-idf weight in the document and its idf
+    """
+    if compressed_postings_enabled():
+        postings = get_compressed_postings(doc)
+    else:
+        postings = DocumentLexicon.objects.filter(context=doc).values_list(
+            'term_id', 'term__term', 'frequency', 'term__document_frequency')
+    if get_shard_aliases():
+        postings = list(postings)
+        N, document_frequencies = get_global_statistics(term for _, term, _, _ in postings)
+        postings = [(term_id, term, frequency, document_frequencies[term])
+                    for term_id, term, frequency, _ in postings]
+    else:
+        N = get_total_documents()
+
+    weights = {}
+    for term_id, _, frequency, N_t in postings:
+        term_idf = idf(N, N_t)
+        weights[term_id] = (term_weight(frequency, term_idf), term_idf)
+    return weights
+
+
+def compute_document_norm(doc):
+    """
+    Computes the length of a document's tf-idf vector
+
+    doc: Document object
+
+    returns:
+        float: the document's norm
+    """
+    return math.sqrt(sum(weight ** 2 for weight, _ in get_document_weights(doc).values()))
+
+
+def raise_term_max_scores(max_scores):
+    """
+    Raises each term's max_score to the given value if it is higher
+
+    max_scores: dict mapping TermLexicon id to the term's log(1.2 + tf) / norm in a document, its
+                normalized weight without idf
+
+    returns:
+        None
+    """
+    for score_batch in batched(max_scores.items(), TERM_BATCH_SIZE):
+        max_score = Case(
+            *[When(pk=term_id, then=Value(score)) for term_id, score in score_batch],
+            output_field=FloatField())
+        TermLexicon.objects.filter(pk__in=[term_id for term_id, _ in score_batch]).update(
+            max_score=Greatest(F('max_score'), max_score))
+
+
+@atomic
+def refresh_document_norms():
+    """
+    Recomputes every document's norm and every term's max_score with the current IDF
+    statistics (global ones when the index is sharded) in two passes over the postings,
+    rebuilds the champion and impact lists when they are maintained, and resets the drift counter
+
+    returns:
+        None
+    """
+    term_idfs = get_term_idfs()
+
+    squared_norms = defaultdict(float)
+    for term_id, doc_id, frequency in iter_postings():
+        squared_norms[doc_id] += term_weight(frequency, term_idfs[term_id]) ** 2
+    norms = {doc_id: math.sqrt(squared_norm) for doc_id, squared_norm in squared_norms.items()}
+
+    # max_score leaves idf out, retrieval multiplies it by the idf the query is weighted with
+    max_scores = defaultdict(float)
+    for term_id, doc_id, frequency in iter_postings():
+        if norms[doc_id] > 0:
+            max_scores[term_id] = max(max_scores[term_id], term_weight(frequency, 1.0) / norms[doc_id])
+
+    for norm_batch in batched(norms.items(), TERM_BATCH_SIZE):
+        norm = Case(
+            *[When(pk=doc_id, then=Value(doc_norm)) for doc_id, doc_norm in norm_batch],
+            output_field=FloatField())
+        Document.objects.filter(pk__in=[doc_id for doc_id, _ in norm_batch]).update(norm=norm)
+    TermLexicon.objects.update(max_score=0.0)
+    raise_term_max_scores(max_scores)
+    if champion_lists_enabled():
+        rebuild_champion_lists()
+    if impact_ordered_enabled():
+        rebuild_impact_lists()
+    CorpusStatistics.objects.update(changed_document_count=0, generation=F('generation') + 1)
+
+
+def update_document_norm(doc):
+    """
+    Stores a freshly (re)indexed document's norm and raises its terms' max_score.
+    Norms of other documents depend on IDF statistics that drift as the corpus changes,
+    so all of them are recomputed once the share of the corpus changed since the last
+    refresh crosses INDEXER_NORM_DRIFT_THRESHOLD.
+
+    doc: Document object
+
+    returns:
+        None
+    """
+    weights = get_document_weights(doc)
+    doc.norm = math.sqrt(sum(weight ** 2 for weight, _ in weights.values()))
+    Document.objects.filter(pk=doc.pk).update(norm=doc.norm)
+    scores = {term_id: weight / doc.norm for term_id, (weight, _) in weights.items()} if doc.norm > 0 else {}
+    raise_term_max_scores({term_id: score / weights[term_id][1] for term_id, score in scores.items()})
+    if champion_lists_enabled():
+        update_champion_lists(doc.pk, scores)
+    if impact_ordered_enabled():
+        update_impact_lists(doc.pk, document_impacts(scores))
+
+    record_index_change(1)
+
+
+def record_index_change(changed_document_count, **deltas):
+    """
+    Records that documents were (re)indexed or deleted: bumps the index generation and
+    refreshes all norms once the share of the corpus changed since the last refresh
+    crosses INDEXER_NORM_DRIFT_THRESHOLD
+
+    changed_document_count: number of documents (re)indexed or deleted
+    deltas:                 other CorpusStatistics changes applied in the same UPDATE
+
+    returns:
+        None
+    """
+    CorpusStatistics.adjust(changed_document_count=changed_document_count, generation=1, **deltas)
+    stats = CorpusStatistics.get()
+    threshold = getattr(settings, 'INDEXER_NORM_DRIFT_THRESHOLD', DEFAULT_NORM_DRIFT_THRESHOLD)
+    if stats.changed_document_count > threshold * stats.document_count:
+        refresh_document_norms()
+
+
+@atomic
 def cleanup_indexed_document(index_params):
     '''
-    Deletes DocumentLexicon entries and adjusts TermLexicon frequencies for an existing Document
-    before it is reindexed.
+    Deletes the postings and adjusts TermLexicon frequencies for an existing Document.
 
     indexParams: a map containing parameters for indexing
         parsedDocument:  ParsedDocument object containing stemmed word frequencies
@@ -46,20 +358,19 @@ def cleanup_indexed_document(index_params):
         None
     '''
     doc = index_params['documentContext']
-
-    old_doc_terms = DocumentLexicon.objects.filter(context=doc)
-    # Substract doc-term frequencies from corresponding TermLexicon entry
-    for old_doc_term in old_doc_terms:
-        term_lexicon_term = old_doc_term.term
-        term_lexicon_term.frequency -= old_doc_term.frequency
-        term_lexicon_term.save()
-        old_doc_term.delete()
+    delete_postings(doc, get_indexed_postings(doc))
+    update_document_norm(doc)
 
 
+@atomic
 def index_document(index_params):
     '''
     Indexes a document that has not previously been indexed.
 
+    All writes happen in a single transaction: terms are resolved with term__in queries,
+    missing terms are bulk inserted, existing terms' frequencies are updated with set-based
+    statements and the document's postings are bulk inserted.
+
     indexParams: a map containing parameters for indexing
         parsedDocument:  ParsedDocument object containing stemmed word frequencies
         documentContext: Document object initialized with page URL
@@ -72,60 +383,251 @@ def index_document(index_params):
     doc = index_params['documentContext']
     p_doc = index_params['parsedDocument']
 
-    for doc_term, parsed_frequency in p_doc.term_frequency_map.items():
-        try:
-            term_lexicon_term = TermLexicon.objects.get(term=doc_term)
-            term_lexicon_term.frequency += parsed_frequency
-            term_lexicon_term.save()
-        except TermLexicon.DoesNotExist:
-            term_lexicon_term = TermLexicon.objects.create(
-                term=doc_term, frequency=parsed_frequency)
-
-        try:
-            doc_lexicon_term = DocumentLexicon.objects.get(
-                context=doc, term=term_lexicon_term)
+    for term in get_indexed_postings(doc):
+        if term in p_doc.term_frequency_map:
             raise RuntimeError(
                 f"""
-                Found a duplicate term {doc_lexicon_term.id}
-                in DocumentLexicon that shouldn't be there
+                Found a duplicate term {term}
+                in the document's postings that shouldn't be there
                 """)
-        except DocumentLexicon.DoesNotExist:
-            doc_lexicon_term = DocumentLexicon.objects.create(
-                context=doc, term=term_lexicon_term, frequency=parsed_frequency)
 
+    insert_postings(doc, p_doc.term_frequency_map)
+    update_document_norm(doc)
+
+
+@atomic
+def reindex_document(index_params):
+    '''
+    Reindexes a previously indexed document by diffing its stored postings against
+    its new term frequencies. Only postings of terms that were added, removed or whose
+    frequency changed are written; unchanged terms cost nothing.
+
+    indexParams: a map containing parameters for indexing
+        parsedDocument:  ParsedDocument object containing stemmed word frequencies
+        documentContext: Document object initialized with page URL
+        pageURL:         String corresponding to indexed document's URL
+        pageFullText:    String of document's full text
 
-def index(word_list, page_title, page_url, page_full_text):
+    returns:
+        None
+    '''
+    doc = index_params['documentContext']
+    term_frequency_map = index_params['parsedDocument'].term_frequency_map
+
+    old_postings = get_indexed_postings(doc)
+    removed_postings = {
+        term: posting for term, posting in old_postings.items()
+        if term not in term_frequency_map}
+    changed_postings = {
+        term: posting for term, posting in old_postings.items()
+        if term in term_frequency_map and term_frequency_map[term] != posting[2]}
+    added_terms = {
+        term: frequency for term, frequency in term_frequency_map.items()
+        if term not in old_postings}
+
+    if not (removed_postings or changed_postings or added_terms):
+        return
+
+    delete_postings(doc, removed_postings)
+    update_postings(doc, changed_postings, term_frequency_map)
+    insert_postings(doc, added_terms)
+    update_document_norm(doc)
+
+
+@atomic
+def delete_indexed_documents(urls):
     """
-    Wrapper function for indexing a document
+    Deletes documents and their postings from the current database with set-based statements.
+    The postings' frequencies are subtracted from the TermLexicon in one aggregate pass, and
+    the corpus statistics are adjusted.
+
+    urls: list of URLs of the documents to delete
 
-    word_list:      a list containing words to be indexed
+    returns:
+        int: number of documents deleted
+    """
+    doc_ids = []
+    for url_batch in batched(urls, TERM_BATCH_SIZE):
+        doc_ids.extend(Document.objects.filter(url__in=url_batch).values_list('pk', flat=True))
+    if not doc_ids:
+        return 0
+
+    frequency_deltas = {}
+    document_frequency_deltas = {}
+    removed_postings = defaultdict(dict)
+    for doc_id_batch in batched(doc_ids, TERM_BATCH_SIZE):
+        if compressed_postings_enabled():
+            for doc_id, term_frequencies in read_document_terms(doc_id_batch).items():
+                for term_id, frequency in term_frequencies.items():
+                    frequency_deltas[term_id] = frequency_deltas.get(term_id, 0) - frequency
+                    document_frequency_deltas[term_id] = document_frequency_deltas.get(term_id, 0) - 1
+                    removed_postings[doc_id][term_id] = 0
+            continue
+        postings = DocumentLexicon.objects.filter(context_id__in=doc_id_batch)
+        term_totals = postings.values('term_id').annotate(
+            total_frequency=Sum('frequency'), total_documents=Count('id'))
+        for term_total in term_totals:
+            term_id = term_total['term_id']
+            frequency_deltas[term_id] = frequency_deltas.get(term_id, 0) - term_total['total_frequency']
+            document_frequency_deltas[term_id] = \
+                document_frequency_deltas.get(term_id, 0) - term_total['total_documents']
+        if compressed_postings_enabled() or impact_ordered_enabled():
+            for doc_id, term_id in postings.values_list('context_id', 'term_id'):
+                removed_postings[doc_id][term_id] = 0
+        postings.delete()
+
+    adjust_term_frequencies(frequency_deltas, document_frequency_deltas)
+    for doc_id, term_frequencies in removed_postings.items():
+        if compressed_postings_enabled():
+            update_postings_lists(doc_id, term_frequencies)
+        if impact_ordered_enabled():
+            update_impact_lists(doc_id, term_frequencies)
+    for doc_id_batch in batched(doc_ids, TERM_BATCH_SIZE):
+        Document.objects.filter(pk__in=doc_id_batch).delete()
+
+    if segments_enabled():
+        for doc_id in doc_ids:
+            transaction.on_commit(lambda doc_id=doc_id: delete_document(doc_id), using=get_current_database())
+    # the deleted documents' max_score contributions are left in place, they remain upper bounds
+    record_index_change(len(doc_ids), document_count=-len(doc_ids))
+    return len(doc_ids)
+
+
+def delete_documents(urls):
+    """
+    Wrapper function for deleting documents by URL, from the shards their URLs belong to
+    when the index is sharded
+
+    urls: iterable of URLs of the documents to delete
+
+    returns:
+        int: number of documents deleted
+    """
+    urls_by_shard = defaultdict(list)
+    for url in urls:
+        urls_by_shard[shard_for_url(url)].append(url)
+
+    deleted = 0
+    for alias, shard_urls in urls_by_shard.items():
+        with use_shard(alias):
+            deleted += delete_indexed_documents(shard_urls)
+    return deleted
+
+
+def vacuum_lexicon():
+    """
+    Purges TermLexicon rows no document contains any more, then rebuilds SQLite databases
+    with VACUUM to return the space freed by deletions to the file system
+
+    returns:
+        int: number of terms purged
+    """
+    def vacuum_database(alias):
+        with transaction.atomic(using=get_current_database()):
+            purged, _ = TermLexicon.objects.filter(frequency__lte=0, document_frequency__lte=0).delete()
+        connection = connections[get_current_database()]
+        # VACUUM cannot run inside a transaction
+        if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+        return purged
+
+    return sum(map_shards(vacuum_database))
+
+
+def get_document_validators(page_url):
+    """
+    Reads the HTTP validators stored with a page's Document, to make its next scrape conditional
+
+    page_url: URL of the page/document
+
+    returns:
+        tuple of the page's etag and last_modified, empty strings when the page is not indexed
+        or its row is locked by a batch being written, the page is then fetched unconditionally
+    """
+    try:
+        with use_shard(shard_for_url(page_url)):
+            validators = Document.objects.filter(url=page_url).values_list('etag', 'last_modified').first()
+    except DatabaseError:
+        validators = None
+    return validators or ('', '')
+
+
+def index(word_list, page_title, page_url, page_full_text, etag='', last_modified=''):
+    """
+    Wrapper function for indexing a document, in the shard its URL belongs to when the
+    index is sharded (see indexer.shards)
+
+    word_list:      an iterable of words to be indexed, consumed at most once
     page_title:     title of the page/document to be indexed
     page_url:       URL of the page/document to be indexed
     page_full_text: full text of page/document to be indexed
+    etag:           ETag header returned with the page, if any
+    last_modified:  Last-Modified header returned with the page, if any
 
     returns:
-        None
+        bool: False if the page's text is unchanged since it was last indexed and
+              indexing was skipped, True otherwise
+    """
+    with use_shard(shard_for_url(page_url)):
+        return index_page(word_list, page_title, page_url, page_full_text, etag, last_modified)
+
+
+@atomic
+def index_page(word_list, page_title, page_url, page_full_text, etag, last_modified, parsed_document=None):
+    """
+    Indexes a document in the current database, see index. parsed_document is the
+    ParsedDocument of word_list when the caller analyzed the page already.
     """
-    p_doc = ParsedDocument(word_list)
+    content_hash = fingerprint(page_full_text)
     try:
-        doc = Document.objects.get(url=page_url)
+        doc = Document.objects.defer('text').get(url=page_url)
+        doc_is_indexed = True
+    except Document.DoesNotExist:
+        doc = None
+        doc_is_indexed = False
+
+    if doc_is_indexed and doc.content_hash == content_hash:
+        # the postings are up to date, only refresh the cheap per-document fields
+        if (doc.title, doc.etag, doc.last_modified) != (page_title, etag, last_modified):
+            doc.title = page_title
+            doc.etag = etag
+            doc.last_modified = last_modified
+            doc.save(update_fields=['title', 'etag', 'last_modified'])
+        return False
+
+    if doc_is_indexed:
         doc.title = page_title
         doc.text = page_full_text
+        doc.content_hash = content_hash
+        doc.etag = etag
+        doc.last_modified = last_modified
         doc.save()
-        doc_cleanup_needed = True
-    except Document.DoesNotExist:
-        doc = Document.objects.create(url=page_url, title=page_title, text=page_full_text)
-        doc_cleanup_needed = False
+    else:
+        doc = Document.objects.create(
+            url=page_url, title=page_title, text=page_full_text,
+            content_hash=content_hash, etag=etag, last_modified=last_modified)
 
     index_params = {
-        'parsedDocument': p_doc,
+        'parsedDocument': parsed_document or ParsedDocument(word_list),
         'documentContext': doc,
     }
 
-    if doc_cleanup_needed:
-        cleanup_indexed_document(index_params)
+    if segments_enabled():
+        # the document goes to the current segment batch once its row is committed,
+        # global term statistics are left untouched
+        term_frequency_map = index_params['parsedDocument'].term_frequency_map
+        transaction.on_commit(
+            lambda: add_document(doc.pk, term_frequency_map, replaces=doc_is_indexed),
+            using=get_current_database())
+        return True
+
+    if doc_is_indexed:
+        reindex_document(index_params)
+    else:
+        index_document(index_params)
 
-    index_document(index_params)
+    return True
 
 
 
@@ -139,5 +641,6 @@ def index(word_list, page_title, page_url, page_full_text):
 # 4. Check the TermLexicon for term's existence
 # 5a. If term hasn't been added, created an entry and set its frequency to the document frequency
 # 5b. If a term has been previously added, add its document frequency to its overall frequency
-# 5c. If document is being updated, subtract each term's existing doc frequency from corresponding
-# overall doc frequency, update doc-term freq, add updated doc-term frequency to overall
+# 5c. If document is being updated, diff its stored doc-term frequencies against the new ones:
+# delete postings of removed terms, update changed doc-term freqs and apply each difference to the
+# overall freq, then index the added terms as in 5a/5b
@@ -0,0 +1,232 @@
+"""
+Background indexing queue: IndexDocumentView only records an IndexJob row for the submitted
+URL, and the run_index_workers command scrapes and indexes queued jobs in worker threads.
+A job is claimed with a conditional UPDATE, so any number of workers and processes can drain
+the same queue. Failed attempts are retried with exponential backoff, starting at
+INDEXER_JOB_RETRY_DELAY seconds and capped at INDEXER_JOB_MAX_RETRY_DELAY, until
+INDEXER_JOB_MAX_ATTEMPTS attempts have been made; a job left running for longer than
+INDEXER_JOB_LEASE seconds, by a worker that died, is claimed again.
+"""
+
+from datetime import timedelta
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from django.utils import timezone
+from indexer.index import get_document_validators, index
+from indexer.models import IndexJob
+from indexer.scraper import NOT_MODIFIED, scrape
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 30
+DEFAULT_MAX_RETRY_DELAY = 3600
+DEFAULT_JOB_LEASE = 600
+# responses worth another attempt later, other error statuses fail the job right away
+RETRYABLE_STATUS_CODES = {408, 425, 429}
+# errors indexing a page raises for the page itself, such as a missing title, so another
+# attempt would raise them again and the job fails right away
+NON_RETRYABLE_ERRORS = (ValidationError, ValueError)
+
+# SQLite fails a transaction that finds another writer ahead of it rather than waiting, so a
+# process's workers scrape concurrently but take turns writing to the database, an
+# indexer.writer.IndexWriter committing their pages takes the same lock
+write_lock = threading.Lock()
+
+
+def get_max_attempts():
+    return getattr(settings, 'INDEXER_JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+
+
+def get_job_lease():
+    return timedelta(seconds=getattr(settings, 'INDEXER_JOB_LEASE', DEFAULT_JOB_LEASE))
+
+
+def retry_delay(attempts):
+    """Returns the backoff in seconds before a job that failed its attempts-th attempt is retried"""
+    delay = getattr(settings, 'INDEXER_JOB_RETRY_DELAY', DEFAULT_RETRY_DELAY) * 2 ** (attempts - 1)
+    return min(delay, getattr(settings, 'INDEXER_JOB_MAX_RETRY_DELAY', DEFAULT_MAX_RETRY_DELAY))
+
+
+def is_retryable(status_code):
+    """Returns True if a failed scrape is worth retrying, None standing for a connection error"""
+    return status_code is None or status_code >= 500 or status_code in RETRYABLE_STATUS_CODES
+
+
+def enqueue_index_job(url):
+    """
+    Queues a URL for indexing, a URL already waiting in the queue is not queued twice
+
+    url: url of page to index
+
+    returns:
+        the URL's IndexJob
+    """
+    job = IndexJob.objects.filter(url=url, status=IndexJob.QUEUED).order_by('id').first()
+    if job is None:
+        job = IndexJob(url=url)
+        job.full_clean()
+        job.save()
+    return job
+
+
+def claim_index_job():
+    """
+    Marks the next job due to run as running, unless another worker claims it first
+
+    returns:
+        the claimed IndexJob with its attempts incremented, None when no job is due
+    """
+    while True:
+        now = timezone.now()
+        due = Q(status=IndexJob.QUEUED, run_after__lte=now) | \
+            Q(status=IndexJob.RUNNING, claimed_at__lt=now - get_job_lease())
+        job = IndexJob.objects.filter(due).order_by('run_after', 'id').first()
+        if job is None:
+            return None
+        # only one worker's UPDATE matches the job's status and attempts as they were read
+        with write_lock:
+            claimed = IndexJob.objects.filter(pk=job.pk, status=job.status, attempts=job.attempts).update(
+                status=IndexJob.RUNNING, claimed_at=now, attempts=F('attempts') + 1, updated_at=now)
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def finish_index_job(job, **fields):
+    """Records the outcome of a job's attempt, unless its lease expired and another worker took it over"""
+    fields['updated_at'] = timezone.now()
+    with write_lock:
+        IndexJob.objects.filter(pk=job.pk, status=IndexJob.RUNNING, claimed_at=job.claimed_at).update(**fields)
+    for field, value in fields.items():
+        setattr(job, field, value)
+
+
+def fail_index_job(job, status_code, error, retryable=True):
+    """Queues the job again after its backoff, or fails it once its attempts are used up"""
+    if retryable and job.attempts < get_max_attempts():
+        finish_index_job(job, status=IndexJob.QUEUED, status_code=status_code, last_error=error,
+                         run_after=timezone.now() + timedelta(seconds=retry_delay(job.attempts)))
+    else:
+        finish_index_job(job, status=IndexJob.FAILED, status_code=status_code, last_error=error)
+
+
+def record_indexed_page(job, status_code, outcome):
+    """Finishes a job with index's result for its page, or fails it if indexing raised an exception"""
+    if isinstance(outcome, Exception):
+        fail_index_job(job, status_code, f'{type(outcome).__name__}: {outcome}',
+                       retryable=not isinstance(outcome, NON_RETRYABLE_ERRORS))
+    else:
+        finish_index_job(job, status=IndexJob.DONE, status_code=status_code, page_was_indexed=outcome,
+                         last_error='')
+
+
+def run_index_job(job, writer=None, report=None):
+    """
+    Scrapes and indexes a claimed job's page and records the outcome
+
+    job:    IndexJob returned by claim_index_job
+    writer: indexer.writer.IndexWriter the page is handed to, indexed in this thread when None
+    report: function called with the job once its attempt has finished
+
+    returns:
+        the job's new status, still running while its page waits for the writer
+    """
+    status_code = None
+    try:
+        page_is_scraped_successfully, scrape_results = scrape(job.url, *get_document_validators(job.url))
+        status_code = scrape_results['status_code']
+        if page_is_scraped_successfully and status_code == NOT_MODIFIED:
+            # the page was neither downloaded nor reindexed
+            record_indexed_page(job, status_code, False)
+        elif not page_is_scraped_successfully or status_code != 200:
+            error = scrape_results.get('error') or (
+                'Connection error' if status_code is None else f'Page returned status code {status_code}')
+            fail_index_job(job, status_code, error, retryable=is_retryable(status_code))
+        else:
+            page = (scrape_results['word_list'], scrape_results['page_title'], job.url,
+                    scrape_results['page_full_text'], scrape_results['etag'], scrape_results['last_modified'])
+            if writer is not None:
+                # the page is analyzed here and the worker moves on, the job is finished by the
+                # writer's thread once the page's batch is committed
+                def record_batch(future):
+                    record_indexed_page(job, status_code, future.exception() or future.result())
+                    if report is not None:
+                        report(job)
+
+                writer.submit(*page).add_done_callback(record_batch)
+                return job.status
+            with write_lock:
+                page_was_indexed = index(*page)
+            record_indexed_page(job, status_code, page_was_indexed)
+    except Exception as error:  # the worker outlives any one page
+        fail_index_job(job, status_code, f'{type(error).__name__}: {error}',
+                       retryable=not isinstance(error, NON_RETRYABLE_ERRORS))
+    if report is not None:
+        report(job)
+    return job.status
+
+
+def queue_is_empty():
+    """Returns True if no job is queued or running"""
+    return not IndexJob.objects.filter(status__in=(IndexJob.QUEUED, IndexJob.RUNNING)).exists()
+
+
+def work_index_queue(stop=None, drain=False, poll_interval=1.0, report=None, writer=None):
+    """
+    Claims and runs jobs in the calling thread until stopped
+
+    stop:          threading.Event ending the loop once set, checked between jobs
+    drain:         return once no job is queued or running instead of waiting for new ones
+    poll_interval: seconds to sleep when no job is due
+    report:        function called with each job once its attempt has finished
+    writer:        indexer.writer.IndexWriter the scraped pages are handed to, see run_index_job
+
+    returns:
+        int: number of attempts run
+    """
+    attempts = 0
+    while stop is None or not stop.is_set():
+        job = claim_index_job()
+        if job is None:
+            if drain and queue_is_empty():
+                break
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        run_index_job(job, writer, report)
+        attempts += 1
+    return attempts
+
+
+def describe_index_job(job):
+    """
+    Returns a job's progress as a JSON serializable dict
+
+    job: IndexJob
+
+    returns:
+        dict of the job's id, url, status, attempts, status_code, page_was_indexed, error,
+        created_at and updated_at, with retry_at for a job waiting out its backoff and
+        jobs_ahead, the number of jobs due before it, for a queued job
+    """
+    description = {
+        'id': job.pk,
+        'url': job.url,
+        'status': job.status,
+        'attempts': job.attempts,
+        'status_code': job.status_code,
+        'page_was_indexed': job.page_was_indexed,
+        'error': job.last_error or None,
+        'created_at': job.created_at.isoformat(),
+        'updated_at': job.updated_at.isoformat(),
+    }
+    if job.status == IndexJob.QUEUED:
+        if job.attempts:
+            description['retry_at'] = job.run_after.isoformat()
+        description['jobs_ahead'] = IndexJob.objects.filter(status=IndexJob.QUEUED).filter(
+            Q(run_after__lt=job.run_after) | Q(run_after=job.run_after, pk__lt=job.pk)).count()
+    return description
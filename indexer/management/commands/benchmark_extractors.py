@@ -0,0 +1,71 @@
+import random
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand, CommandError
+from indexer.extractors import extract_streaming, extract_with_soup
+from indexer.scraper import BODY_CHUNK_SIZE
+
+EXTRACTORS = (('streaming', extract_streaming), ('soup', extract_with_soup))
+SAMPLE_WORDS = ('persimmon', 'harbor', 'lantern', 'quiet', 'river', 'orchard', 'copper', 'meadow', 'signal', 'winter')
+
+
+def sample_page(paragraphs):
+    """Returns the bytes of a generated page of about 1KiB per paragraph, with scripts, styles and links"""
+    rand = random.Random(0)
+    parts = ['<html><head><title>Sample page</title><style>p { margin: 0 }</style></head><body>']
+    for num in range(paragraphs):
+        words = ' '.join(rand.choice(SAMPLE_WORDS) for _ in range(150))
+        parts.append(f'<div class="section"><h2>Section {num}</h2>\n  <p>{words} &amp; more</p>'
+                     f'<a href="/page/{num}#top">next</a><script>var n = {num};</script></div>\n')
+    parts.append('</body></html>')
+    return ''.join(parts).encode('utf-8')
+
+
+def page_chunks(page):
+    """Returns a generator of BODY_CHUNK_SIZE slices of a page, as the scraper hands a body to the extractor"""
+    view = memoryview(page)
+    return (view[start:start + BODY_CHUNK_SIZE] for start in range(0, len(page), BODY_CHUNK_SIZE))
+
+
+class Command(BaseCommand):
+    help = 'Compares the time and peak memory of the streaming and BeautifulSoup HTML extractors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='HTML files to extract, a generated page when none are given')
+        parser.add_argument(
+            '--paragraphs', type=int, default=2000, help='Paragraphs of about 1KiB in the generated page')
+        parser.add_argument('--repeat', type=int, default=5, help='Times each page is extracted, the fastest counts')
+
+    def handle(self, *args, **options):
+        if options['files']:
+            try:
+                pages = []
+                for path in options['files']:
+                    with open(path, 'rb') as page_file:
+                        pages.append(page_file.read())
+            except OSError as error:
+                raise CommandError(f'Could not read {error.filename}: {error.strerror}')
+        else:
+            pages = [sample_page(options['paragraphs'])]
+        page_bytes = sum(len(page) for page in pages)
+        print(f'Extracting {len(pages)} pages, {page_bytes / 1024:.1f} KiB, best of {options["repeat"]} runs.')
+
+        results = {}
+        for name, extractor in EXTRACTORS:
+            best = None
+            for _ in range(max(1, options['repeat'])):
+                start = time.perf_counter()
+                results[name] = [extractor(page_chunks(page), None, 'http://example.com/') for page in pages]
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            tracemalloc.start()
+            for page in pages:
+                extractor(page_chunks(page), None, 'http://example.com/')
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'{name}: {best:.3f}s, {page_bytes / 1024 / 1024 / max(best, 1e-9):.1f} MiB/sec, '
+                  f'peak memory {peak / 1024 / 1024:.1f} MiB.')
+
+        mismatches = sum(streaming != soup for streaming, soup in zip(results['streaming'], results['soup']))
+        print(f'{len(pages) - mismatches} of {len(pages)} pages extracted identically.')
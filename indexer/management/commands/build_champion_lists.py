@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from indexer.champions import rebuild_champion_lists
+from indexer.shards import map_shards
+
+class Command(BaseCommand):
+    help = 'Rebuilds the champion list of every term from the postings'
+
+    def handle(self, *args, **options):
+        written = sum(map_shards(lambda alias: rebuild_champion_lists()))
+        print(f'Built champion lists with {written} postings.')
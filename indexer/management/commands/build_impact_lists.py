@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from indexer.impacts import rebuild_impact_lists
+from indexer.shards import map_shards
+
+class Command(BaseCommand):
+    help = 'Requantizes every posting and rebuilds the impact-ordered list of every term'
+
+    def handle(self, *args, **options):
+        written = sum(map_shards(lambda alias: rebuild_impact_lists()))
+        print(f'Built {written} impact lists.')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from indexer.postings import compressed_postings_enabled, rebuild_postings_lists
+from indexer.shards import map_shards
+
+class Command(BaseCommand):
+    help = 'Moves the postings of the DocumentLexicon table into compressed postings lists'
+
+    def handle(self, *args, **options):
+        # the DocumentLexicon rows are deleted, only the compressed engines could read the index afterwards
+        if not compressed_postings_enabled():
+            print('INDEXER_COMPRESSED_POSTINGS is not enabled, the postings were left in DocumentLexicon.')
+            return
+        written = sum(map_shards(lambda alias: rebuild_postings_lists()))
+        print(f'Built {written} postings lists.')
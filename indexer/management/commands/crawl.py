@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from indexer.crawler import Crawler, read_seed_file
+from indexer.writer import IndexWriter
+
+class Command(BaseCommand):
+    help = 'Fetches and indexes the URLs listed in a seed file concurrently, politely to each host'
+
+    def add_arguments(self, parser):
+        parser.add_argument('seed_file', help='File listing one URL per line, # starts a comment')
+        parser.add_argument(
+            '--concurrency', type=int, default=None,
+            help='Most pages fetched at once (INDEXER_CRAWL_CONCURRENCY)')
+        parser.add_argument(
+            '--host-concurrency', type=int, default=None,
+            help='Most pages fetched at once from one host (INDEXER_CRAWL_HOST_CONCURRENCY)')
+        parser.add_argument(
+            '--host-delay', type=float, default=None,
+            help='Least seconds between two requests to one host (INDEXER_CRAWL_HOST_DELAY)')
+        parser.add_argument(
+            '--depth', type=int, default=0, help='Follow links to the same host this many levels from the seeds')
+        parser.add_argument('--max-pages', type=int, default=None, help='Stop after fetching this many pages')
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Most pages committed in one transaction (INDEXER_WRITER_BATCH_SIZE)')
+        parser.add_argument(
+            '--flush-interval', type=float, default=None,
+            help='Longest wait in seconds for a batch of pages to fill (INDEXER_WRITER_FLUSH_INTERVAL)')
+        parser.add_argument(
+            '--report-interval', type=float, default=10.0, help='Seconds between progress reports')
+
+    def handle(self, *args, **options):
+        try:
+            seeds = read_seed_file(options['seed_file'])
+        except OSError as error:
+            raise CommandError(f"Could not read {options['seed_file']}: {error}")
+        print(f'Crawling from {len(seeds)} seed URLs...')
+
+        with IndexWriter(options['batch_size'], options['flush_interval']) as writer:
+            crawler = Crawler(
+                writer, concurrency=options['concurrency'], host_concurrency=options['host_concurrency'],
+                host_delay=options['host_delay'], max_depth=options['depth'], max_pages=options['max_pages'])
+            stats = crawler.crawl(seeds, report=print, report_interval=options['report_interval'])
+        print(f'Done: {stats}.')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from indexer.index import delete_documents
+
+class Command(BaseCommand):
+    help = 'Deletes documents and their postings from the index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', help='URLs of the documents to delete')
+        parser.add_argument('--file', help='file listing the URLs of the documents to delete, one per line')
+
+    def handle(self, *args, **options):
+        urls = list(options['urls'])
+        if options['file']:
+            with open(options['file']) as url_file:
+                urls.extend(line.strip() for line in url_file if line.strip())
+        deleted = delete_documents(urls)
+        print(f'{deleted} documents deleted.')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from indexer.shards import use_shard
+from indexer.snapshot import dump_index
+
+class Command(BaseCommand):
+    help = 'Writes a compressed binary snapshot of the index: corpus statistics, documents, lexicon and postings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='file the snapshot is written to')
+        parser.add_argument(
+            '--full-text', action='store_true',
+            help="include each document's full text rather than the preview displayed in results")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='database (or shard) to dump')
+
+    def handle(self, *args, **options):
+        with use_shard(options['database']), open(options['path'], 'wb') as snapshot_file:
+            counts = dump_index(snapshot_file, full_text=options['full_text'])
+        print(f"Dumped {counts['documents']} documents, {counts['terms']} terms and {counts['postings']} postings.")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from indexer.shards import use_shard
+from indexer.snapshot import SnapshotFormatError, load_index
+
+class Command(BaseCommand):
+    help = 'Replaces the index with a snapshot written by dump_index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='snapshot file to load')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='database (or shard) to load into')
+
+    def handle(self, *args, **options):
+        try:
+            with use_shard(options['database']), open(options['path'], 'rb') as snapshot_file:
+                counts = load_index(snapshot_file)
+        except SnapshotFormatError as error:
+            raise CommandError(error)
+        print(f"Loaded {counts['documents']} documents, {counts['terms']} terms and {counts['postings']} postings.")
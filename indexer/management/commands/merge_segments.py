@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+from indexer.segments import merge_tiers
+
+class Command(BaseCommand):
+    help = 'Compacts the index segments with a tiered merge policy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--merge-factor', type=int, help='number of segments of a tier merged together')
+        parser.add_argument('--full', action='store_true', help='merge every segment into one')
+        parser.add_argument(
+            '--interval', type=float,
+            help='keep running in the background, looking for merges every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            merges = merge_tiers(merge_factor=options['merge_factor'], full=options['full'])
+            print(f'{merges} segment merges performed.')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
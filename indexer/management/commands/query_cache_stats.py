@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from indexer.query_cache import get_query_cache_stats, reset_query_cache_stats
+
+class Command(BaseCommand):
+    help = 'Prints the query-result cache hit and miss counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Set the counts back to zero afterwards')
+
+    def handle(self, *args, **options):
+        stats = get_query_cache_stats()
+        hit_rate = 'n/a' if stats['hit_rate'] is None else f"{stats['hit_rate']:.1%}"
+        print(f"{stats['hits']} hits, {stats['misses']} misses, hit rate {hit_rate}.")
+        if options['reset']:
+            reset_query_cache_stats()
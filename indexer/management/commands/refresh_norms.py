@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from indexer.index import refresh_document_norms
+from indexer.shards import map_shards
+
+class Command(BaseCommand):
+    help = 'Recomputes the tf-idf vector norm of every indexed document'
+
+    def handle(self, *args, **options):
+        # every shard's norms are computed against the global statistics of all shards
+        map_shards(lambda alias: refresh_document_norms())
+        print('Document norms refreshed.')
@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from indexer.jobs import work_index_queue, write_lock
+from indexer.writer import IndexWriter
+
+DEFAULT_WORKERS = 4
+
+class Command(BaseCommand):
+    help = 'Scrapes and indexes the URLs queued by the indexing page, retrying failed pages with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=getattr(settings, 'INDEXER_INDEX_WORKERS', DEFAULT_WORKERS),
+            help='Number of pages scraped and indexed at once')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0, help='Seconds to wait when no job is due')
+        parser.add_argument(
+            '--drain', action='store_true',
+            help='Exit once no job is queued or running instead of waiting for new ones')
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Most pages committed in one transaction by the writer (INDEXER_WRITER_BATCH_SIZE)')
+        parser.add_argument(
+            '--flush-interval', type=float, default=None,
+            help='Longest wait in seconds for a batch of pages to fill (INDEXER_WRITER_FLUSH_INTERVAL)')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        print_lock = threading.Lock()
+
+        def report(job):
+            with print_lock:
+                print(f'Job {job.pk} {job.url}: {job.status} after {job.attempts} attempt(s).')
+
+        workers = max(1, options['workers'])
+        if workers == 1:
+            attempts = work_index_queue(None, options['drain'], options['poll_interval'], report)
+        else:
+            attempts = self.work_in_threads(workers, stop, options, report)
+        print(f'{attempts} indexing attempts run.')
+
+    def work_in_threads(self, workers, stop, options, report):
+        # the workers only scrape and analyze, a single writer thread commits their pages in batches
+        writer = IndexWriter(options['batch_size'], options['flush_interval'], write_lock=write_lock)
+
+        def work():
+            try:
+                return work_index_queue(stop, options['drain'], options['poll_interval'], report, writer)
+            finally:
+                # database connections are per thread, the worker's would otherwise leak
+                connections.close_all()
+
+        with writer, ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(work) for _ in range(workers)]
+            try:
+                return sum(future.result() for future in futures)
+            except KeyboardInterrupt:
+                # running jobs finish first, a job left running is claimed again after INDEXER_JOB_LEASE
+                stop.set()
+                return sum(future.result() for future in futures)
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError
-from indexer.index import index
-from indexer.scraper import scrape
+from indexer.index import get_document_validators, index
+from indexer.segments import segment_batch
+from indexer.scraper import NOT_MODIFIED, scrape
 
 class Command(BaseCommand):
     help = 'Seeds the database with some documents'
@@ -24,19 +25,36 @@ class Command(BaseCommand):
 
         )
 
+        # with INDEXER_SEGMENTS enabled all seeded documents are written to one segment
+        with segment_batch():
+            self.index_urls(urls)
+
+    def index_urls(self, urls):
         num_successfully_indexed = 0
+        num_unchanged = 0
         for url in urls:
             print(f'Scraping {url}...')
-            scrape_results = scrape(url)
-            if scrape_results[0] and scrape_results[1]['status_code'] == 200:
+            scrape_results = scrape(url, *get_document_validators(url))
+            if scrape_results[0] and scrape_results[1]['status_code'] == NOT_MODIFIED:
+                print(f'Page not modified since it was last indexed, skipped.')
+                num_unchanged += 1
+            elif scrape_results[0] and scrape_results[1]['status_code'] == 200:
                 print('Page scraped successfully.')
                 word_list = scrape_results[1]['word_list']
                 page_title = scrape_results[1]['page_title']
                 page_full_text = scrape_results[1]['page_full_text']
                 print(f'Indexing...')
-                index(word_list, page_title, url, page_full_text)
-                print(f'Page indexed successfully.')
-                num_successfully_indexed += 1
+                page_was_indexed = index(
+                    word_list, page_title, url, page_full_text,
+                    etag=scrape_results[1]['etag'],
+                    last_modified=scrape_results[1]['last_modified'])
+                if page_was_indexed:
+                    print(f'Page indexed successfully.')
+                    num_successfully_indexed += 1
+                else:
+                    print(f'Page unchanged since it was last indexed, skipped.')
+                    num_unchanged += 1
             else:
                 print('Error encountered while scraping.')
         print(f'{num_successfully_indexed} documents successfully indexed.')
+        print(f'{num_unchanged} documents unchanged.')
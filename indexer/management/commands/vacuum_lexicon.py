@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from indexer.index import vacuum_lexicon
+
+class Command(BaseCommand):
+    help = 'Purges terms no document contains any more and reclaims the database space they used'
+
+    def handle(self, *args, **options):
+        purged = vacuum_lexicon()
+        print(f'{purged} terms purged.')
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:06
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_corpus_statistics(apps, schema_editor):
+    CorpusStatistics = apps.get_model('indexer', 'CorpusStatistics')
+    Document = apps.get_model('indexer', 'Document')
+    TermLexicon = apps.get_model('indexer', 'TermLexicon')
+    db_alias = schema_editor.connection.alias
+
+    CorpusStatistics.objects.using(db_alias).update_or_create(
+        pk=1, defaults={'document_count': Document.objects.using(db_alias).count()})
+    term_set = TermLexicon.objects.using(db_alias).annotate(num_documents=Count('documentlexicon'))
+    for term in term_set.iterator():
+        term.document_frequency = term.num_documents
+        term.save(update_fields=['document_frequency'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer', '0003_alter_document_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorpusStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='termlexicon',
+            name='document_frequency',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_corpus_statistics, migrations.RunPython.noop),
+    ]
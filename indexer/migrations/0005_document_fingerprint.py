@@ -0,0 +1,37 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:09
+
+from hashlib import sha256
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    Document = apps.get_model('indexer', 'Document')
+    for doc in Document.objects.using(schema_editor.connection.alias).only('id', 'text').iterator():
+        doc.content_hash = sha256(doc.text.encode('utf-8')).hexdigest()
+        doc.save(update_fields=['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer', '0004_corpus_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='last_modified',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
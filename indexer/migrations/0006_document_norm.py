@@ -0,0 +1,43 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:12
+
+from collections import defaultdict
+import math
+from django.db import migrations, models
+
+
+def backfill_document_norms(apps, schema_editor):
+    CorpusStatistics = apps.get_model('indexer', 'CorpusStatistics')
+    Document = apps.get_model('indexer', 'Document')
+    DocumentLexicon = apps.get_model('indexer', 'DocumentLexicon')
+    db_alias = schema_editor.connection.alias
+
+    N = Document.objects.using(db_alias).count()
+    squared_norms = defaultdict(float)
+    postings = DocumentLexicon.objects.using(db_alias).values_list('context_id', 'frequency', 'term__document_frequency')
+    for doc_id, frequency, N_t in postings.iterator():
+        term_idf = 1.0 + math.log(N / N_t) if N_t > 0 else 1.0
+        squared_norms[doc_id] += (math.log(1.2 + frequency) * term_idf) ** 2
+    for doc_id, squared_norm in squared_norms.items():
+        Document.objects.using(db_alias).filter(pk=doc_id).update(norm=math.sqrt(squared_norm))
+    CorpusStatistics.objects.using(db_alias).update(changed_document_count=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer', '0005_document_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='corpusstatistics',
+            name='changed_document_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='norm',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(backfill_document_norms, migrations.RunPython.noop),
+    ]
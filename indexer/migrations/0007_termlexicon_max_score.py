@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer', '0006_document_norm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='termlexicon',
+            name='max_score',
+            field=models.FloatField(default=1.0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer', '0007_termlexicon_max_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='corpusstatistics',
+            name='generation',
+            field=models.IntegerField(default=0),
+        ),
+    ]
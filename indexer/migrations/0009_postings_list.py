@@ -0,0 +1,25 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer', '0008_corpus_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostingsList',
+            fields=[
+                ('term', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='indexer.termlexicon')),
+                ('data', models.BinaryField(default=b'')),
+                ('skips', models.BinaryField(default=b'')),
+                ('doc_count', models.IntegerField(default=0)),
+                ('last_doc_id', models.BigIntegerField(default=0)),
+                ('last_block_count', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
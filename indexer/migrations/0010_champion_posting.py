@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer', '0009_postings_list'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChampionPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('context', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='indexer.document')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='indexer.termlexicon')),
+            ],
+        ),
+    ]
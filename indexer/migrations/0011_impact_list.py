@@ -0,0 +1,28 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer', '0010_champion_posting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImpactList',
+            fields=[
+                ('term', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='indexer.termlexicon')),
+                ('data', models.BinaryField(default=b'')),
+                ('segments', models.BinaryField(default=b'')),
+                ('doc_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='corpusstatistics',
+            name='impact_scale',
+            field=models.FloatField(default=0.0),
+        ),
+    ]
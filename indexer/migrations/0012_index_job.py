@@ -0,0 +1,35 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:55
+
+import django.core.validators
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer', '0011_impact_list'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField(validators=[django.core.validators.URLValidator()])),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('status_code', models.IntegerField(blank=True, null=True)),
+                ('page_was_indexed', models.BooleanField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='indexjob',
+            index=models.Index(fields=['status', 'run_after'], name='indexer_ind_status_29c7f1_idx'),
+        ),
+    ]
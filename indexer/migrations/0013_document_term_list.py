@@ -0,0 +1,21 @@
+# Generated by Django 3.2.9 on 2026-10-18 21:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indexer', '0012_index_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentTermList',
+            fields=[
+                ('context', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='indexer.document')),
+                ('data', models.BinaryField(default=b'')),
+            ],
+        ),
+    ]
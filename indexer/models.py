@@ -1,10 +1,40 @@
 """This module serves as model definitions for the indexer app"""
 from django.db import models
+from django.db.models import F
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
+from django.utils import timezone
 
 EMPTY_STRING = ''
 EMPTY_STRING_MESSAGE = "Database should not contain empty string for {attribute} on {model_name}"
+CORPUS_STATISTICS_ID = 1
+
+class CorpusStatistics(models.Model):
+    """corpus-wide statistics kept up to date by the indexer so that retrieval never has to count"""
+    document_count = models.IntegerField(default=0)  # N: number of documents in the corpus
+    # documents (re)indexed since every Document.norm was last recomputed, a proxy for IDF drift
+    changed_document_count = models.IntegerField(default=0)
+    # bumped whenever postings or norms change, so in-memory copies of the index can detect staleness
+    generation = models.IntegerField(default=0)
+    # normalized weight mapped to the highest impact level when impact lists were last quantized
+    impact_scale = models.FloatField(default=0.0)
+
+    @classmethod
+    def get(cls):
+        """Returns the single CorpusStatistics row, creating it if needed"""
+        stats, _ = cls.objects.get_or_create(pk=CORPUS_STATISTICS_ID)
+        return stats
+
+    @classmethod
+    def adjust(cls, **deltas):
+        """Adds each keyword argument's value to the field of the same name in one UPDATE"""
+        updates = {field: F(field) + delta for field, delta in deltas.items()}
+        if not cls.objects.filter(pk=CORPUS_STATISTICS_ID).update(**updates):
+            cls.objects.get_or_create(pk=CORPUS_STATISTICS_ID)
+            cls.objects.filter(pk=CORPUS_STATISTICS_ID).update(**updates)
+
+    def __str__(self):
+        return f"{self.document_count} documents"
 
 class Document(models.Model):
     '''additional info on a document we don't want to keep in the docLexicon table'''
@@ -13,6 +43,11 @@ class Document(models.Model):
     # raw page text for displaying some portion on retrieval
     # (maybe 500-1000 words stored at most)
     text = models.TextField()
+    content_hash = models.CharField(max_length=64, blank=True, default=EMPTY_STRING)  # fingerprint of text
+    # HTTP validators returned with the page, sent back on re-scrapes
+    etag = models.CharField(max_length=255, blank=True, default=EMPTY_STRING)
+    last_modified = models.CharField(max_length=64, blank=True, default=EMPTY_STRING)
+    norm = models.FloatField(default=0.0)  # length of the document's tf-idf vector
 
     def clean(self):
         if self.url == EMPTY_STRING:
@@ -27,7 +62,10 @@ class Document(models.Model):
 
     def save(self, *args, **kwargs):
         self.full_clean()
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        if adding:
+            CorpusStatistics.adjust(document_count=1)
 
     def __str__(self):
         return f"{self.title}: {self.url}"
@@ -36,12 +74,32 @@ class TermLexicon(models.Model):
     """overall representation of a term across all documents"""
     term = models.CharField(max_length=500, unique=True)
     frequency = models.IntegerField()  # overall frequency in the corpus
+    document_frequency = models.IntegerField(default=0)  # number of documents containing the term
+    # upper bound on log(1.2 + tf) / norm of the term in any document, its normalized weight
+    # without idf; times the query's idf it bounds the term's share of any cosine, used to
+    # prune documents that cannot make the top k during retrieval
+    max_score = models.FloatField(default=1.0)
 
     def clean(self):
         if self.term == EMPTY_STRING:
             raise ValidationError(EMPTY_STRING_MESSAGE.format(
                 attribute="Term", model_name=TermLexicon.__name__))
 
+    @classmethod
+    def validate_terms(cls, terms):
+        """
+        Validates a batch of terms before they are bulk inserted, since bulk_create
+        bypasses save() and full_clean()
+        """
+        max_length = cls._meta.get_field('term').max_length
+        for term in terms:
+            if term == EMPTY_STRING:
+                raise ValidationError(EMPTY_STRING_MESSAGE.format(
+                    attribute="Term", model_name=cls.__name__))
+            if len(term) > max_length:
+                raise ValidationError(
+                    f"Term {term[:50]}... is longer than {max_length} characters")
+
     def save(self, *args, **kwargs):
         self.full_clean()
         super().save(*args, **kwargs)
@@ -58,6 +116,70 @@ class DocumentLexicon(models.Model):
     def __str__(self):
         return f"{self.context.title}: {self.term.term} ({self.frequency})"
 
+class PostingsList(models.Model):
+    """a term's postings compressed into one blob, see indexer.postings for the format"""
+    term = models.OneToOneField(TermLexicon, on_delete=models.CASCADE, primary_key=True)
+    data = models.BinaryField(default=b'')  # delta + varint encoded (document id, frequency) pairs
+    skips = models.BinaryField(default=b'')  # (base document id, byte offset) of each block of data
+    doc_count = models.IntegerField(default=0)  # number of postings
+    last_doc_id = models.BigIntegerField(default=0)  # base for appending the next posting
+    last_block_count = models.IntegerField(default=0)  # number of postings in the last block
+
+    def __str__(self):
+        return f"{self.term_id}: {self.doc_count} postings"
+
+class DocumentTermList(models.Model):
+    """a document's terms compressed into one blob, stored in place of its DocumentLexicon rows with PostingsList"""
+    context = models.OneToOneField(Document, on_delete=models.CASCADE, primary_key=True)
+    data = models.BinaryField(default=b'')  # delta + varint encoded (term id, frequency) pairs
+
+    def __str__(self):
+        return f"{self.context_id}: {len(self.data)} bytes"
+
+class ImpactList(models.Model):
+    """a term's postings grouped by quantized impact, highest first, see indexer.impacts for the format"""
+    term = models.OneToOneField(TermLexicon, on_delete=models.CASCADE, primary_key=True)
+    data = models.BinaryField(default=b'')  # delta + varint encoded document ids of each segment
+    segments = models.BinaryField(default=b'')  # (impact, document count, byte offset) of each segment
+    doc_count = models.IntegerField(default=0)  # number of postings
+
+    def __str__(self):
+        return f"{self.term_id}: {self.doc_count} postings"
+
+class ChampionPosting(models.Model):
+    """one of the highest weighted postings of a term, see indexer.champions"""
+    term = models.ForeignKey(TermLexicon, on_delete=models.CASCADE)
+    context = models.ForeignKey(Document, on_delete=models.CASCADE)
+    score = models.FloatField()  # the term's weight in the document vector divided by the document's norm
+
+    def __str__(self):
+        return f"{self.term_id}: {self.context_id} ({self.score})"
+
+class IndexJob(models.Model):
+    """a URL waiting to be scraped and indexed by the run_index_workers command, see indexer.jobs"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    url = models.TextField(validators=[URLValidator()])
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)  # number of times a worker has started the job
+    run_after = models.DateTimeField(default=timezone.now)  # a retried job waits out its backoff
+    claimed_at = models.DateTimeField(null=True, blank=True)  # when the running attempt started
+    status_code = models.IntegerField(null=True, blank=True)  # of the last attempt's response
+    page_was_indexed = models.BooleanField(null=True, blank=True)  # False when the page had not changed
+    last_error = models.TextField(blank=True, default=EMPTY_STRING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"{self.url} ({self.status})"
+
 # Retrieval:
 # 0. Perform stopword elimination and stemming on query
 # 1. Query each term from TermLexicon
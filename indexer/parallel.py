@@ -0,0 +1,131 @@
+"""
+Parallel query scoring: the document id space of every shard (or of the unsharded index) is
+split into partitions of INDEXER_SCORING_PARTITION_SIZE consecutive ids, and each partition
+is ranked term-at-a-time by one of the INDEXER_SCORING_WORKERS processes of a persistent
+pool. Workers read the same read-only database files, which the operating system's page
+cache shares between them, and return their partition's best offset + k; the partial
+rankings are merged. Select it with INDEXER_RETRIEVAL_ENGINE = 'indexer.parallel.rank_parallel',
+a sharded index uses it whenever INDEXER_SCORING_WORKERS is set.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import heapq
+from itertools import islice
+from multiprocessing import get_context
+from threading import Lock
+import django
+from django.conf import settings
+from django.db.models import Max
+from indexer.models import Document, DocumentLexicon
+from indexer.postings import compressed_postings_enabled, read_compressed_postings
+from indexer.retrieve import accumulate_top_scores, gather_query_statistics, rank_key, read_database_postings
+from indexer.shards import to_global_id, use_shard
+
+DEFAULT_PARTITION_SIZE = 50000
+
+
+def get_partition_size():
+    return getattr(settings, 'INDEXER_SCORING_PARTITION_SIZE', DEFAULT_PARTITION_SIZE)
+
+
+_scoring_pool = None
+_scoring_pool_workers = None
+_scoring_pool_lock = Lock()
+
+def get_scoring_pool():
+    """
+    Returns this process's pool of INDEXER_SCORING_WORKERS scoring processes, started on
+    first use and kept for later queries; None when fewer than two workers are configured
+    """
+    global _scoring_pool, _scoring_pool_workers
+    workers = getattr(settings, 'INDEXER_SCORING_WORKERS', None) or 0
+    if workers < 2:
+        return None
+    with _scoring_pool_lock:
+        if _scoring_pool is None or _scoring_pool_workers != workers:
+            if _scoring_pool is not None:
+                _scoring_pool.shutdown(wait=False)
+            # spawned rather than forked, a forked worker would share the request's database connections
+            _scoring_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=get_context('spawn'), initializer=django.setup)
+            _scoring_pool_workers = workers
+        return _scoring_pool
+
+def discard_scoring_pool(pool):
+    """Forgets a pool whose workers died, the next query starts a new one"""
+    global _scoring_pool
+    with _scoring_pool_lock:
+        if _scoring_pool is pool:
+            _scoring_pool = None
+    pool.shutdown(wait=False)
+
+
+def score_partition(alias, first_doc_id, last_doc_id, tf_idf_query, idf_terms, term_ids, max_scores, depth):
+    """
+    Ranks the documents of one partition term-at-a-time with MaxScore pruning, runs in a
+    scoring worker
+
+    alias:        shard alias, None when the index is not sharded
+    first_doc_id: lowest Document id of the partition
+    last_doc_id:  Document id just above the partition
+    tf_idf_query: dict mapping query term to its tf-idf weight
+    idf_terms:    dict mapping query term to its global idf
+    term_ids:     dict mapping query term to its TermLexicon id in the shard
+    max_scores:   dict mapping query term to its max_score in the shard
+    depth:        number of documents to return, all matching documents when None
+
+    returns:
+        list of (Document id, cosine similarity) tuples, best first, with global ids when sharded
+    """
+    def read_postings(term_id, candidates=None):
+        if candidates is not None:
+            # pruning only keeps candidates from this partition
+            return read_database_postings(term_id, candidates)
+        if compressed_postings_enabled():
+            return read_compressed_postings(term_id, doc_id_range=(first_doc_id, last_doc_id))
+        return DocumentLexicon.objects.filter(
+            term_id=term_id, context_id__gte=first_doc_id, context_id__lt=last_doc_id).values_list(
+                'context_id', 'frequency', 'context__norm').iterator()
+
+    with use_shard(alias):
+        ranked = accumulate_top_scores(tf_idf_query, idf_terms, term_ids, max_scores, depth, read_postings)
+    if alias is None:
+        return ranked
+    return [(to_global_id(alias, doc_id), score) for doc_id, score in ranked]
+
+
+def rank_parallel(query_term_frequency_map, k=None, offset=0):
+    """
+    Retrieval engine ranking partitions of the document id space in parallel worker
+    processes, see indexer.retrieve.rank_in_database for the arguments. IDF is global across
+    shards as in indexer.retrieve.rank_shards. A query with a single partition, or without a
+    pool, is ranked in the calling thread.
+    """
+    idf_terms, tf_idf_query, shard_terms = gather_query_statistics(query_term_frequency_map)
+    depth = None if k is None else offset + k
+    partition_size = get_partition_size()
+
+    partitions = []
+    for alias, (term_ids, max_scores) in shard_terms.items():
+        if not term_ids:
+            continue
+        with use_shard(alias):
+            last_doc_id = Document.objects.aggregate(last_doc_id=Max('id'))['last_doc_id'] or 0
+        for first_doc_id in range(0, last_doc_id + 1, partition_size):
+            partitions.append((alias, first_doc_id, first_doc_id + partition_size,
+                               tf_idf_query, idf_terms, term_ids, max_scores, depth))
+
+    pool = get_scoring_pool() if len(partitions) > 1 else None
+    partial_rankings = None
+    if pool is not None:
+        try:
+            partial_rankings = list(pool.map(score_partition, *zip(*partitions)))
+        except BrokenProcessPool:
+            discard_scoring_pool(pool)
+    if partial_rankings is None:
+        partial_rankings = [score_partition(*partition) for partition in partitions]
+
+    # every partition's ranking is sorted already, and ids keep their tie order across partitions
+    ranked = heapq.merge(*partial_rankings, key=rank_key)
+    return tuple(doc_id for doc_id, _ in islice(ranked, offset, depth))
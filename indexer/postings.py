@@ -0,0 +1,442 @@
+"""
+Compressed postings lists: each term's (document id, frequency) pairs are stored in one
+PostingsList row as a blob sorted by document id. Document ids are delta encoded and every
+number is written as a variable-length integer (LEB128), so most postings take two or three
+bytes instead of a DocumentLexicon row and its index entries.
+
+The blob is cut into blocks of POSTINGS_BLOCK_SIZE postings. A separate skip table holds,
+for every block, the document id the block's deltas start from and the block's byte offset,
+so a reader looking for a few documents only decodes the blocks that can contain them.
+
+With INDEXER_COMPRESSED_POSTINGS the PostingsList rows are the index's postings store and no
+DocumentLexicon rows are written. Each document's (term id, frequency) pairs are kept in its
+DocumentTermList row, encoded the same way, for the per-document reads of norms, reindexing
+diffs and deletions. iter_postings and read_compressed_postings give the retrieval engines
+and maintenance passes the same postings whichever table holds them.
+"""
+
+from bisect import bisect_right
+from itertools import groupby
+from django.conf import settings
+from indexer.models import Document, DocumentLexicon, DocumentTermList, PostingsList, TermLexicon
+from indexer.retrieve import (DOCUMENT_BATCH_SIZE, MAX_FILTERED_CANDIDATES, accumulate_top_scores,
+                              compute_idf_query_terms, weight_query_terms)
+from indexer.shards import atomic
+from indexer.utils import batched
+
+POSTINGS_BLOCK_SIZE = 128
+# PostingsList rows are read and written in batches of this size
+POSTINGS_BATCH_SIZE = 250
+
+
+def compressed_postings_enabled():
+    """Returns True if the write path maintains PostingsList rows (INDEXER_COMPRESSED_POSTINGS)"""
+    return getattr(settings, 'INDEXER_COMPRESSED_POSTINGS', False)
+
+
+def encode_varint(value, out):
+    """Appends a non-negative integer to a bytearray as a LEB128 variable-length integer"""
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, position):
+    """Decodes the variable-length integer at data[position], returns it and the position after it"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def decode_varints(data, start=0, end=None):
+    """Lazily decodes the variable-length integers in data[start:end]"""
+    end = len(data) if end is None else end
+    position = start
+    while position < end:
+        value = 0
+        shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        yield value
+
+
+def encode_postings(postings):
+    """
+    Encodes postings into a postings blob and its skip table
+
+    postings: iterable of (document id, frequency) tuples sorted by document id
+
+    returns:
+        tuple of the data blob, the skip table blob, the number of postings, the last
+        document id and the number of postings in the last block
+    """
+    data = bytearray()
+    skips = bytearray()
+    doc_count = 0
+    last_doc_id = 0
+    for doc_id, frequency in postings:
+        if doc_count % POSTINGS_BLOCK_SIZE == 0:
+            encode_varint(last_doc_id, skips)
+            encode_varint(len(data), skips)
+        encode_varint(doc_id - last_doc_id, data)
+        encode_varint(frequency, data)
+        doc_count += 1
+        last_doc_id = doc_id
+    last_block_count = doc_count % POSTINGS_BLOCK_SIZE or min(doc_count, POSTINGS_BLOCK_SIZE)
+    return bytes(data), bytes(skips), doc_count, last_doc_id, last_block_count
+
+
+class PostingsReader:
+    """Streaming decoder over one term's postings blob"""
+    def __init__(self, data, skips):
+        self.data = bytes(data)
+        skip_values = list(decode_varints(bytes(skips)))
+        self.block_bases = skip_values[0::2]  # document id each block's deltas start from
+        self.block_offsets = skip_values[1::2]
+
+    def iter_block(self, block):
+        """Decodes the postings of a single block"""
+        end = self.block_offsets[block + 1] if block + 1 < len(self.block_offsets) else len(self.data)
+        values = decode_varints(self.data, self.block_offsets[block], end)
+        doc_id = self.block_bases[block]
+        for delta in values:
+            doc_id += delta
+            yield doc_id, next(values)
+
+    def __iter__(self):
+        for block in range(len(self.block_offsets)):
+            yield from self.iter_block(block)
+
+    def iter_range(self, first_doc_id, last_doc_id):
+        """Decodes the postings of the documents with ids from first_doc_id up to, not including, last_doc_id"""
+        first_block = max(bisect_right(self.block_bases, first_doc_id - 1) - 1, 0)
+        for block in range(first_block, len(self.block_offsets)):
+            for doc_id, frequency in self.iter_block(block):
+                if doc_id >= last_doc_id:
+                    return
+                if doc_id >= first_doc_id:
+                    yield doc_id, frequency
+
+    def lookup(self, doc_ids):
+        """
+        Finds the postings of the given documents, decoding only the blocks that may hold them
+
+        doc_ids: iterable of document ids
+
+        returns:
+            generator of (document id, frequency) tuples for the documents that contain the term
+        """
+        wanted_by_block = {}
+        for doc_id in doc_ids:
+            # block i holds the document ids in (block_bases[i], block_bases[i + 1]]
+            block = bisect_right(self.block_bases, doc_id - 1) - 1
+            if block >= 0:
+                wanted_by_block.setdefault(block, set()).add(doc_id)
+        for block in sorted(wanted_by_block):
+            wanted = wanted_by_block[block]
+            for doc_id, frequency in self.iter_block(block):
+                if doc_id in wanted:
+                    yield doc_id, frequency
+
+
+def encode_term_frequencies(term_frequencies):
+    """Encodes a document's terms as delta + varint (term id, frequency) pairs sorted by term id"""
+    data = bytearray()
+    last_term_id = 0
+    for term_id in sorted(term_frequencies):
+        encode_varint(term_id - last_term_id, data)
+        encode_varint(term_frequencies[term_id], data)
+        last_term_id = term_id
+    return bytes(data)
+
+
+def decode_term_frequencies(data):
+    """Decodes a DocumentTermList blob into a dict mapping TermLexicon id to frequency"""
+    values = decode_varints(bytes(data))
+    term_frequencies = {}
+    term_id = 0
+    for delta in values:
+        term_id += delta
+        term_frequencies[term_id] = next(values)
+    return term_frequencies
+
+
+def read_document_terms(doc_ids):
+    """
+    Reads the terms of the given documents from their DocumentTermList rows
+
+    doc_ids: iterable of Document ids
+
+    returns:
+        dict mapping Document id to a dict mapping TermLexicon id to the term's frequency in the document
+    """
+    document_terms = {}
+    for doc_id_batch in batched(doc_ids, POSTINGS_BATCH_SIZE):
+        for doc_id, data in DocumentTermList.objects.filter(pk__in=doc_id_batch).values_list('context_id', 'data'):
+            document_terms[doc_id] = decode_term_frequencies(data)
+    return document_terms
+
+
+def load_postings_readers(term_ids):
+    """
+    Reads the postings lists of the given terms
+
+    term_ids: iterable of TermLexicon ids
+
+    returns:
+        dict mapping TermLexicon id to a PostingsReader
+    """
+    readers = {}
+    for term_id_batch in batched(term_ids, POSTINGS_BATCH_SIZE):
+        for term_id, data, skips in PostingsList.objects.filter(term_id__in=term_id_batch).values_list(
+                'term_id', 'data', 'skips'):
+            readers[term_id] = PostingsReader(data, skips)
+    return readers
+
+
+def set_postings(postings_list, postings):
+    """Re-encodes a PostingsList row from a full list of sorted (document id, frequency) tuples"""
+    (postings_list.data, postings_list.skips, postings_list.doc_count,
+     postings_list.last_doc_id, postings_list.last_block_count) = encode_postings(postings)
+
+
+def append_posting(postings_list, doc_id, frequency):
+    """Appends a posting for a document id above every id already in the list, without decoding it"""
+    data = bytearray(postings_list.data)
+    if postings_list.last_block_count == POSTINGS_BLOCK_SIZE or postings_list.doc_count == 0:
+        skips = bytearray(postings_list.skips)
+        encode_varint(postings_list.last_doc_id, skips)
+        encode_varint(len(data), skips)
+        postings_list.skips = bytes(skips)
+        postings_list.last_block_count = 0
+    encode_varint(doc_id - postings_list.last_doc_id, data)
+    encode_varint(frequency, data)
+    postings_list.data = bytes(data)
+    postings_list.doc_count += 1
+    postings_list.last_block_count += 1
+    postings_list.last_doc_id = doc_id
+
+
+def update_postings_lists(doc_id, term_frequencies):
+    """
+    Applies one document's posting changes to the PostingsList rows of its terms and to its
+    DocumentTermList row. Postings of new documents are appended in place; other changes
+    re-encode the term's list.
+
+    doc_id:           Document id
+    term_frequencies: dict mapping TermLexicon id to the document's new frequency of the term,
+                      0 to remove the document from the term's postings
+
+    returns:
+        None
+    """
+    for term_batch in batched(term_frequencies.items(), POSTINGS_BATCH_SIZE):
+        batch_frequencies = dict(term_batch)
+        postings_lists = PostingsList.objects.in_bulk(batch_frequencies.keys())
+        changed_lists = []
+        new_lists = []
+        empty_term_ids = []
+        for term_id, frequency in batch_frequencies.items():
+            postings_list = postings_lists.get(term_id)
+            if postings_list is None:
+                if frequency:
+                    postings_list = PostingsList(term_id=term_id)
+                    set_postings(postings_list, [(doc_id, frequency)])
+                    new_lists.append(postings_list)
+                continue
+
+            if frequency and doc_id > postings_list.last_doc_id:
+                append_posting(postings_list, doc_id, frequency)
+            else:
+                postings = {
+                    posting_doc_id: posting_frequency
+                    for posting_doc_id, posting_frequency in PostingsReader(postings_list.data, postings_list.skips)}
+                postings[doc_id] = frequency
+                set_postings(postings_list, sorted(
+                    (posting_doc_id, posting_frequency) for posting_doc_id, posting_frequency in postings.items()
+                    if posting_frequency))
+            if postings_list.doc_count:
+                changed_lists.append(postings_list)
+            else:
+                empty_term_ids.append(term_id)
+
+        PostingsList.objects.bulk_create(new_lists)
+        PostingsList.objects.bulk_update(
+            changed_lists, ['data', 'skips', 'doc_count', 'last_doc_id', 'last_block_count'])
+        PostingsList.objects.filter(term_id__in=empty_term_ids).delete()
+
+    document_terms = read_document_terms([doc_id]).get(doc_id, {})
+    document_terms.update(term_frequencies)
+    document_terms = {term_id: frequency for term_id, frequency in document_terms.items() if frequency}
+    if document_terms:
+        DocumentTermList.objects.update_or_create(
+            context_id=doc_id, defaults={'data': encode_term_frequencies(document_terms)})
+    else:
+        DocumentTermList.objects.filter(pk=doc_id).delete()
+
+
+def iter_postings():
+    """
+    Streams every posting of the current database ordered by term and then document id, from
+    the PostingsList rows when compressed postings are enabled and from DocumentLexicon otherwise
+
+    returns:
+        generator of (TermLexicon id, Document id, frequency) tuples
+    """
+    if not compressed_postings_enabled():
+        yield from DocumentLexicon.objects.order_by('term_id', 'context_id').values_list(
+            'term_id', 'context_id', 'frequency').iterator()
+        return
+    postings_lists = PostingsList.objects.order_by('term_id').values_list('term_id', 'data', 'skips')
+    for term_id, data, skips in postings_lists.iterator(chunk_size=POSTINGS_BATCH_SIZE):
+        for doc_id, frequency in PostingsReader(data, skips):
+            yield term_id, doc_id, frequency
+
+
+@atomic
+def rebuild_postings_lists():
+    """
+    Moves the postings of the DocumentLexicon table into PostingsList rows, and every document's
+    terms into its DocumentTermList row, in two ordered passes. The DocumentLexicon rows are
+    deleted, the compressed lists replace them. An index without DocumentLexicon rows is
+    compressed already and is left as it is.
+
+    returns:
+        int: number of postings lists written
+    """
+    if not DocumentLexicon.objects.exists():
+        return 0
+    PostingsList.objects.all().delete()
+    DocumentTermList.objects.all().delete()
+    postings = DocumentLexicon.objects.order_by('term_id', 'context_id').values_list(
+        'term_id', 'context_id', 'frequency')
+    postings_lists = []
+    written = 0
+    for term_id, term_postings in groupby(postings.iterator(), key=lambda posting: posting[0]):
+        postings_list = PostingsList(term_id=term_id)
+        set_postings(postings_list, ((doc_id, frequency) for _, doc_id, frequency in term_postings))
+        postings_lists.append(postings_list)
+        if len(postings_lists) == POSTINGS_BATCH_SIZE:
+            PostingsList.objects.bulk_create(postings_lists)
+            written += len(postings_lists)
+            postings_lists = []
+    PostingsList.objects.bulk_create(postings_lists)
+    written += len(postings_lists)
+
+    postings = DocumentLexicon.objects.order_by('context_id', 'term_id').values_list(
+        'context_id', 'term_id', 'frequency')
+    term_lists = []
+    for doc_id, doc_postings in groupby(postings.iterator(), key=lambda posting: posting[0]):
+        term_lists.append(DocumentTermList(context_id=doc_id, data=encode_term_frequencies(
+            {term_id: frequency for _, term_id, frequency in doc_postings})))
+        if len(term_lists) == POSTINGS_BATCH_SIZE:
+            DocumentTermList.objects.bulk_create(term_lists)
+            term_lists = []
+    DocumentTermList.objects.bulk_create(term_lists)
+    DocumentLexicon.objects.all().delete()
+    return written
+
+
+def load_document_norms(doc_norms, doc_ids):
+    """
+    Adds the norms of the given documents to doc_norms. Few documents are looked up with
+    pk__in batches, many are read with a single scan of the norm column.
+
+    doc_norms: dict mapping Document id to norm, updated in place
+    doc_ids:   list of Document ids missing from doc_norms
+
+    returns:
+        None
+    """
+    if len(doc_ids) > MAX_FILTERED_CANDIDATES:
+        doc_norms.update(Document.objects.values_list('id', 'norm').iterator())
+        return
+    for doc_id_batch in batched(doc_ids, DOCUMENT_BATCH_SIZE):
+        doc_norms.update(Document.objects.filter(pk__in=doc_id_batch).values_list('id', 'norm'))
+
+
+def read_compressed_postings(term_id, candidates=None, doc_id_range=None):
+    """
+    Reads a term's postings from its PostingsList row, together with each document's norm
+
+    term_id:      TermLexicon id
+    candidates:   set of Document ids, when given only their blocks are decoded
+    doc_id_range: tuple of the lowest Document id and the id just above the documents to read,
+                  when given only the blocks that overlap it are decoded
+
+    returns:
+        generator of (Document id, frequency, document norm) tuples
+    """
+    reader = load_postings_readers([term_id]).get(term_id)
+    if reader is None:
+        return
+    if candidates is not None:
+        postings = list(reader.lookup(candidates))
+    elif doc_id_range is not None:
+        postings = list(reader.iter_range(*doc_id_range))
+    else:
+        postings = list(reader)
+    doc_norms = {}
+    load_document_norms(doc_norms, [doc_id for doc_id, _ in postings])
+    for doc_id, frequency in postings:
+        if doc_id in doc_norms:
+            yield doc_id, frequency, doc_norms[doc_id]
+
+
+def count_compressed_matches(terms):
+    """
+    Counts the documents with a norm that contain at least one of the given terms, from
+    their PostingsList rows
+
+    terms: list of term strings
+
+    returns:
+        number of matching documents
+    """
+    term_ids = []
+    for term_batch in batched(terms, POSTINGS_BATCH_SIZE):
+        term_ids.extend(TermLexicon.objects.filter(term__in=term_batch).values_list('id', flat=True))
+    doc_ids = set()
+    for reader in load_postings_readers(term_ids).values():
+        doc_ids.update(doc_id for doc_id, _ in reader)
+    doc_norms = {}
+    load_document_norms(doc_norms, list(doc_ids))
+    return sum(1 for doc_id in doc_ids if doc_norms.get(doc_id, 0.0) > 0)
+
+
+def rank_compressed(query_term_frequency_map, k=None, offset=0):
+    """
+    Retrieval engine scoring documents term-at-a-time against the compressed PostingsList
+    rows, see indexer.retrieve.rank_in_database for the arguments. Each query term's
+    postings are read as one row; once MaxScore pruning narrows the candidates, only the
+    blocks that may contain them are decoded.
+    """
+    idf_terms, term_ids, max_scores = compute_idf_query_terms(query_term_frequency_map.keys())
+    tf_idf_query = weight_query_terms(query_term_frequency_map, idf_terms)
+    readers = load_postings_readers(term_ids.values())
+    doc_norms = {}
+
+    def read_postings(term_id, candidates=None):
+        reader = readers.get(term_id)
+        if reader is None:
+            return
+        postings = list(reader if candidates is None else reader.lookup(candidates))
+        load_document_norms(doc_norms, [doc_id for doc_id, _ in postings if doc_id not in doc_norms])
+        for doc_id, frequency in postings:
+            yield doc_id, frequency, doc_norms.get(doc_id, 0.0)
+
+    ranked = accumulate_top_scores(
+        tf_idf_query, idf_terms, term_ids, max_scores, None if k is None else offset + k, read_postings)
+    return tuple(doc_id for doc_id, _ in ranked[offset:])
@@ -0,0 +1,119 @@
+"""
+Query-result cache: rankings returned by retrieve are kept in the Django cache named by
+INDEXER_QUERY_CACHE, keyed on the analyzed query terms rather than the raw query string, so
+"Apples" and "apple" share an entry. Keys include the index generation, which indexing,
+deleting and refreshing norms all bump, so a ranking computed before a change is never
+served after it; stale entries are left to the cache backend's TTL and LRU eviction.
+
+Hit and miss counts are kept in the same cache, see get_query_cache_stats.
+"""
+
+from hashlib import sha1
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from indexer.models import CorpusStatistics
+from indexer.shards import get_current_database, get_shard_aliases, use_shard
+
+QUERY_CACHE_KEY_PREFIX = 'indexer:query'
+HITS_KEY = 'indexer:query-cache:hits'
+MISSES_KEY = 'indexer:query-cache:misses'
+
+
+def get_query_cache():
+    """Returns the cache rankings are kept in, None when INDEXER_QUERY_CACHE is not set"""
+    alias = getattr(settings, 'INDEXER_QUERY_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def get_index_generation():
+    """
+    Returns a string identifying the current state of the index: the generation of every
+    shard, followed by the manifest version when segments are enabled
+    """
+    generations = []
+    for alias in get_shard_aliases() or [None]:
+        with use_shard(alias):
+            generations.append(CorpusStatistics.get().generation)
+    # imported here, indexer.segments depends on indexer.retrieve which depends on this module
+    from indexer.segments import get_segment_dir, read_manifest, segments_enabled
+    if segments_enabled():
+        generations.append(read_manifest(get_segment_dir())['version'])
+    return '.'.join(str(generation) for generation in generations)
+
+
+def query_cache_usable():
+    """
+    Returns False inside a transaction on the index's databases: a ranking read there may
+    depend on uncommitted changes, and their generation is reused if they are rolled back
+    """
+    aliases = get_shard_aliases() or [get_current_database()]
+    return not any(connections[alias].in_atomic_block for alias in aliases)
+
+
+def query_cache_key(engine, query_term_frequency_map, k, offset, generation):
+    """Builds the cache key of a ranking, hashing the query so keys stay short"""
+    engine_name = f'{engine.__module__}.{engine.__qualname__}'
+    terms = ' '.join(f'{term}:{frequency}' for term, frequency in sorted(query_term_frequency_map.items()))
+    digest = sha1(f'{engine_name}|{k}|{offset}|{terms}'.encode('utf-8')).hexdigest()
+    return f'{QUERY_CACHE_KEY_PREFIX}:{generation}:{digest}'
+
+
+def count(cache, key):
+    """Increments a counter kept in the cache, counters do not expire"""
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted since add
+        cache.set(key, 1, timeout=None)
+
+
+def cached_ranking(engine, query_term_frequency_map, k=None, offset=0):
+    """
+    Ranks a query with a retrieval engine, or returns the ranking cached for the same
+    analyzed terms, k and offset in the current index generation
+
+    engine:                   retrieval engine function, see indexer.retrieve.rank_in_database
+    query_term_frequency_map: dict mapping parsed query term to its frequency in the query
+    k:                        number of documents to return, all matching documents when None
+    offset:                   number of best ranked documents to skip
+
+    returns:
+        tuple of Document ids, best match first
+    """
+    cache = get_query_cache()
+    if cache is None or not query_cache_usable():
+        return engine(query_term_frequency_map, k=k, offset=offset)
+
+    key = query_cache_key(engine, query_term_frequency_map, k, offset, get_index_generation())
+    ranked = cache.get(key)
+    if ranked is not None:
+        count(cache, HITS_KEY)
+        return ranked
+
+    count(cache, MISSES_KEY)
+    ranked = tuple(engine(query_term_frequency_map, k=k, offset=offset))
+    cache.set(key, ranked)
+    return ranked
+
+
+def get_query_cache_stats():
+    """
+    Returns the query cache's counters since they were last reset
+
+    returns:
+        dict with the number of 'hits' and 'misses' and the 'hit_rate', None before any lookup
+    """
+    cache = get_query_cache()
+    if cache is None:
+        return {'hits': 0, 'misses': 0, 'hit_rate': None}
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else None}
+
+
+def reset_query_cache_stats():
+    """Sets the query cache's hit and miss counters back to zero"""
+    cache = get_query_cache()
+    if cache is not None:
+        cache.delete_many([HITS_KEY, MISSES_KEY])
@@ -1,117 +1,472 @@
 # Authored by Kee Dong (yuqingd2)
 
-from indexer.models import Document, DocumentLexicon, TermLexicon
-from indexer.utils import is_alpha, is_stopword, stem 
+from collections import defaultdict
+from django.conf import settings
+from django.db.models.functions import Substr
+from django.utils.module_loading import import_string
+from indexer.models import CORPUS_STATISTICS_ID, CorpusStatistics, Document, DocumentLexicon, TermLexicon
+from indexer.query_cache import cached_ranking
+from indexer.shards import get_current_database, get_shard_aliases, map_shards, split_global_id, to_global_id
+from indexer.utils import batched, get_analyzer, tokenize
+from itertools import islice
+import heapq
 import math
 
+# candidate documents are looked up with context_id__in in batches of this size,
+# and only while there are at most MAX_FILTERED_CANDIDATES of them
+DOCUMENT_BATCH_SIZE = 250
+MAX_FILTERED_CANDIDATES = 2000
+# corpus statistics are read for at most this many terms per statement, SQLite caps the
+# number of parameters bound to one
+STATISTICS_BATCH_SIZE = 250
+# number of characters of a document's text loaded for display in results
+PREVIEW_LENGTH = 255
+DEFAULT_RETRIEVAL_ENGINE = 'indexer.retrieve.rank_in_database'
+APPROXIMATE_RETRIEVAL_ENGINE = 'indexer.champions.rank_champions'
+PARALLEL_RETRIEVAL_ENGINE = 'indexer.parallel.rank_parallel'
+
+
 def parse_query(query):
-    word_list = query.split()
-    query_term_frequency_map = {}
-    for word in word_list:
-        word = word.lower()
-        if is_alpha(word) and not is_stopword(word):
-            stemmed_word = stem(word)
-            if stemmed_word not in query_term_frequency_map.keys():
-                query_term_frequency_map[stemmed_word] = 1
-            else:
-                query_term_frequency_map[stemmed_word] += 1
-        
-    return query_term_frequency_map
+    return get_analyzer().analyze(tokenize(query))
 
 def get_total_documents():
-    #query index table to get total number of documents
-    return Document.objects.all().count()
+    #read the number of documents maintained by the indexer
+    return CorpusStatistics.get().document_count
 
 def get_total_related_documents(term):
     #takes term object as input
-    #query index table on number of documents who has the input term
-    return DocumentLexicon.objects.filter(term=term).count()
-    
-def inverse_document_frequency(term):
-    #takes term object as input
-    N = get_total_documents()
-    N_t = get_total_related_documents(term)
-    
+    #number of documents who has the input term, maintained by the indexer
+    return term.document_frequency
+
+def idf(N, N_t):
     if N_t > 0:
         return 1.0 + math.log(N / N_t)
     else:
         return 1.0
+
+def term_weight(tf, term_idf):
+    #smoothed tf times idf, used for both query and document vectors
+    # smoothed_tf = math.log(1+tf)
+    return math.log(1.2+tf) * term_idf
+
+def get_global_statistics(terms=None):
+    """
+    Reads the document count and document frequencies IDF is computed from, summed over every
+    shard when the index is sharded so that each shard's norms are on the scale of the global
+    IDF queries are weighted with. Shards are read in the calling thread, so the current
+    shard's uncommitted changes are included.
+
+    terms: iterable of terms whose document frequency is needed, every term when None
+
+    returns:
+        tuple of the document count and a dict mapping term to its document frequency
+    """
+    terms = None if terms is None else list(terms)
+    N = 0
+    document_frequencies = defaultdict(int)
+    for alias in get_shard_aliases() or [get_current_database()]:
+        N += CorpusStatistics.objects.using(alias).filter(pk=CORPUS_STATISTICS_ID).values_list(
+            'document_count', flat=True).first() or 0
+        term_sets = [TermLexicon.objects.using(alias)] if terms is None else [
+            TermLexicon.objects.using(alias).filter(term__in=term_batch)
+            for term_batch in batched(terms, STATISTICS_BATCH_SIZE)]
+        for term_set in term_sets:
+            for term, N_t in term_set.values_list('term', 'document_frequency').iterator():
+                document_frequencies[term] += N_t
+    return N, document_frequencies
+
+
+def get_term_idfs():
+    """
+    Returns a dict mapping the current database's TermLexicon ids to their idf, computed from
+    the global statistics when the index is sharded (see get_global_statistics)
+    """
+    N, document_frequencies = get_global_statistics()
+    return {term_id: idf(N, document_frequencies[term])
+            for term_id, term in TermLexicon.objects.values_list('id', 'term').iterator()}
+
+
+def inverse_document_frequency(term):
+    #takes term object as input
+    N = get_total_documents()
+    N_t = get_total_related_documents(term)
+    return idf(N, N_t)
     
 def compute_idf_corpus():
     idf_corpus = {}
-    term_set = TermLexicon.objects.all()
-    for t in term_set.iterator():
-        idf_corpus[t.term] = inverse_document_frequency(t)
+    N = get_total_documents()
+    # terms left behind by deleted documents are skipped, they weigh as unknown terms
+    term_set = TermLexicon.objects.filter(document_frequency__gt=0).values_list('term', 'document_frequency')
+    for term, N_t in term_set.iterator():
+        idf_corpus[term] = idf(N, N_t)
 
     return idf_corpus
-        
-def compute_tf_idf_query(query, idf_corpus):
+
+def compute_idf_query_terms(terms):
+    """
+    Computes IDF for the given terms only, rather than for the whole TermLexicon
+
+    terms: iterable of stemmed query terms
+
+    returns:
+        tuple of a dict mapping term to idf, a dict mapping term to TermLexicon id and a dict
+        mapping term to its max_score, for the terms that are present in the index
+    """
+    idf_terms = {}
+    term_ids = {}
+    max_scores = {}
+    terms = list(terms)
+    if not terms:
+        return idf_terms, term_ids, max_scores
+
+    N = get_total_documents()
+    term_set = TermLexicon.objects.filter(term__in=terms).values_list(
+        'id', 'term', 'document_frequency', 'max_score')
+    for term_id, term, N_t, max_score in term_set:
+        term_ids[term] = term_id
+        idf_terms[term] = idf(N, N_t)
+        max_scores[term] = max_score
+
+    return idf_terms, term_ids, max_scores
+
+def weight_query_terms(query_term_frequency_map, idf_corpus):
     tf_idf_query = {}
-    query_term_frequency_map = parse_query(query)
     for word in query_term_frequency_map.keys():
         tf = query_term_frequency_map[word]
-        # smoothed_tf = math.log(1+tf)
-        smoothed_tf = math.log(1.2+tf)
         if word in idf_corpus.keys():
-            tf_idf_query[word] = smoothed_tf * idf_corpus[word]
+            tf_idf_query[word] = term_weight(tf, idf_corpus[word])
         else:
-            tf_idf_query[word] = smoothed_tf
+            tf_idf_query[word] = term_weight(tf, 1.0)
 
     return tf_idf_query
 
+def compute_tf_idf_query(query, idf_corpus):
+    return weight_query_terms(parse_query(query), idf_corpus)
+
 def compute_tf_idf_document(document, idf_corpus):
+    from indexer.postings import compressed_postings_enabled, read_document_terms
     tf_idf_document = {}
+    if compressed_postings_enabled():
+        term_frequencies = read_document_terms([document.pk]).get(document.pk, {})
+        for term_id_batch in batched(list(term_frequencies), STATISTICS_BATCH_SIZE):
+            for term_id, word in TermLexicon.objects.filter(pk__in=term_id_batch).values_list('id', 'term'):
+                tf_idf_document[word] = term_weight(term_frequencies[term_id], idf_corpus[word])
+        return tf_idf_document
     lex_objs = DocumentLexicon.objects.filter(context=document)
     for t in lex_objs.iterator():
         termobj = t.term
         word = termobj.term
-        smoothed_tf = math.log(1.2+t.frequency)
-        tf_idf_document[word] = smoothed_tf * idf_corpus[word]
+        tf_idf_document[word] = term_weight(t.frequency, idf_corpus[word])
 
     return tf_idf_document
 
     
 def cosine_similarity_query_document(tf_idf_query, tf_idf_document):
     dot_product = 0
-    qry_mod = 0
-    doc_mod = 0
    
     for word in tf_idf_query.keys():
-        if word not in tf_idf_document.keys():
-            tf_idf_document_term = math.log(1.2)
-        else:
-            tf_idf_document_term = tf_idf_document[word]
-        
-        dot_product += tf_idf_query[word] * tf_idf_document_term
-        #||Query||
-        qry_mod += tf_idf_query[word] * tf_idf_query[word]
-        #||Document||
-        doc_mod += tf_idf_document_term * tf_idf_document_term
-    qry_mod = math.sqrt(qry_mod)
-    doc_mod = math.sqrt(doc_mod)
+        if word in tf_idf_document.keys():
+            dot_product += tf_idf_query[word] * tf_idf_document[word]
+    #||Query||
+    qry_mod = math.sqrt(sum(weight * weight for weight in tf_idf_query.values()))
+    #||Document||, over the whole document vector rather than just the query terms
+    doc_mod = math.sqrt(sum(weight * weight for weight in tf_idf_document.values()))
     #implement formula
     denominator = qry_mod * doc_mod
+    if denominator == 0:
+        return 0.0
     cos_sim = dot_product/denominator
     return cos_sim
 
 
-def retrieve(query):
-    idf_corpus = compute_idf_corpus()
-    tf_idf_query = compute_tf_idf_query(query, idf_corpus)
-    
-    similarity = {}
-    all_docs = Document.objects.all()
-    
-    for doc in all_docs.iterator():
-        tf_idf_document = compute_tf_idf_document(doc, idf_corpus)
-        doc_sim = cosine_similarity_query_document(tf_idf_query, tf_idf_document)
-        # print(f"{doc}: {doc_sim}")
-        if doc_sim < 1.0:  # completely non-similar documents are currently output as 1.0
-            similarity[doc] = doc_sim
-    # print(similarity)
-    
-    # ranked_similarity = tuple(sorted(similarity.items(), key=lambda item: item[1], reverse=True))
-    # print(similarity)
-    ranked_similarity = tuple(sorted(similarity, key=similarity.get, reverse=True))
+def rank_key(item):
+    #best score first, ties broken by indexing order
+    doc_id, score = item
+    return -score, doc_id
+
+
+def read_database_postings(term_id, candidates=None):
+    """
+    Reads a term's postings from the DocumentLexicon table, or from its PostingsList row when
+    compressed postings are enabled, together with each document's norm
+
+    term_id:    TermLexicon id
+    candidates: set of Document ids, when given postings of other documents may be skipped
+
+    returns:
+        generator of (Document id, frequency, document norm) tuples
+    """
+    from indexer.postings import compressed_postings_enabled, read_compressed_postings
+    if compressed_postings_enabled():
+        yield from read_compressed_postings(term_id, candidates)
+        return
+
+    postings = DocumentLexicon.objects.filter(term_id=term_id)
+    if candidates is not None and len(candidates) <= MAX_FILTERED_CANDIDATES:
+        posting_sets = [postings.filter(context_id__in=candidate_batch)
+                        for candidate_batch in batched(candidates, DOCUMENT_BATCH_SIZE)]
+    else:
+        posting_sets = [postings]
+
+    for posting_set in posting_sets:
+        yield from posting_set.values_list('context_id', 'frequency', 'context__norm').iterator()
+
+
+def accumulate_top_scores(tf_idf_query, idf_terms, term_ids, max_scores, k,
+                          read_postings=read_database_postings):
+    """
+    Finds the k best scoring documents term-at-a-time with MaxScore pruning.
+
+    Terms are processed from the largest possible contribution to the smallest. A term can
+    add at most its normalized query weight times its idf times its TermLexicon.max_score to
+    any cosine. max_score leaves idf out and is taken over the norms documents are scored
+    with, so the bound holds whatever IDF the query is weighted with and however stale the
+    norms are. Once the k-th best partial score exceeds what the remaining terms could add
+    together, documents not seen so far cannot enter the top k: the remaining terms' postings
+    are then only read for the surviving candidates. The pruning is exact, the top k are the
+    first k documents of the full ranking.
+
+    tf_idf_query:  dict mapping query term to its tf-idf weight
+    idf_terms:     dict mapping indexed query term to its idf
+    term_ids:      dict mapping indexed query term to its TermLexicon id
+    max_scores:    dict mapping indexed query term to its max_score, the most log(1.2 + tf) / norm
+                   of the term in any document
+    k:             number of documents to return, all matching documents without pruning when None
+    read_postings: function reading a term's postings, see read_database_postings
+
+    returns:
+        list of (Document id, cosine similarity) tuples, best first, at most k long
+    """
+    if not term_ids or (k is not None and k <= 0):
+        return []
+
+    qry_mod = math.sqrt(sum(weight * weight for weight in tf_idf_query.values()))
+    upper_bounds = {term: tf_idf_query[term] / qry_mod * idf_terms[term] * max_scores[term] for term in term_ids}
+    terms = sorted(term_ids, key=upper_bounds.get, reverse=True)
+
+    scores = {}
+    candidates = None  # None while any document can still enter the top k
+    for position, term in enumerate(terms):
+        remaining_bound = sum(upper_bounds[remaining_term] for remaining_term in terms[position + 1:])
+        query_weight = tf_idf_query[term] / qry_mod
+        term_idf = idf_terms[term]
+
+        for doc_id, frequency, doc_norm in read_postings(term_ids[term], candidates):
+            if doc_norm <= 0 or (candidates is not None and doc_id not in candidates):
+                continue
+            scores[doc_id] = scores.get(doc_id, 0.0) + \
+                query_weight * term_weight(frequency, term_idf) / doc_norm
+
+        if k is not None and len(scores) >= k:
+            threshold = heapq.nlargest(k, scores.values())[-1]
+            if threshold > remaining_bound:
+                candidates = {doc_id for doc_id, score in scores.items()
+                              if score + remaining_bound >= threshold}
+                scores = {doc_id: scores[doc_id] for doc_id in candidates}
+
+    if k is None:
+        return sorted(scores.items(), key=rank_key)
+    return heapq.nsmallest(k, scores.items(), key=rank_key)
+
+
+def rank_in_database(query_term_frequency_map, k=None, offset=0):
+    """
+    Retrieval engine scoring documents term-at-a-time against the DocumentLexicon table
+
+    query_term_frequency_map: dict mapping parsed query term to its frequency in the query
+    k:                        number of documents to return, all matching documents when None
+    offset:                   number of best ranked documents to skip
+
+    returns:
+        tuple of Document ids, best match first
+    """
+    idf_terms, term_ids, max_scores = compute_idf_query_terms(query_term_frequency_map.keys())
+    tf_idf_query = weight_query_terms(query_term_frequency_map, idf_terms)
+
+    # with k, only a bounded heap of the best offset + k documents is kept. Without it the same
+    # accumulation runs unpruned, so a page of results is always a slice of the full ranking
+    ranked = accumulate_top_scores(
+        tf_idf_query, idf_terms, term_ids, max_scores, None if k is None else offset + k)
+    return tuple(doc_id for doc_id, _ in ranked[offset:])
+
+
+def gather_query_statistics(query_term_frequency_map):
+    """
+    Gathers the query terms' statistics from every shard, or from the current database when
+    the index is not sharded, and combines their document counts and document frequencies
+    into global IDF
+
+    query_term_frequency_map: dict mapping parsed query term to its frequency in the query
+
+    returns:
+        tuple of a dict mapping term to idf, a dict mapping query term to its tf-idf weight and
+        a dict mapping shard alias (None when not sharded) to a tuple of a dict mapping term to
+        TermLexicon id and a dict mapping term to max_score, for the terms present in the shard
+    """
+    terms = list(query_term_frequency_map.keys())
+
+    def get_shard_statistics(alias):
+        term_set = TermLexicon.objects.filter(term__in=terms).values_list(
+            'id', 'term', 'document_frequency', 'max_score')
+        return get_total_documents(), list(term_set)
+
+    shard_statistics = dict(zip(get_shard_aliases() or [None], map_shards(get_shard_statistics)))
+    N = sum(shard_N for shard_N, _ in shard_statistics.values())
+    document_frequencies = defaultdict(int)
+    for _, term_set in shard_statistics.values():
+        for _, term, N_t, _ in term_set:
+            document_frequencies[term] += N_t
+    idf_terms = {term: idf(N, N_t) for term, N_t in document_frequencies.items()}
+    tf_idf_query = weight_query_terms(query_term_frequency_map, idf_terms)
+
+    shard_terms = {
+        alias: ({term: term_id for term_id, term, _, _ in term_set},
+                {term: max_score for _, term, _, max_score in term_set})
+        for alias, (_, term_set) in shard_statistics.items()}
+    return idf_terms, tf_idf_query, shard_terms
+
+
+def rank_shards(query_term_frequency_map, k=None, offset=0, select_postings=None):
+    """
+    Retrieval engine for a sharded index (see indexer.shards). The query terms' statistics
+    are gathered from every shard and combined into global IDF, then every shard ranks its
+    own documents term-at-a-time in parallel and the shards' best offset + k are merged.
+    Document norms are computed from the same global statistics (see
+    get_global_statistics), so every shard's scores are on the same scale.
+
+    query_term_frequency_map: dict mapping parsed query term to its frequency in the query
+    k:                        number of documents to return, all matching documents when None
+    offset:                   number of best ranked documents to skip
+    select_postings:          function called in each shard with the query terms' TermLexicon
+                              ids and offset + k when k is given, returning the read_postings
+                              function to rank with or None for read_database_postings
+
+    returns:
+        tuple of global Document ids, best match first
+    """
+    idf_terms, tf_idf_query, shard_terms = gather_query_statistics(query_term_frequency_map)
+    depth = None if k is None else offset + k
+
+    def rank_shard(alias):
+        term_ids, max_scores = shard_terms[alias]
+        read_postings = None
+        if select_postings is not None and depth is not None:
+            read_postings = select_postings(term_ids.values(), depth)
+        ranked = accumulate_top_scores(
+            tf_idf_query, idf_terms, term_ids, max_scores, depth, read_postings or read_database_postings)
+        return [(to_global_id(alias, doc_id), score) for doc_id, score in ranked]
+
+    # every shard's ranking is sorted already, and global ids keep each shard's tie order
+    ranked = heapq.merge(*map_shards(rank_shard), key=rank_key)
+    return tuple(doc_id for doc_id, _ in islice(ranked, offset, depth))
+
+
+def get_retrieval_engine():
+    """
+    Returns the engine function named by the INDEXER_RETRIEVAL_ENGINE setting, or rank_shards
+    when the index is sharded (rank_parallel when INDEXER_SCORING_WORKERS is set as well)
+    """
+    if get_shard_aliases():
+        if getattr(settings, 'INDEXER_SCORING_WORKERS', None):
+            return import_string(PARALLEL_RETRIEVAL_ENGINE)
+        return rank_shards
+    return import_string(getattr(settings, 'INDEXER_RETRIEVAL_ENGINE', DEFAULT_RETRIEVAL_ENGINE))
+
+
+def retrieve(query, k=None, offset=0, approximate=False):
+    """
+    Ranks the indexed documents against a query with the configured retrieval engine,
+    going through the query-result cache when INDEXER_QUERY_CACHE is set. Only document
+    ids are handled, see hydrate_documents and RankedDocuments for loading the documents
+    to display.
+
+    query:       query string
+    k:           number of documents to return, all matching documents when None
+    offset:      number of best ranked documents to skip, for pagination
+    approximate: True to only rank the documents in the query terms' champion lists
+                 when INDEXER_CHAMPION_LISTS is set, see indexer.champions
+
+    returns:
+        tuple of Document ids, best match first
+    """
+    query_term_frequency_map = parse_query(query)
+    if not query_term_frequency_map:
+        return ()
+
+    engine = import_string(APPROXIMATE_RETRIEVAL_ENGINE) if approximate else get_retrieval_engine()
+    return cached_ranking(engine, query_term_frequency_map, k=k, offset=offset)
+
+
+def count_matches(query):
+    """
+    Counts the indexed documents sharing at least one term with a query, the length of the
+    full ranking retrieve(query) returns, without scoring them
+
+    query: query string
+
+    returns:
+        number of matching documents
+    """
+    terms = list(parse_query(query).keys())
+    if not terms:
+        return 0
+
+    from indexer.postings import compressed_postings_enabled, count_compressed_matches
+    from indexer.segments import get_segment_index, segments_enabled
+    if segments_enabled():
+        return get_segment_index().count_matches(terms)
+
+    def count_shard_matches(alias):
+        if compressed_postings_enabled():
+            return count_compressed_matches(terms)
+        # documents without a norm are never ranked
+        postings = DocumentLexicon.objects.filter(term__term__in=terms, context__norm__gt=0)
+        return postings.values('context_id').distinct().count()
+
+    return sum(map_shards(count_shard_matches))
+
+
+def hydrate_documents(doc_ids):
+    """
+    Loads documents for display without their full text: only the title, URL and
+    a PREVIEW_LENGTH character preview of the text are read
+
+    doc_ids: sequence of Document ids
+
+    returns:
+        list of Document objects in the order of doc_ids, each with a preview attribute
+    """
+    # ids from a sharded index are global ids, the documents are read from their shards
+    sharded = bool(get_shard_aliases())
+    database_doc_ids = defaultdict(dict)  # database alias -> {Document id: id in doc_ids}
+    for doc_id in doc_ids:
+        alias, local_id = split_global_id(doc_id) if sharded else (get_current_database(), doc_id)
+        database_doc_ids[alias][local_id] = doc_id
+
+    docs = {}
+    for alias, local_ids in database_doc_ids.items():
+        for doc_id_batch in batched(list(local_ids), DOCUMENT_BATCH_SIZE):
+            doc_set = Document.objects.using(alias).filter(pk__in=doc_id_batch).only(
+                'id', 'title', 'url').annotate(preview=Substr('text', 1, PREVIEW_LENGTH))
+            docs.update((local_ids[doc.pk], doc) for doc in doc_set)
+    return [docs[doc_id] for doc_id in doc_ids if doc_id in docs]
+
+
+class RankedDocuments:
+    """
+    Sequence of ranked document ids that only hydrates the documents of the slices taken
+    from it, so paginating a ranking loads one page of rows rather than all of them. When
+    only the first pages are ranked, count is the length of the full ranking (see
+    count_matches), so a paginator still reports every page.
+    """
+    def __init__(self, doc_ids, count=None):
+        self.doc_ids = doc_ids
+        self.count = count
+
+    def __len__(self):
+        return len(self.doc_ids) if self.count is None else self.count
 
-    return ranked_similarity
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return hydrate_documents(self.doc_ids[key])
+        return hydrate_documents([self.doc_ids[key]])[0]
@@ -1,51 +1,137 @@
-from requests import get, ConnectionError
-from bs4 import BeautifulSoup
+import re
+from threading import Lock
+from django.conf import settings
+from django.utils.module_loading import import_string
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from indexer.utils import tokenize
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+USER_AGENT = 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.36'
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
+DEFAULT_MAX_BODY_BYTES = 10 * 1024 * 1024
+DEFAULT_POOL_SIZE = 16
+BODY_CHUNK_SIZE = 64 * 1024
+NOT_MODIFIED = 304
+DEFAULT_HTML_EXTRACTOR = 'indexer.extractors.extract_streaming'
 
 def get_words(full_page_text):
-    return full_page_text.split(" ")
+    """Returns a generator of the page's word tokens, so the word list is never built in memory"""
+    return tokenize(full_page_text)
 
 def get_full_page_text(raw_page_text):
-    lines = (line.strip() for line in raw_page_text.splitlines())
-    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-    text = '\n'.join(chunk for chunk in chunks if chunk)
-    text = text.replace('\n', ' ')
-    return text
+    """Collapses every run of whitespace in the page's text into a single space in one pass"""
+    return WHITESPACE_PATTERN.sub(' ', raw_page_text).strip()
+
+def get_html_extractor():
+    """Returns the extractor function named by the INDEXER_HTML_EXTRACTOR setting (see indexer.extractors)"""
+    return import_string(getattr(settings, 'INDEXER_HTML_EXTRACTOR', DEFAULT_HTML_EXTRACTOR))
+
 
-def scrape(url):
+_session = None
+_session_lock = Lock()
+
+def get_session():
+    """
+    Returns the process's shared requests Session, started on first use. Its pools keep up to
+    INDEXER_HTTP_POOL_SIZE connections to each host alive between requests, so repeated
+    requests to a host skip the TCP and TLS handshakes. It asks for gzip and deflate encoded
+    bodies, and brotli when the brotli package is installed.
     """
-    Scrapes a list of words from a given web page
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = getattr(settings, 'INDEXER_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE)
+            session = Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'User-Agent': USER_AGENT, 'Accept-Encoding': ACCEPT_ENCODING})
+            _session = session
+        return _session
 
-    url: url of page to scrape
+def get_timeouts():
+    """Returns the (connect, read) timeouts in seconds of a request"""
+    return (getattr(settings, 'INDEXER_HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+            getattr(settings, 'INDEXER_HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT))
 
-    Returns:
-        a tuple of True and dict of word_list, page_text, and page_title when page was successfully scraped
-        a tuple of False and dict of status_code when something went wrong on request
+class PageTooLargeError(Exception):
+    """Raised while a page's body is read, once it turns out to be larger than the limit"""
+
+class BodyStream:
     """
-    headers = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.36'
-    }
-    try:
-        request = get(url, headers=headers)
-    except ConnectionError:
-        return False, {'status_code': None}
+    Iterable over a streamed response's decompressed body, chunk by chunk, counting the bytes
+    read so far in size. The chunks are handed on as they arrive, so the body is never held
+    whole, and PageTooLargeError is raised as soon as it is larger than max_bytes.
+    """
+    def __init__(self, response, max_bytes):
+        self.response = response
+        self.max_bytes = max_bytes
+        self.size = 0
 
-    status_code = request.status_code
+    def __iter__(self):
+        content_length = self.response.headers.get('Content-Length', '')
+        if content_length.isdigit() and int(content_length) > self.max_bytes and \
+                not self.response.headers.get('Content-Encoding'):
+            raise PageTooLargeError(f'Page is larger than {self.max_bytes} bytes')
+        for chunk in self.response.iter_content(BODY_CHUNK_SIZE):
+            self.size += len(chunk)
+            if self.size > self.max_bytes:
+                raise PageTooLargeError(f'Page is larger than {self.max_bytes} bytes')
+            yield chunk
+
+def scrape(url, etag='', last_modified=''):
+    """
+    Scrapes a list of words from a given web page. With the validators the page was last
+    indexed with, the request is conditional and a page that has not changed is not downloaded.
 
-    if status_code != 200:
-        return False, {'status_code': status_code}
+    url:           url of page to scrape
+    etag:          ETag of the page when it was last scraped, sent as If-None-Match
+    last_modified: Last-Modified of the page when it was last scraped, sent as If-Modified-Since
 
-    soup = BeautifulSoup(request.text, 'html.parser')
+    Returns:
+        a tuple of True and dict of word_list (a lazy generator of words), page_text, page_title,
+            the page's etag and last_modified validators, its links and page_bytes, the size of
+            the response body, when page was successfully scraped
+        a tuple of True and dict of status_code 304 when the page has not been modified
+        a tuple of False and dict of status_code when something went wrong on request, and an
+            error when the page was larger than INDEXER_HTTP_MAX_BODY_BYTES
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    max_bytes = getattr(settings, 'INDEXER_HTTP_MAX_BODY_BYTES', DEFAULT_MAX_BODY_BYTES)
 
-    for script in soup(['script', 'style']):
-        script.decompose()
+    try:
+        with get_session().get(url, headers=headers, timeout=get_timeouts(), stream=True) as request:
+            status_code = request.status_code
+            if status_code == NOT_MODIFIED and headers:
+                return True, {'status_code': status_code}
+            if status_code != 200:
+                return False, {'status_code': status_code}
+            # without a charset in the Content-Type header the extractor detects the page's encoding
+            content_type = request.headers.get('Content-Type', '').lower()
+            encoding = request.encoding if 'charset' in content_type else None
+            # the extractor reads the body chunk by chunk while it is downloaded
+            body = BodyStream(request, max_bytes)
+            page_title, page_full_text, links = get_html_extractor()(body, encoding, request.url)
+    except PageTooLargeError as error:
+        return False, {'status_code': status_code, 'error': str(error)}
+    except RequestException:
+        return False, {'status_code': None}
 
-    page_title = soup.title.text.strip()
-    page_raw_text = soup.get_text()
-    page_full_text = get_full_page_text(page_raw_text)
     word_list = get_words(page_full_text)
     return True, {
         'status_code': status_code,
         'word_list': word_list,
         'page_full_text': page_full_text,
-        'page_title': page_title
+        'page_title': page_title,
+        'etag': request.headers.get('ETag', ''),
+        'last_modified': request.headers.get('Last-Modified', ''),
+        'links': links,
+        'page_bytes': body.size,
     }
@@ -0,0 +1,528 @@
+"""
+Segment-based index: with INDEXER_SEGMENTS enabled, indexing no longer touches TermLexicon
+or DocumentLexicon. Each batch of index() calls is written to a new immutable segment file
+holding the batch's postings and per-document term frequencies, and segments are opened
+read-only through mmap for querying.
+
+The segment directory (INDEXER_SEGMENT_DIR) holds the segment files and a manifest,
+segments.json, listing the live segments and the tombstones. Writers and the merger
+serialize on a lock file, while readers only read the manifest, which is always replaced
+atomically, so they never block on writers.
+
+Segment ids grow with every flush. Reindexing or deleting a document records a tombstone
+(document id -> id of the segment flushed with it): the document's postings in every older
+segment are dead. merge_segments compacts segments with a tiered policy, dropping dead
+postings and tombstones that no longer hide anything.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+import fcntl
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+from uuid import uuid4
+from django.conf import settings
+from indexer.postings import PostingsReader, encode_postings, encode_varint, read_varint
+from indexer.retrieve import accumulate_top_scores, idf, term_weight, weight_query_terms
+
+SEGMENT_MAGIC = b'SAVEITSG'
+SEGMENT_FORMAT_VERSION = 1
+# magic, format version, document count, term count, then the offsets of the postings,
+# forward and forward index sections. The document ids follow the header, then the terms.
+SEGMENT_HEADER = struct.Struct('<8sIIIQQQ')
+MANIFEST_NAME = 'segments.json'
+LOCK_NAME = 'segments.lock'
+DEFAULT_MERGE_FACTOR = 10
+# segments with fewer live documents than this all belong to the lowest merge tier
+DEFAULT_MERGE_FLOOR = 100
+# attempts at opening a manifest whose segments a concurrent merge may just have removed
+OPEN_ATTEMPTS = 5
+
+
+def segments_enabled():
+    """Returns True if index() writes segments instead of the database index (INDEXER_SEGMENTS)"""
+    return getattr(settings, 'INDEXER_SEGMENTS', False)
+
+
+def get_segment_dir():
+    """Returns the directory holding the segment files and their manifest"""
+    return str(settings.INDEXER_SEGMENT_DIR)
+
+
+def segment_file_name(segment_id):
+    # merged segments reuse the highest id of their inputs, the suffix keeps file names unique
+    return f'{segment_id:010d}-{uuid4().hex[:12]}.seg'
+
+
+def replace_file(path, content):
+    """Writes content to path atomically: readers see either the old or the new file"""
+    temporary_path = f'{path}.{uuid4().hex[:12]}.tmp'
+    with open(temporary_path, 'wb') as temporary_file:
+        temporary_file.write(content)
+        temporary_file.flush()
+        os.fsync(temporary_file.fileno())
+    os.replace(temporary_path, path)
+
+
+def write_segment(path, documents):
+    """
+    Writes an immutable segment file
+
+    path:      path of the segment file
+    documents: dict mapping Document id to a dict mapping term to its frequency in the document
+
+    returns:
+        None
+    """
+    doc_ids = sorted(documents)
+    terms = sorted({term for term_frequency_map in documents.values() for term in term_frequency_map})
+    term_ordinals = {term: ordinal for ordinal, term in enumerate(terms)}
+
+    postings = defaultdict(list)
+    for doc_id in doc_ids:
+        for term, frequency in documents[doc_id].items():
+            postings[term].append((doc_id, frequency))
+
+    term_section = bytearray()
+    postings_section = bytearray()
+    for term in terms:
+        data, skips, doc_count, _, _ = encode_postings(postings[term])
+        encoded_term = term.encode('utf-8')
+        encode_varint(len(encoded_term), term_section)
+        term_section += encoded_term
+        encode_varint(doc_count, term_section)
+        encode_varint(len(data), term_section)
+        encode_varint(len(skips), term_section)
+        postings_section += data
+        postings_section += skips
+
+    forward_section = bytearray()
+    forward_positions = []
+    for doc_id in doc_ids:
+        forward_positions.append(len(forward_section))
+        encode_varint(len(documents[doc_id]), forward_section)
+        for term, frequency in documents[doc_id].items():
+            encode_varint(term_ordinals[term], forward_section)
+            encode_varint(frequency, forward_section)
+
+    doc_section = struct.pack(f'<{len(doc_ids)}q', *doc_ids)
+    postings_offset = SEGMENT_HEADER.size + len(doc_section) + len(term_section)
+    forward_offset = postings_offset + len(postings_section)
+    forward_index_offset = forward_offset + len(forward_section)
+    header = SEGMENT_HEADER.pack(
+        SEGMENT_MAGIC, SEGMENT_FORMAT_VERSION, len(doc_ids), len(terms),
+        postings_offset, forward_offset, forward_index_offset)
+    replace_file(path, b''.join((
+        header, doc_section, term_section, postings_section, forward_section,
+        struct.pack(f'<{len(forward_positions)}Q', *forward_positions))))
+
+
+class Segment:
+    """Read-only view of a segment file through mmap"""
+    def __init__(self, segment_id, path):
+        self.segment_id = segment_id
+        self.file_name = os.path.basename(path)
+        with open(path, 'rb') as segment_file:
+            self.buffer = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, format_version, doc_count, term_count,
+         postings_offset, self.forward_offset, forward_index_offset) = SEGMENT_HEADER.unpack_from(self.buffer)
+        if magic != SEGMENT_MAGIC or format_version != SEGMENT_FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {SEGMENT_FORMAT_VERSION} index segment")
+
+        self.doc_ids = struct.unpack_from(f'<{doc_count}q', self.buffer, SEGMENT_HEADER.size)
+        self.forward_positions = struct.unpack_from(f'<{doc_count}Q', self.buffer, forward_index_offset)
+
+        # the term dictionary is parsed once, postings stay in the mapped file until read
+        self.terms = []  # ordinal -> term
+        self.term_postings = {}  # term -> (document frequency, data start, data end, skips end)
+        position = SEGMENT_HEADER.size + 8 * doc_count
+        postings_position = postings_offset
+        for _ in range(term_count):
+            length, position = read_varint(self.buffer, position)
+            term = self.buffer[position:position + length].decode('utf-8')
+            doc_frequency, position = read_varint(self.buffer, position + length)
+            data_length, position = read_varint(self.buffer, position)
+            skips_length, position = read_varint(self.buffer, position)
+            data_end = postings_position + data_length
+            self.term_postings[term] = (doc_frequency, postings_position, data_end, data_end + skips_length)
+            self.terms.append(term)
+            postings_position = data_end + skips_length
+
+    def postings(self, term):
+        """Returns a PostingsReader over the term's postings in this segment, None if it has none"""
+        if term not in self.term_postings:
+            return None
+        _, data_start, data_end, skips_end = self.term_postings[term]
+        return PostingsReader(self.buffer[data_start:data_end], self.buffer[data_end:skips_end])
+
+    def document_terms(self, ordinal):
+        """Returns a list of (term, frequency) tuples of the document at the given position"""
+        position = self.forward_offset + self.forward_positions[ordinal]
+        term_count, position = read_varint(self.buffer, position)
+        document_terms = []
+        for _ in range(term_count):
+            term_ordinal, position = read_varint(self.buffer, position)
+            frequency, position = read_varint(self.buffer, position)
+            document_terms.append((self.terms[term_ordinal], frequency))
+        return document_terms
+
+
+def empty_manifest():
+    return {'version': 0, 'next_segment_id': 1, 'segments': [], 'tombstones': {}}
+
+
+def read_manifest(segment_dir):
+    """Reads the segment manifest, tombstone keys are converted back to Document ids"""
+    try:
+        with open(os.path.join(segment_dir, MANIFEST_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return empty_manifest()
+    manifest['tombstones'] = {int(doc_id): bound for doc_id, bound in manifest['tombstones'].items()}
+    return manifest
+
+
+def write_manifest(segment_dir, manifest):
+    replace_file(os.path.join(segment_dir, MANIFEST_NAME), json.dumps(manifest).encode('utf-8'))
+
+
+@contextmanager
+def segment_lock(segment_dir):
+    """Serializes writers and mergers of a segment directory, readers never take it"""
+    os.makedirs(segment_dir, exist_ok=True)
+    with open(os.path.join(segment_dir, LOCK_NAME), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SegmentIndex:
+    """
+    Point-in-time view of the segments listed by one version of the manifest, with the
+    corpus statistics retrieval needs: live documents, document frequencies and norms
+    """
+    def __init__(self, version, segments, tombstones):
+        self.version = version
+        self.segments = segments
+        self.tombstones = tombstones
+        self.live_documents = {}  # Document id -> (segment, ordinal)
+        self.document_frequencies = defaultdict(int)
+        self.norms = {}  # computed lazily, see norm
+        for segment in segments:
+            for term, (doc_frequency, _, _, _) in segment.term_postings.items():
+                self.document_frequencies[term] += doc_frequency
+            for ordinal, doc_id in enumerate(segment.doc_ids):
+                if self.is_live(segment, doc_id):
+                    self.live_documents[doc_id] = (segment, ordinal)
+                else:
+                    for term, _ in segment.document_terms(ordinal):
+                        self.document_frequencies[term] -= 1
+
+    @classmethod
+    def open(cls, segment_dir):
+        """Opens the segments of the current manifest"""
+        for attempt in range(OPEN_ATTEMPTS):
+            manifest = read_manifest(segment_dir)
+            try:
+                segments = [Segment(entry['id'], os.path.join(segment_dir, entry['file']))
+                            for entry in manifest['segments']]
+            except FileNotFoundError:
+                # a merge replaced the manifest and removed its inputs meanwhile
+                if attempt == OPEN_ATTEMPTS - 1:
+                    raise
+                continue
+            return cls(manifest['version'], segments, manifest['tombstones'])
+
+    def is_live(self, segment, doc_id):
+        return self.tombstones.get(doc_id, 0) <= segment.segment_id
+
+    @property
+    def document_count(self):
+        return len(self.live_documents)
+
+    def norm(self, doc_id):
+        """Returns the length of a live document's tf-idf vector under the current statistics"""
+        if doc_id not in self.norms:
+            segment, ordinal = self.live_documents[doc_id]
+            N = self.document_count
+            self.norms[doc_id] = math.sqrt(sum(
+                term_weight(frequency, idf(N, self.document_frequencies[term])) ** 2
+                for term, frequency in segment.document_terms(ordinal)))
+        return self.norms[doc_id]
+
+    def read_postings(self, term, candidates=None):
+        """
+        Reads a term's live postings across all segments, see
+        indexer.retrieve.read_database_postings
+        """
+        for segment in self.segments:
+            reader = segment.postings(term)
+            if reader is None:
+                continue
+            for doc_id, frequency in (reader if candidates is None else reader.lookup(candidates)):
+                if self.is_live(segment, doc_id):
+                    yield doc_id, frequency, self.norm(doc_id)
+
+    def count_matches(self, terms):
+        """Counts the live documents holding any of the terms, see indexer.retrieve.count_matches"""
+        doc_ids = set()
+        for segment in self.segments:
+            for term in terms:
+                reader = segment.postings(term)
+                if reader is not None:
+                    doc_ids.update(doc_id for doc_id, _ in reader if self.is_live(segment, doc_id))
+        return len(doc_ids)
+
+    def rank(self, query_term_frequency_map, k=None, offset=0):
+        """Ranks the live documents against a query, see indexer.retrieve.rank_in_database"""
+        N = self.document_count
+        idf_terms = {term: idf(N, self.document_frequencies[term]) for term in query_term_frequency_map
+                     if self.document_frequencies.get(term, 0) > 0}
+        tf_idf_query = weight_query_terms(query_term_frequency_map, idf_terms)
+        # segments keep no max_score, a normalized weight is at most 1 so 1 / idf bounds it without idf
+        max_scores = {term: 1.0 / term_idf for term, term_idf in idf_terms.items()}
+        ranked = accumulate_top_scores(
+            tf_idf_query, idf_terms, {term: term for term in idf_terms}, max_scores,
+            None if k is None else offset + k, self.read_postings)
+        return tuple(doc_id for doc_id, _ in ranked[offset:])
+
+
+_segment_index = None
+_segment_index_lock = threading.Lock()
+
+def get_segment_index():
+    """
+    Returns this process's SegmentIndex, reopening it if the manifest changed since it was opened
+
+    returns:
+        SegmentIndex
+    """
+    global _segment_index
+    segment_dir = get_segment_dir()
+    version = read_manifest(segment_dir)['version']
+    with _segment_index_lock:
+        if _segment_index is None or _segment_index.version != version:
+            _segment_index = SegmentIndex.open(segment_dir)
+        return _segment_index
+
+def rank_segments(query_term_frequency_map, k=None, offset=0):
+    """
+    Retrieval engine scoring documents against the index segments, see
+    indexer.retrieve.rank_in_database for the arguments
+    """
+    return get_segment_index().rank(query_term_frequency_map, k=k, offset=offset)
+
+
+class SegmentWriter:
+    """Buffers analyzed documents and tombstones until they are flushed as one segment"""
+    def __init__(self):
+        self.documents = {}
+        self.deleted = set()
+
+    def add_document(self, doc_id, term_frequency_map, replaces=False):
+        self.documents[doc_id] = term_frequency_map
+        if replaces:
+            self.deleted.add(doc_id)
+
+    def delete_document(self, doc_id):
+        self.documents.pop(doc_id, None)
+        self.deleted.add(doc_id)
+
+    def flush(self):
+        """
+        Writes the buffered documents to a new segment and records the tombstones of the
+        documents they replace, all under the segment lock
+
+        returns:
+            int: id of the new segment, None if there was nothing to flush
+        """
+        if not (self.documents or self.deleted):
+            return None
+
+        segment_dir = get_segment_dir()
+        with segment_lock(segment_dir):
+            manifest = read_manifest(segment_dir)
+            segment_id = manifest['next_segment_id']
+            manifest['next_segment_id'] += 1
+            for doc_id in self.deleted:
+                manifest['tombstones'][doc_id] = segment_id
+            if self.documents:
+                file_name = segment_file_name(segment_id)
+                write_segment(os.path.join(segment_dir, file_name), self.documents)
+                manifest['segments'].append(
+                    {'id': segment_id, 'file': file_name, 'doc_count': len(self.documents)})
+            manifest['version'] += 1
+            write_manifest(segment_dir, manifest)
+
+        self.documents = {}
+        self.deleted = set()
+        return segment_id
+
+
+_batch = threading.local()
+
+@contextmanager
+def segment_batch():
+    """
+    Collects the documents indexed within the block into a single segment, flushed on exit.
+    Outside a batch every index() call writes its own segment.
+    """
+    if getattr(_batch, 'writer', None) is not None:
+        yield _batch.writer
+        return
+    _batch.writer = SegmentWriter()
+    try:
+        yield _batch.writer
+    finally:
+        writer = _batch.writer
+        _batch.writer = None
+        writer.flush()
+
+def add_document(doc_id, term_frequency_map, replaces=False):
+    """
+    Adds an analyzed document to the current segment batch
+
+    doc_id:             Document id
+    term_frequency_map: dict mapping term to its frequency in the document
+    replaces:           True if the document was indexed before and its old postings must be hidden
+
+    returns:
+        None
+    """
+    with segment_batch() as writer:
+        writer.add_document(doc_id, term_frequency_map, replaces=replaces)
+
+def delete_document(doc_id):
+    """Hides a document's postings in every segment written so far"""
+    with segment_batch() as writer:
+        writer.delete_document(doc_id)
+
+
+def select_merges(segment_sizes, merge_factor=DEFAULT_MERGE_FACTOR, merge_floor=DEFAULT_MERGE_FLOOR):
+    """
+    Tiered merge policy: segments are grouped in tiers by number of live documents, each tier
+    merge_factor times larger than the previous one, and every merge_factor segments of a tier
+    are merged together. Segments without live documents are always dropped.
+
+    segment_sizes: dict mapping segment id to its number of live documents
+    merge_factor:  number of segments of a tier merged together
+    merge_floor:   segments with fewer live documents all belong to the lowest tier
+
+    returns:
+        list of lists of segment ids to merge
+    """
+    merges = []
+    empty_segments = sorted(segment_id for segment_id, size in segment_sizes.items() if size == 0)
+    if empty_segments:
+        merges.append(empty_segments)
+
+    tiers = defaultdict(list)
+    for segment_id, size in sorted(segment_sizes.items()):
+        if size > 0:
+            tiers[int(math.log(max(size, merge_floor) / merge_floor, merge_factor))].append(segment_id)
+    for tier in sorted(tiers):
+        segment_ids = tiers[tier]
+        while len(segment_ids) >= merge_factor:
+            merges.append(segment_ids[:merge_factor])
+            segment_ids = segment_ids[merge_factor:]
+    return merges
+
+
+def merge_segments(segment_ids):
+    """
+    Merges segments into one, keeping only their live documents. The merged segment takes
+    the highest id of its inputs, so tombstones recorded meanwhile still apply to it. The
+    segment is written without the lock; the manifest swap is skipped if a concurrent merge
+    already replaced one of the inputs.
+
+    segment_ids: collection of segment ids
+
+    returns:
+        bool: True if the segments were merged
+    """
+    segment_dir = get_segment_dir()
+    snapshot = SegmentIndex.open(segment_dir)
+    inputs = [segment for segment in snapshot.segments if segment.segment_id in segment_ids]
+    if not inputs:
+        return False
+
+    documents = {}
+    for segment in inputs:
+        for ordinal, doc_id in enumerate(segment.doc_ids):
+            if snapshot.is_live(segment, doc_id):
+                documents[doc_id] = dict(segment.document_terms(ordinal))
+    merged_id = max(segment.segment_id for segment in inputs)
+    merged_file = segment_file_name(merged_id) if documents else None
+    if merged_file:
+        write_segment(os.path.join(segment_dir, merged_file), documents)
+
+    input_files = {segment.segment_id: segment.file_name for segment in inputs}
+    with segment_lock(segment_dir):
+        manifest = read_manifest(segment_dir)
+        current_files = {entry['id']: entry['file'] for entry in manifest['segments']}
+        if any(current_files.get(segment_id) != file_name for segment_id, file_name in input_files.items()):
+            if merged_file:
+                os.remove(os.path.join(segment_dir, merged_file))
+            return False
+
+        manifest['segments'] = [entry for entry in manifest['segments'] if entry['id'] not in input_files]
+        if merged_file:
+            manifest['segments'].append({'id': merged_id, 'file': merged_file, 'doc_count': len(documents)})
+        manifest['segments'].sort(key=lambda entry: entry['id'])
+        # a tombstone is kept while a segment older than its bound still holds the document,
+        # tombstones recorded after the snapshot are kept as they are
+        segment_doc_ids = {segment.segment_id: set(segment.doc_ids) for segment in snapshot.segments
+                           if segment.segment_id not in input_files}
+        segment_doc_ids[merged_id] = set(documents)
+        manifest['tombstones'] = {
+            doc_id: bound for doc_id, bound in manifest['tombstones'].items()
+            if snapshot.tombstones.get(doc_id) != bound or any(
+                doc_id in doc_ids for segment_id, doc_ids in segment_doc_ids.items() if segment_id < bound)}
+        manifest['version'] += 1
+        write_manifest(segment_dir, manifest)
+
+    # open readers keep their mappings of the removed files
+    for file_name in input_files.values():
+        os.remove(os.path.join(segment_dir, file_name))
+    return True
+
+
+def merge_tiers(merge_factor=None, full=False):
+    """
+    Runs merges chosen by select_merges until none is left, or merges every segment into one
+
+    merge_factor: number of segments of a tier merged together, INDEXER_SEGMENT_MERGE_FACTOR by default
+    full:         True to merge all segments into one
+
+    returns:
+        int: number of merges performed
+    """
+    if merge_factor is None:
+        merge_factor = getattr(settings, 'INDEXER_SEGMENT_MERGE_FACTOR', DEFAULT_MERGE_FACTOR)
+    segment_dir = get_segment_dir()
+    merges_performed = 0
+    while True:
+        snapshot = SegmentIndex.open(segment_dir)
+        segment_sizes = {segment.segment_id: 0 for segment in snapshot.segments}
+        for segment, _ in snapshot.live_documents.values():
+            segment_sizes[segment.segment_id] += 1
+
+        if full:
+            has_dead_documents = any(
+                len(segment.doc_ids) > segment_sizes[segment.segment_id] for segment in snapshot.segments)
+            merges = [list(segment_sizes)] if len(segment_sizes) > 1 or has_dead_documents else []
+        else:
+            merges = select_merges(segment_sizes, merge_factor)
+
+        merged = sum(merge_segments(segment_ids) for segment_ids in merges)
+        merges_performed += merged
+        # a full merge is done in one pass, tiered merges may cascade into the next tier
+        if full or not merged:
+            return merges_performed
@@ -0,0 +1,136 @@
+"""
+Hash partitioning of the index across shard databases. With INDEXER_SHARDS set to N,
+saveit/settings.py declares the SQLite databases shard_0 ... shard_{N-1}, each holding the
+indexer tables for the documents whose URL hashes to it. ShardRouter sends the indexer
+models' queries to the shard selected with use_shard, other apps stay on the default database,
+and so does the IndexJob queue, which is shared by every shard.
+
+Document ids are only unique within a shard, so ids handed out by retrieval are global ids
+that encode the shard: local id * N + shard number.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from hashlib import sha1
+import threading
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+SHARD_ALIAS_PREFIX = 'shard_'
+INDEXER_APP_LABEL = 'indexer'
+# indexer models kept once, on the default database, rather than in every shard
+UNSHARDED_MODELS = {'indexjob'}
+
+_routing = threading.local()
+
+
+def get_shard_aliases():
+    """Returns the aliases of the shard databases in shard number order, empty when not sharded"""
+    return sorted(
+        (alias for alias in settings.DATABASES if alias.startswith(SHARD_ALIAS_PREFIX)),
+        key=lambda alias: int(alias[len(SHARD_ALIAS_PREFIX):]))
+
+
+def shard_number(url, shard_count):
+    """Hashes a URL to a shard number, stable across processes unlike hash()"""
+    return int.from_bytes(sha1(url.encode('utf-8')).digest()[:8], 'big') % shard_count
+
+
+def shard_for_url(url):
+    """Returns the alias of the shard a URL's document belongs to, None when not sharded"""
+    aliases = get_shard_aliases()
+    return aliases[shard_number(url, len(aliases))] if aliases else None
+
+
+@contextmanager
+def use_shard(alias):
+    """Routes the indexer models' queries made by this thread within the block to a shard"""
+    previous_alias = getattr(_routing, 'alias', None)
+    _routing.alias = alias
+    try:
+        yield
+    finally:
+        _routing.alias = previous_alias
+
+
+def get_current_database():
+    """Returns the alias of the database this thread's indexer queries are routed to"""
+    return getattr(_routing, 'alias', None) or DEFAULT_DB_ALIAS
+
+
+def atomic(func):
+    """Like transaction.atomic, but on the database selected when the function is called"""
+    @wraps(func)
+    def atomic_in_current_database(*args, **kwargs):
+        with transaction.atomic(using=get_current_database()):
+            return func(*args, **kwargs)
+    return atomic_in_current_database
+
+
+def to_global_id(alias, doc_id):
+    """Converts a Document id local to a shard into an id unique across shards"""
+    aliases = get_shard_aliases()
+    return doc_id * len(aliases) + aliases.index(alias)
+
+
+def split_global_id(global_id):
+    """Converts a global Document id back into a tuple of its shard alias and local id"""
+    aliases = get_shard_aliases()
+    return aliases[global_id % len(aliases)], global_id // len(aliases)
+
+
+def map_shards(func):
+    """
+    Calls a function once per shard with the shard's queries routed to it, in up to
+    INDEXER_SHARD_WORKERS threads (one per shard by default). When the index is not
+    sharded the function is called once, with None, on the default database.
+
+    func: function taking a shard alias
+
+    returns:
+        list of the function's results, in shard number order
+    """
+    aliases = get_shard_aliases() or [None]
+    workers = getattr(settings, 'INDEXER_SHARD_WORKERS', None) or len(aliases)
+
+    def call_in_shard(alias):
+        with use_shard(alias):
+            return func(alias)
+
+    if workers <= 1:
+        return [call_in_shard(alias) for alias in aliases]
+
+    def call_in_worker(alias):
+        try:
+            return call_in_shard(alias)
+        finally:
+            # database connections are per thread, the worker's would otherwise leak
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(call_in_worker, aliases))
+
+
+class ShardRouter:
+    """Routes the indexer models to the shard selected with use_shard"""
+    def route(self, model, **hints):
+        if model._meta.app_label != INDEXER_APP_LABEL:
+            return None
+        if model._meta.model_name in UNSHARDED_MODELS:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return getattr(_routing, 'alias', None)
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, **hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db.startswith(SHARD_ALIAS_PREFIX):
+            return app_label == INDEXER_APP_LABEL and model_name not in UNSHARDED_MODELS
+        return None
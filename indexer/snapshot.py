@@ -0,0 +1,277 @@
+"""
+Index snapshots: a versioned binary dump of the corpus statistics, documents, lexicon and
+postings for warm starting a replica without re-scraping or copying the database file.
+
+A snapshot is a gzip stream starting with SNAPSHOT_MAGIC and the format version, followed
+by tagged records in foreign key order and an end tag. Integers are variable-length, floats
+are little-endian doubles and strings are length-prefixed UTF-8. A postings record holds
+one term's (document id delta, frequency) pairs ended by a zero delta. Both directions
+stream through fixed-size buffers, so neither side ever holds the whole snapshot.
+"""
+
+import gzip
+import struct
+from django.core.management.color import no_style
+from django.db import connections
+from indexer.champions import champion_lists_enabled, rebuild_champion_lists
+from indexer.impacts import impact_ordered_enabled, rebuild_impact_lists
+from indexer.models import (CORPUS_STATISTICS_ID, ChampionPosting, CorpusStatistics, Document, DocumentLexicon,
+                            DocumentTermList, ImpactList, PostingsList, TermLexicon)
+from indexer.postings import compressed_postings_enabled, encode_varint, iter_postings, rebuild_postings_lists
+from indexer.retrieve import PREVIEW_LENGTH
+from indexer.shards import atomic, get_current_database
+
+SNAPSHOT_MAGIC = b'SAVEITIX'
+SNAPSHOT_FORMAT_VERSION = 1
+STATISTICS_RECORD = b'S'
+DOCUMENT_RECORD = b'D'
+TERM_RECORD = b'T'
+POSTINGS_RECORD = b'P'
+END_RECORD = b'E'
+DOUBLE = struct.Struct('<d')
+# bytes buffered between writes to and reads from the compressed stream
+STREAM_BUFFER_SIZE = 1 << 16
+# rows inserted per bulk_create while loading
+LOAD_BATCH_SIZE = 2000
+
+
+class SnapshotFormatError(ValueError):
+    """Raised when a file is not a snapshot of a supported format version"""
+
+
+class SnapshotWriter:
+    """Buffered encoder of snapshot values onto a binary stream"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = bytearray()
+
+    def write_bytes(self, value):
+        self.buffer += value
+        if len(self.buffer) >= STREAM_BUFFER_SIZE:
+            self.flush()
+
+    def write_int(self, value):
+        encode_varint(value, self.buffer)
+        if len(self.buffer) >= STREAM_BUFFER_SIZE:
+            self.flush()
+
+    def write_float(self, value):
+        self.write_bytes(DOUBLE.pack(value))
+
+    def write_str(self, value):
+        encoded = value.encode('utf-8')
+        self.write_int(len(encoded))
+        self.write_bytes(encoded)
+
+    def flush(self):
+        self.stream.write(self.buffer)
+        self.buffer = bytearray()
+
+
+class SnapshotReader:
+    """Buffered decoder of snapshot values from a binary stream"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b''
+        self.position = 0
+
+    def fill(self, length):
+        """Makes sure at least length unread bytes are buffered"""
+        if self.position + length > len(self.buffer):
+            self.buffer = self.buffer[self.position:] + self.stream.read(max(STREAM_BUFFER_SIZE, length))
+            self.position = 0
+            if length > len(self.buffer):
+                raise SnapshotFormatError("Snapshot ended unexpectedly")
+
+    def read_bytes(self, length):
+        self.fill(length)
+        value = self.buffer[self.position:self.position + length]
+        self.position += length
+        return value
+
+    def read_int(self):
+        value = 0
+        shift = 0
+        while True:
+            if self.position >= len(self.buffer):
+                self.fill(1)
+            byte = self.buffer[self.position]
+            self.position += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def read_float(self):
+        return DOUBLE.unpack(self.read_bytes(DOUBLE.size))[0]
+
+    def read_str(self):
+        return self.read_bytes(self.read_int()).decode('utf-8')
+
+
+def dump_index(output_file, full_text=False):
+    """
+    Writes a snapshot of the current database's index
+
+    output_file: binary file object the compressed snapshot is written to
+    full_text:   True to include each document's full text rather than the PREVIEW_LENGTH
+                 characters displayed in results
+
+    returns:
+        dict mapping 'documents', 'terms' and 'postings' to the number of rows dumped
+    """
+    counts = {'documents': 0, 'terms': 0, 'postings': 0}
+    with gzip.GzipFile(fileobj=output_file, mode='wb') as stream:
+        writer = SnapshotWriter(stream)
+        writer.write_bytes(SNAPSHOT_MAGIC)
+        writer.write_int(SNAPSHOT_FORMAT_VERSION)
+
+        stats = CorpusStatistics.get()
+        writer.write_bytes(STATISTICS_RECORD)
+        for value in (stats.document_count, stats.changed_document_count, stats.generation):
+            writer.write_int(value)
+
+        documents = Document.objects.order_by('pk').values_list(
+            'pk', 'title', 'url', 'text', 'content_hash', 'etag', 'last_modified', 'norm')
+        for doc_id, title, url, text, content_hash, etag, last_modified, norm in documents.iterator():
+            writer.write_bytes(DOCUMENT_RECORD)
+            writer.write_int(doc_id)
+            if not full_text:
+                text = text[:PREVIEW_LENGTH]
+            for value in (title, url, text, content_hash, etag, last_modified):
+                writer.write_str(value)
+            writer.write_float(norm)
+            counts['documents'] += 1
+
+        terms = TermLexicon.objects.order_by('pk').values_list(
+            'pk', 'term', 'frequency', 'document_frequency', 'max_score')
+        for term_id, term, frequency, document_frequency, max_score in terms.iterator():
+            writer.write_bytes(TERM_RECORD)
+            writer.write_int(term_id)
+            writer.write_str(term)
+            writer.write_int(frequency)
+            writer.write_int(document_frequency)
+            writer.write_float(max_score)
+            counts['terms'] += 1
+
+        current_term_id = None
+        for term_id, doc_id, frequency in iter_postings():
+            if term_id != current_term_id:
+                if current_term_id is not None:
+                    writer.write_int(0)
+                writer.write_bytes(POSTINGS_RECORD)
+                writer.write_int(term_id)
+                current_term_id = term_id
+                last_doc_id = 0
+            writer.write_int(doc_id - last_doc_id)
+            writer.write_int(frequency)
+            last_doc_id = doc_id
+            counts['postings'] += 1
+        if current_term_id is not None:
+            writer.write_int(0)
+
+        writer.write_bytes(END_RECORD)
+        writer.flush()
+    return counts
+
+
+@atomic
+def load_index(input_file):
+    """
+    Replaces the current database's index with a snapshot, inserting rows with their
+    original ids in batches of LOAD_BATCH_SIZE
+
+    input_file: binary file object the compressed snapshot is read from
+
+    returns:
+        dict mapping 'documents', 'terms' and 'postings' to the number of rows loaded
+    """
+    counts = {'documents': 0, 'terms': 0, 'postings': 0}
+    with gzip.GzipFile(fileobj=input_file, mode='rb') as stream:
+        reader = SnapshotReader(stream)
+        try:
+            magic = reader.read_bytes(len(SNAPSHOT_MAGIC))
+        except (OSError, SnapshotFormatError):
+            magic = None
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotFormatError("Not an index snapshot")
+        format_version = reader.read_int()
+        if format_version != SNAPSHOT_FORMAT_VERSION:
+            raise SnapshotFormatError(
+                f"Snapshot format version {format_version} is not supported, expected {SNAPSHOT_FORMAT_VERSION}")
+
+        # plain DELETE statements, the ORM's delete() would load every row to collect relations
+        connection = connections[get_current_database()]
+        with connection.cursor() as cursor:
+            for model in (PostingsList, DocumentTermList, ChampionPosting, ImpactList, DocumentLexicon, TermLexicon,
+                          Document):
+                cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+        previous_generation = CorpusStatistics.get().generation
+
+        pending = {Document: [], TermLexicon: [], DocumentLexicon: []}
+
+        def save_pending(model, force=False):
+            if pending[model] and (force or len(pending[model]) >= LOAD_BATCH_SIZE):
+                model.objects.bulk_create(pending[model], batch_size=LOAD_BATCH_SIZE)
+                pending[model] = []
+
+        while True:
+            record = reader.read_bytes(1)
+            if record == STATISTICS_RECORD:
+                document_count = reader.read_int()
+                changed_document_count = reader.read_int()
+                # in-memory copies of the replaced index must see a new generation
+                generation = max(reader.read_int(), previous_generation) + 1
+                CorpusStatistics.objects.update_or_create(pk=CORPUS_STATISTICS_ID, defaults={
+                    'document_count': document_count,
+                    'changed_document_count': changed_document_count,
+                    'generation': generation})
+            elif record == DOCUMENT_RECORD:
+                doc_id = reader.read_int()
+                title, url, text, content_hash, etag, last_modified = (reader.read_str() for _ in range(6))
+                pending[Document].append(Document(
+                    pk=doc_id, title=title, url=url, text=text, content_hash=content_hash,
+                    etag=etag, last_modified=last_modified, norm=reader.read_float()))
+                counts['documents'] += 1
+                save_pending(Document)
+            elif record == TERM_RECORD:
+                save_pending(Document, force=True)
+                pending[TermLexicon].append(TermLexicon(
+                    pk=reader.read_int(), term=reader.read_str(), frequency=reader.read_int(),
+                    document_frequency=reader.read_int(), max_score=reader.read_float()))
+                counts['terms'] += 1
+                save_pending(TermLexicon)
+            elif record == POSTINGS_RECORD:
+                save_pending(Document, force=True)
+                save_pending(TermLexicon, force=True)
+                term_id = reader.read_int()
+                doc_id = 0
+                while True:
+                    delta = reader.read_int()
+                    if delta == 0:
+                        break
+                    doc_id += delta
+                    pending[DocumentLexicon].append(
+                        DocumentLexicon(context_id=doc_id, term_id=term_id, frequency=reader.read_int()))
+                    counts['postings'] += 1
+                    save_pending(DocumentLexicon)
+            elif record == END_RECORD:
+                break
+            else:
+                raise SnapshotFormatError(f"Unknown snapshot record {record!r}")
+
+        for model in pending:
+            save_pending(model, force=True)
+
+    # rows were inserted with explicit ids, let the databases that need it know
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Document, TermLexicon, DocumentLexicon]):
+            cursor.execute(sql)
+    if compressed_postings_enabled():
+        # the postings were loaded into DocumentLexicon, move them into the compressed lists
+        rebuild_postings_lists()
+    if champion_lists_enabled():
+        rebuild_champion_lists()
+    if impact_ordered_enabled():
+        rebuild_impact_lists()
+    return counts
@@ -0,0 +1,164 @@
+"""
+In-memory retrieval engine: the whole index is loaded into a compressed sparse row (CSR)
+matrix of tf-idf weights, one row per term, and queries are scored with vectorized NumPy
+operations instead of iterating over ORM rows. Meant for corpora that fit in RAM; select
+it with INDEXER_RETRIEVAL_ENGINE = 'indexer.sparse.rank_in_memory'.
+"""
+
+from array import array
+import math
+from threading import Lock
+from django.core.exceptions import ImproperlyConfigured
+from indexer.models import CorpusStatistics, TermLexicon
+from indexer.postings import iter_postings
+from indexer.retrieve import idf, term_weight
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed by this engine
+    np = None
+
+
+class SparseIndex:
+    """
+    Term-major CSR matrix of the index: the postings of the term at row r are the column
+    positions indices[indptr[r]:indptr[r + 1]] with tf-idf weights data[indptr[r]:indptr[r + 1]].
+    Column positions map to Document ids through doc_ids.
+    """
+    def __init__(self, generation, term_rows, idf_terms, indptr, indices, data, doc_ids, norms):
+        self.generation = generation
+        self.term_rows = term_rows  # term -> row
+        self.idf_terms = idf_terms  # row -> idf
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.doc_ids = doc_ids  # column -> Document id
+        self.norms = norms  # column -> length of the document's tf-idf vector
+
+    @classmethod
+    def load(cls):
+        """
+        Builds the matrix from TermLexicon and the postings (see indexer.postings.iter_postings),
+        streaming them into compact typed arrays rather than model instances
+
+        returns:
+            SparseIndex
+        """
+        if np is None:
+            raise ImproperlyConfigured("The in-memory retrieval engine requires NumPy")
+
+        stats = CorpusStatistics.get()
+        N = stats.document_count
+
+        term_set = TermLexicon.objects.filter(document_frequency__gt=0).order_by('id').values_list(
+            'id', 'term', 'document_frequency')
+        term_ids = array('q')
+        term_rows = {}
+        idf_terms = array('d')
+        indexed_term_ids = set()
+        for row, (term_id, term, N_t) in enumerate(term_set.iterator()):
+            indexed_term_ids.add(term_id)
+            term_ids.append(term_id)
+            term_rows[term] = row
+            idf_terms.append(idf(N, N_t))
+        term_ids = np.frombuffer(term_ids, dtype=np.int64)
+        idf_terms = np.frombuffer(idf_terms, dtype=np.float64)
+
+        posting_term_ids = array('q')
+        posting_doc_ids = array('q')
+        frequencies = array('d')
+        for term_id, doc_id, frequency in iter_postings():
+            if term_id not in indexed_term_ids:
+                continue
+            posting_term_ids.append(term_id)
+            posting_doc_ids.append(doc_id)
+            frequencies.append(frequency)
+        posting_term_ids = np.frombuffer(posting_term_ids, dtype=np.int64)
+        posting_doc_ids = np.frombuffer(posting_doc_ids, dtype=np.int64)
+        frequencies = np.frombuffer(frequencies, dtype=np.float64)
+
+        rows = np.searchsorted(term_ids, posting_term_ids)
+        doc_ids, columns = np.unique(posting_doc_ids, return_inverse=True)
+        weights = np.log(1.2 + frequencies) * idf_terms[rows]
+        norms = np.sqrt(np.bincount(columns, weights=weights * weights, minlength=len(doc_ids)))
+
+        order = np.lexsort((columns, rows))
+        indptr = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(term_ids)), out=indptr[1:])
+
+        return cls(
+            stats.generation, term_rows, idf_terms, indptr,
+            columns[order].astype(np.int32), weights[order], doc_ids, norms)
+
+    def rank(self, query_term_frequency_map, k=None, offset=0):
+        """
+        Scores documents with a sparse matrix-vector product restricted to the query's rows
+
+        query_term_frequency_map: dict mapping parsed query term to its frequency in the query
+        k:                        number of documents to return, all matching documents when None
+        offset:                   number of best ranked documents to skip
+
+        returns:
+            tuple of Document ids, best match first
+        """
+        rows = []
+        query_weights = []
+        qry_mod = 0.0
+        for term, tf in query_term_frequency_map.items():
+            row = self.term_rows.get(term)
+            weight = term_weight(tf, self.idf_terms[row] if row is not None else 1.0)
+            qry_mod += weight * weight
+            if row is not None:
+                rows.append(row)
+                query_weights.append(weight)
+        if not rows:
+            return ()
+        qry_mod = math.sqrt(qry_mod)
+
+        starts = self.indptr[rows]
+        lengths = self.indptr[np.array(rows) + 1] - starts
+        positions = np.concatenate([np.arange(start, start + length) for start, length in zip(starts, lengths)])
+        columns = self.indices[positions]
+        contributions = self.data[positions] * np.repeat(query_weights, lengths)
+
+        candidates, candidate_positions = np.unique(columns, return_inverse=True)
+        scores = np.bincount(candidate_positions, weights=contributions) / (self.norms[candidates] * qry_mod)
+        candidate_doc_ids = self.doc_ids[candidates]
+
+        if k is not None and offset + k < len(scores):
+            # partial selection of the best offset + k, only those get sorted
+            top = np.argpartition(-scores, offset + k - 1)[:offset + k]
+        else:
+            top = np.arange(len(scores))
+        # best score first, ties broken by indexing order
+        top = top[np.lexsort((candidate_doc_ids[top], -scores[top]))]
+
+        ranked_ids = candidate_doc_ids[top][offset:]
+        if k is not None:
+            ranked_ids = ranked_ids[:k]
+        return tuple(int(doc_id) for doc_id in ranked_ids)
+
+
+_sparse_index = None
+_sparse_index_lock = Lock()
+
+def get_sparse_index():
+    """
+    Returns this process's SparseIndex, rebuilding it if the index changed since it was loaded
+
+    returns:
+        SparseIndex
+    """
+    global _sparse_index
+    generation = CorpusStatistics.get().generation
+    with _sparse_index_lock:
+        if _sparse_index is None or _sparse_index.generation != generation:
+            _sparse_index = SparseIndex.load()
+        return _sparse_index
+
+def rank_in_memory(query_term_frequency_map, k=None, offset=0):
+    """
+    Retrieval engine scoring documents against the in-memory SparseIndex, see
+    indexer.retrieve.rank_in_database for the arguments
+    """
+    return get_sparse_index().rank(query_term_frequency_map, k=k, offset=offset)
@@ -0,0 +1,109 @@
+from django.core.management import call_command
+from django.db.models import Count
+from unittest import mock
+from django.test import TestCase, override_settings
+from faker import Faker
+from indexer.champions import champion_postings, count_champion_union, rank_champions, rebuild_champion_lists, update_champion_lists
+from indexer.index import delete_documents, index
+from indexer.models import ChampionPosting, Document, TermLexicon
+from indexer.retrieve import parse_query, rank_in_database, retrieve
+from indexer.views import RetrievedDocumentView
+
+CHAMPION_LIST_SIZE = 4
+
+
+def champion_lists():
+    """Returns the champion lists as a dict mapping term id to the set of their document ids"""
+    lists = {}
+    for term_id, doc_id in ChampionPosting.objects.values_list('term_id', 'context_id'):
+        lists.setdefault(term_id, set()).add(doc_id)
+    return lists
+
+
+@override_settings(INDEXER_CHAMPION_LISTS=True, INDEXER_CHAMPION_LIST_SIZE=CHAMPION_LIST_SIZE)
+class ChampionListsTestCase(TestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        self.urls = [faker.url() for _ in range(12)]
+        for num, url in enumerate(self.urls):
+            # persimmon is in every document, more often in later ones
+            text = faker.paragraph(nb_sentences=10) + ' persimmon' * (num % 6 + 1)
+            index(text.split(' '), faker.text(max_nb_chars=50).title(), url, text)
+        self.persimmonId = TermLexicon.objects.get(term='persimmon').pk
+
+    def testListsAreBounded(self):
+        sizes = ChampionPosting.objects.values('term_id').annotate(size=Count('id')).values_list('size', flat=True)
+        self.assertTrue(len(sizes) > 0)
+        self.assertTrue(max(sizes) <= CHAMPION_LIST_SIZE)
+        self.assertTrue(len(champion_lists()[self.persimmonId]) == CHAMPION_LIST_SIZE)
+
+    def testTiedLowestScoresLoseOneEntry(self):
+        ChampionPosting.objects.filter(term_id=self.persimmonId).update(score=0.1)
+        tied = list(ChampionPosting.objects.filter(term_id=self.persimmonId).order_by('id').values_list(
+            'context_id', flat=True))
+        newDoc = Document.objects.create(title='Persimmons', url='http://persimmon.com', text='persimmon')
+        update_champion_lists(newDoc.pk, {self.persimmonId: 0.5})
+        # only the first of the tied entries by id is evicted
+        self.assertTrue(champion_lists()[self.persimmonId] == set(tied[1:]) | {newDoc.pk})
+
+    def testRebuildKeepsBestScores(self):
+        self.assertTrue(rebuild_champion_lists() == ChampionPosting.objects.count())
+        # a one-term query ranks documents by their normalized weight of the term
+        best = set(rank_in_database(parse_query("persimmon"), k=CHAMPION_LIST_SIZE))
+        self.assertTrue(champion_lists()[self.persimmonId] == best)
+
+    def testApproximateRankingOfChampions(self):
+        rebuild_champion_lists()
+        queryMap = parse_query("persimmon")
+        self.assertTrue(rank_champions(queryMap, k=3) == rank_in_database(queryMap, k=3))
+        self.assertTrue(retrieve("persimmon", k=3, approximate=True) == rank_in_database(queryMap, k=3))
+
+    def testUnionOnlyIsScored(self):
+        rebuild_champion_lists()
+        queryMap = parse_query("persimmon")
+        ranked = rank_champions(queryMap, k=CHAMPION_LIST_SIZE - 1, offset=1)
+        self.assertTrue(set(ranked) <= champion_lists()[self.persimmonId])
+
+    def testFallbackWithTooFewCandidates(self):
+        queryMap = parse_query("persimmon")
+        self.assertTrue(champion_postings([self.persimmonId], CHAMPION_LIST_SIZE + 1) is None)
+        self.assertTrue(rank_champions(queryMap, k=10) == rank_in_database(queryMap, k=10))
+
+    def testDeletedDocumentsLeaveLists(self):
+        delete_documents(self.urls[:6])
+        remaining = set(Document.objects.values_list('pk', flat=True))
+        self.assertTrue(set(ChampionPosting.objects.values_list('context_id', flat=True)) <= remaining)
+
+    def testBuildCommand(self):
+        ChampionPosting.objects.all().delete()
+        call_command('build_champion_lists')
+        self.assertTrue(len(champion_lists()[self.persimmonId]) == CHAMPION_LIST_SIZE)
+
+    @override_settings(INDEXER_CHAMPION_LISTS=False)
+    def testExactWhenDisabled(self):
+        queryMap = parse_query("persimmon")
+        self.assertTrue(retrieve("persimmon", k=2, approximate=True) == rank_in_database(queryMap, k=2))
+
+    def resultPages(self, query):
+        pages = []
+        with mock.patch.object(RetrievedDocumentView, 'paginate_by', 2):
+            response = self.client.get(f'/results/{query}')
+            for number in range(1, response.context['paginator'].num_pages + 1):
+                pageResponse = self.client.get(f'/results/{query}?page={number}')
+                pages.append([doc.pk for doc in pageResponse.context['object_list']])
+        return response.context['paginator'].count, pages
+
+    def testResultsViewIsExactByDefault(self):
+        count, pages = self.resultPages('persimmon')
+        self.assertTrue(count == 12 and sum(pages, []) == list(rank_in_database(parse_query("persimmon"))))
+
+    @override_settings(INDEXER_APPROXIMATE_RESULTS=True)
+    def testApproximateResultsViewPagesTheUnion(self):
+        rebuild_champion_lists()
+        queryMap = parse_query("persimmon")
+        self.assertTrue(count_champion_union(queryMap) == CHAMPION_LIST_SIZE)
+        # every page, the last one included, is a slice of the same ranking of the union
+        count, pages = self.resultPages('persimmon')
+        self.assertTrue(count == CHAMPION_LIST_SIZE and len(pages) == 2)
+        self.assertTrue(sum(pages, []) == list(rank_champions(queryMap, k=CHAMPION_LIST_SIZE)))
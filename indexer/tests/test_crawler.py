@@ -0,0 +1,130 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import tempfile
+import threading
+import time
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase
+from faker import Faker
+from indexer.crawler import Crawler, read_seed_file
+from indexer.models import Document
+from indexer.writer import IndexWriter
+
+
+class LocalSite:
+    """A threaded HTTP server on 127.0.0.1 serving a dict of paths to HTML, recording every request"""
+    def __init__(self, pages, response_delay=0.0):
+        site = self
+        self.pages = pages
+        self.requests = []  # (path, start, end)
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                start = time.monotonic()
+                with site.lock:
+                    site.active += 1
+                    site.max_active = max(site.max_active, site.active)
+                time.sleep(response_delay)
+                body = site.pages.get(self.path)
+                self.send_response(200 if body is not None else 404)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.end_headers()
+                if body is not None:
+                    self.wfile.write(body.encode('utf-8'))
+                with site.lock:
+                    site.active -= 1
+                    site.requests.append((self.path, start, time.monotonic()))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path, host='127.0.0.1'):
+        return f'http://{host}:{self.port}{path}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def html_page(title, text, links=()):
+    anchors = ''.join(f'<a href="{link}">{link}</a>' for link in links)
+    return f'<html><head><title>{title}</title></head><body><p>{text}</p>{anchors}</body></html>'
+
+
+class SeedFileTestCase(SimpleTestCase):
+    def testCommentsAndBlankLines(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as seedFile:
+            seedFile.write('# seeds\nhttp://a.com/\n\n  http://b.com/page  \n  # indented comment\n')
+        try:
+            self.assertTrue(read_seed_file(seedFile.name) == ['http://a.com/', 'http://b.com/page'])
+        finally:
+            os.remove(seedFile.name)
+
+
+# the writer commits from its own thread, so the pages it writes must be visible across connections
+class CrawlerTestCase(TransactionTestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        self.texts = [faker.paragraph(nb_sentences=5) for _ in range(10)]
+
+    def testFollowsSameSiteLinksToDepth(self):
+        with LocalSite({}) as site:
+            site.pages.update({
+                '/': html_page('Home', self.texts[0], ['/a', 'b#section', site.url('/other', host='localhost')]),
+                '/a': html_page('A', self.texts[1], ['/c', '/']),
+                '/b': html_page('B', self.texts[2], ['/missing']),
+                '/c': html_page('C', self.texts[3]),
+            })
+            with IndexWriter(batch_size=10, flush_interval=0.1) as writer:
+                stats = Crawler(writer, concurrency=4, host_delay=0, max_depth=1).crawl([site.url('/')])
+            fetchedPaths = sorted(path for path, _, _ in site.requests)
+        self.assertTrue(fetchedPaths == ['/', '/a', '/b'])
+        self.assertTrue(set(Document.objects.values_list('url', flat=True)) ==
+                        {site.url('/'), site.url('/a'), site.url('/b')})
+        self.assertTrue(stats.fetched == 3 and stats.indexed == 3 and stats.failed == 0)
+        self.assertTrue(stats.bytes == sum(len(site.pages[path].encode('utf-8')) for path in fetchedPaths))
+        self.assertTrue(stats.pages_per_second() > 0 and stats.bytes_per_second() > 0)
+
+    def testHostPoliteness(self):
+        pages = {f'/{num}': html_page(f'Page {num}', self.texts[num]) for num in range(8)}
+        with LocalSite(pages, response_delay=0.05) as site:
+            seeds = [site.url(f'/{num}', host='127.0.0.1' if num % 2 else 'localhost') for num in range(8)]
+            with IndexWriter(batch_size=10, flush_interval=0.1) as writer:
+                stats = Crawler(writer, concurrency=8, host_concurrency=1, host_delay=0.2).crawl(seeds)
+            requests = sorted(site.requests, key=lambda request: request[1])
+        self.assertTrue(stats.fetched == 8 and Document.objects.count() == 8)
+        # the two hosts are fetched side by side, each with one request at a time, 0.2s apart
+        self.assertTrue(site.max_active == 2)
+        for paths in ({'/1', '/3', '/5', '/7'}, {'/0', '/2', '/4', '/6'}):
+            starts = [start for path, start, _ in requests if path in paths]
+            self.assertTrue(all(later - earlier >= 0.19 for earlier, later in zip(starts, starts[1:])))
+
+    def testMaxPagesAndFailures(self):
+        with LocalSite({'/': html_page('Home', self.texts[0], ['/a', '/b', '/c'])}) as site:
+            with IndexWriter(batch_size=10, flush_interval=0.1) as writer:
+                stats = Crawler(writer, concurrency=1, host_delay=0, max_depth=1, max_pages=3).crawl(
+                    [site.url('/')])
+        self.assertTrue(len(site.requests) == 3)
+        self.assertTrue(stats.fetched == 1 and stats.failed == 2)
+
+    def testCommand(self):
+        with LocalSite({'/': html_page('Home', self.texts[0], ['/a']), '/a': html_page('A', self.texts[1])}) as site:
+            with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as seedFile:
+                seedFile.write(site.url('/') + '\n')
+            try:
+                call_command('crawl', seedFile.name, '--depth', '1', '--host-delay', '0', '--flush-interval', '0.1')
+            finally:
+                os.remove(seedFile.name)
+        self.assertTrue(Document.objects.count() == 2)
@@ -0,0 +1,74 @@
+from contextlib import redirect_stdout
+import codecs
+import io
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from faker import Faker
+from indexer.extractors import extract_streaming, extract_with_soup
+from indexer.scraper import get_html_extractor
+
+PAGE_URL = 'http://example.com/dir/page'
+
+
+class ExtractorsTestCase(SimpleTestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        self.paragraphs = [faker.paragraph(nb_sentences=5) for _ in range(20)]
+
+    def assertExtractorsAgree(self, body, encoding=None, chunkSize=None):
+        chunkSize = chunkSize or len(body)
+        chunks = [body[start:start + chunkSize] for start in range(0, len(body), chunkSize)]
+        streamed = extract_streaming(iter(chunks), encoding, PAGE_URL)
+        self.assertTrue(streamed == extract_with_soup(iter(chunks), encoding, PAGE_URL))
+        return streamed
+
+    def testHiddenTextEntitiesAndLinks(self):
+        body = (b'<!DOCTYPE html><html><head><title> Fruit <b>and</b> &amp; trees </title>'
+                b'<script>if (a < b) { hidden(); }</script><style>p { color: red }</style></head>'
+                b'<body><!-- comment --><p>Ripe&nbsp;persimmons&#33;</p>\n\t <p>  spread \n out  </p>'
+                b'<template>hidden</template><![CDATA[kept]]><a href>itself</a>'
+                b'<a href="../other#section" href="/last">last</a><a href="mailto:someone">mail</a>'
+                b'<a name="anchor">no link</a></body></html>')
+        title, text, links = self.assertExtractorsAgree(body)
+        self.assertTrue(title == 'Fruit and & trees')
+        self.assertTrue(text == 'Fruit and & trees Ripe persimmons! spread out keptitselflastmailno link')
+        self.assertTrue(links == [PAGE_URL, 'http://example.com/last'])
+
+    def testMalformedLinksAreSkipped(self):
+        body = b'<html><head><title>Links</title></head><body><a href="http://[::1">bad</a><a href="/ok">ok</a></body></html>'
+        title, _, links = self.assertExtractorsAgree(body)
+        self.assertTrue(title == 'Links' and links == ['http://example.com/ok'])
+
+    def testLargePageAcrossChunks(self):
+        paragraphs = ''.join(f'<p>{paragraph} été ☃</p>\n' for paragraph in self.paragraphs)
+        body = f'<html><head><title>Large</title></head><body>{paragraphs}</body></html>'.encode('utf-8')
+        # multibyte characters and tags are split across the chunks fed to the parser
+        title, text, _ = self.assertExtractorsAgree(body, 'utf-8', chunkSize=7)
+        self.assertTrue(title == 'Large' and self.paragraphs[-1] + ' été ☃' in text)
+
+    def testDetectedEncodings(self):
+        page = '<html><head><meta charset="iso-8859-1"><title>Café</title></head><body>naïve</body></html>'
+        self.assertTrue(self.assertExtractorsAgree(page.encode('latin-1'))[1] == 'Cafénaïve')
+        # the declaration is sniffed from the first chunks, however small they are
+        body = page.replace('naïve', 'naïve ' * 300).encode('latin-1')
+        self.assertTrue(self.assertExtractorsAgree(body, chunkSize=7)[1].startswith('Cafénaïve naïve'))
+        page = '<html><head><title>Café</title></head><body>naïve</body></html>'
+        self.assertTrue(self.assertExtractorsAgree(codecs.BOM_UTF8 + page.encode('utf-8'))[0] == 'Café')
+
+    def testMissingTitle(self):
+        self.assertTrue(self.assertExtractorsAgree(b'<html><body><p>untitled</p></body></html>')[:2] ==
+                        ('', 'untitled'))
+
+    def testExtractorSetting(self):
+        self.assertTrue(get_html_extractor() is extract_streaming)
+        with override_settings(INDEXER_HTML_EXTRACTOR='indexer.extractors.extract_with_soup'):
+            self.assertTrue(get_html_extractor() is extract_with_soup)
+
+    def testBenchmarkCommand(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            call_command('benchmark_extractors', '--paragraphs', '20', '--repeat', '1')
+        lines = output.getvalue().splitlines()
+        self.assertTrue(lines[1].startswith('streaming: ') and lines[2].startswith('soup: '))
+        self.assertTrue(lines[3] == '1 of 1 pages extracted identically.')
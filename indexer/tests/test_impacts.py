@@ -0,0 +1,106 @@
+from unittest import mock
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from faker import Faker
+from indexer.impacts import (ImpactReader, encode_impacts, get_impact_levels, quantize, rank_impacts,
+                             rebuild_impact_lists)
+from indexer.index import delete_documents, index, refresh_document_norms
+from indexer.models import CorpusStatistics, DocumentLexicon, ImpactList
+from indexer.retrieve import parse_query, rank_in_database
+
+
+class ImpactCodecTestCase(SimpleTestCase):
+    def testRoundTrip(self):
+        impactDocIds = {3: [40, 7, 12], 255: [5], 1: [1, 2, 3, 1000]}
+        data, segments, docCount = encode_impacts(impactDocIds)
+        reader = ImpactReader(data, segments)
+        self.assertTrue(docCount == 8)
+        self.assertTrue(reader.impacts == [255, 3, 1])
+        self.assertTrue(list(reader.iter_segment(1)) == [7, 12, 40])
+        self.assertTrue(sorted(reader) == sorted((doc_id, impact)
+                                                for impact, doc_ids in impactDocIds.items() for doc_id in doc_ids))
+
+    def testQuantize(self):
+        self.assertTrue(quantize(1.0, 0.5, 255) == 255)
+        self.assertTrue(quantize(0.25, 0.5, 255) == 128)
+        self.assertTrue(quantize(0.0001, 0.5, 255) == 1)
+        self.assertTrue(quantize(0.5, 0.0, 15) == 8)
+
+
+def impact_postings():
+    """Returns the impact lists as a dict mapping (term id, document id) to impact"""
+    return {(impactList.term_id, doc_id): impact
+            for impactList in ImpactList.objects.all()
+            for doc_id, impact in ImpactReader(impactList.data, impactList.segments)}
+
+
+def exhaustive_impact_ranking(query):
+    """Ranks every document by its summed impacts without early termination"""
+    return rank_impacts(parse_query(query))
+
+
+@override_settings(INDEXER_IMPACT_ORDERED=True)
+class ImpactOrderedTestCase(TestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        self.urls = [faker.url() for _ in range(30)]
+        for num, url in enumerate(self.urls):
+            text = faker.paragraph(nb_sentences=8)
+            if num % 3 == 0:
+                text += ' persimmon' * (num % 5 + 1)
+            index(text.split(' '), faker.text(max_nb_chars=50).title(), url, text)
+
+    def assertListsMatchPostings(self):
+        postings = set(DocumentLexicon.objects.filter(context__norm__gt=0).values_list('term_id', 'context_id'))
+        self.assertTrue(set(impact_postings()) == postings)
+
+    def testListsFollowWrites(self):
+        self.assertListsMatchPostings()
+        text = 'persimmon kumquat'
+        index(text.split(' '), 'Kumquats', self.urls[1], text)
+        self.assertListsMatchPostings()
+        delete_documents(self.urls[:4])
+        self.assertListsMatchPostings()
+
+    def testRebuildRequantizes(self):
+        self.assertTrue(rebuild_impact_lists() == ImpactList.objects.count())
+        self.assertListsMatchPostings()
+        scale = CorpusStatistics.get().impact_scale
+        self.assertTrue(0 < scale <= 1)
+        impacts = impact_postings().values()
+        self.assertTrue(max(impacts) == get_impact_levels())
+        self.assertTrue(min(impacts) >= 1)
+
+    def testNormRefreshRequantizes(self):
+        ImpactList.objects.all().delete()
+        refresh_document_norms()
+        self.assertListsMatchPostings()
+
+    def testEarlyTerminationIsRankSafe(self):
+        rebuild_impact_lists()
+        for query in ("persimmon", "persimmon better food", "american policy"):
+            fullRanking = exhaustive_impact_ranking(query)
+            for k, offset in ((1, 0), (3, 0), (5, 2), (50, 0)):
+                self.assertTrue(rank_impacts(parse_query(query), k=k, offset=offset) == fullRanking[offset:offset + k])
+
+    def testEarlyTerminationSkipsSegments(self):
+        rebuild_impact_lists()
+        queryMap = parse_query("persimmon")
+        with mock.patch.object(ImpactReader, 'iter_segment', autospec=True,
+                               side_effect=ImpactReader.iter_segment) as iterSegment:
+            rank_impacts(queryMap)
+            allSegments = iterSegment.call_count
+            iterSegment.reset_mock()
+            rank_impacts(queryMap, k=1)
+            self.assertTrue(iterSegment.call_count < allSegments)
+
+    def testMatchesExactRankingSet(self):
+        queryMap = parse_query("persimmon")
+        self.assertTrue(set(rank_impacts(queryMap)) == set(rank_in_database(queryMap)))
+        self.assertTrue(rank_impacts(parse_query("notaword")) == ())
+
+    def testBuildCommand(self):
+        ImpactList.objects.all().delete()
+        call_command('build_impact_lists')
+        self.assertListsMatchPostings()
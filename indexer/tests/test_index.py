@@ -1,12 +1,21 @@
-from django.test import TestCase
-from indexer.models import TermLexicon, DocumentLexicon, Document
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from indexer.models import CorpusStatistics, TermLexicon, DocumentLexicon, Document
+from indexer.retrieve import compute_idf_corpus, compute_tf_idf_document
 from faker import Faker
 from indexer.utils import is_stopword, stem
 
 from indexer.index import (
     cleanup_indexed_document,
+    delete_documents,
     index_document,
     index,
+    refresh_document_norms,
+    reindex_document,
+    vacuum_lexicon,
     ParsedDocument,
     )
 
@@ -201,6 +210,43 @@ class IndexerHelpersTestCase(TestCase):
                 'parsedDocument': pDoc
             })
 
+        # the failed document is rolled back as a whole
+        self.assertTrue(TermLexicon.objects.count() == 1)
+        self.assertTrue(TermLexicon.objects.get(term=duplicateTermKey).frequency == duplicateTermFreq)
+        self.assertTrue(DocumentLexicon.objects.count() == 1)
+
+    def testEmptyTermValidation(self):
+        docContext = self.params['contextObjs'][0]
+        pDoc = ParsedDocument(['apple', ''])
+
+        with self.assertRaises(ValidationError):
+            index_document({
+                'documentContext': docContext,
+                'parsedDocument': pDoc
+            })
+
+        self.assertTrue(TermLexicon.objects.count() == 0)
+        self.assertTrue(DocumentLexicon.objects.count() == 0)
+
+    def testQueryCountIsBatched(self):
+        docContext = self.params['contextObjs'][0]
+        wordList = [self.faker.unique.pystr(min_chars=8, max_chars=12).lower() for i in range(1000)]
+        wordList = [word for word in wordList if word.isalpha()]
+        pDoc = ParsedDocument(wordList)
+        TermLexicon.objects.create(term=pDoc.words[0], frequency=2, document_frequency=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            index_document({
+                'documentContext': docContext,
+                'parsedDocument': pDoc
+            })
+
+        # a handful of statements per batch of terms rather than several per term
+        self.assertTrue(len(queries) < len(pDoc.words) / 10)
+        self.assertTrue(DocumentLexicon.objects.filter(context=docContext).count() == len(pDoc.words))
+        self.assertTrue(TermLexicon.objects.get(term=pDoc.words[0]).frequency == 3)
+        self.assertTrue(TermLexicon.objects.get(term=pDoc.words[0]).document_frequency == 2)
+
     def testIndexedDocumentCleanup(self):
         pDoc = self.params['pDocs'][0]
         docContext = self.params['contextObjs'][0]
@@ -224,6 +270,128 @@ class IndexerHelpersTestCase(TestCase):
 
         for term in docTerms:
             self.assertTrue(TermLexicon.objects.get(term=term).frequency == 0)
+            self.assertTrue(TermLexicon.objects.get(term=term).document_frequency == 0)
+
+    def testDocumentFrequency(self):
+        pDocs = self.params['pDocs']
+        contextObjs = self.params['contextObjs']
+
+        for pDoc, docContext in zip(pDocs, contextObjs):
+            index_document({
+                'documentContext': docContext,
+                'parsedDocument': pDoc
+            })
+
+        for termObj in TermLexicon.objects.all():
+            numDocs = sum(1 for pDoc in pDocs if termObj.term in pDoc.term_frequency_map)
+            self.assertTrue(termObj.document_frequency == numDocs)
+            self.assertTrue(
+                termObj.document_frequency == DocumentLexicon.objects.filter(term=termObj).count())
+
+    def testReindexUnchangedDocument(self):
+        pDoc = self.params['pDocs'][0]
+        docContext = self.params['contextObjs'][0]
+        funcParams = {
+            'documentContext': docContext,
+            'parsedDocument': pDoc
+        }
+        index_document(funcParams)
+
+        with CaptureQueriesContext(connection) as queries:
+            reindex_document(funcParams)
+
+        writes = [query for query in queries if not query['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertTrue(len(writes) == 0)
+        for term, frequency in pDoc.term_frequency_map.items():
+            termObj = TermLexicon.objects.get(term=term)
+            self.assertTrue(termObj.frequency == frequency)
+            self.assertTrue(termObj.document_frequency == 1)
+
+    def testReindexChangedDocument(self):
+        pDocs = self.params['pDocs']
+        contextObjs = self.params['contextObjs']
+        for pDoc, docContext in zip(pDocs[1:], contextObjs[1:]):
+            index_document({
+                'documentContext': docContext,
+                'parsedDocument': pDoc
+            })
+
+        docContext = contextObjs[0]
+        origWords = list(pDocs[0].words)
+        index_document({
+            'documentContext': docContext,
+            'parsedDocument': ParsedDocument(origWords)
+        })
+
+        # drop one term, repeat another and add a new one
+        updatedWords = origWords[1:] + origWords[1:2] + ['persimmon']
+        pDocUpdate = ParsedDocument(updatedWords)
+        reindex_document({
+            'documentContext': docContext,
+            'parsedDocument': pDocUpdate
+        })
+
+        docTerms = DocumentLexicon.objects.filter(context=docContext)
+        self.assertTrue(docTerms.count() == len(pDocUpdate.get_unique_terms()))
+        for docTerm in docTerms:
+            self.assertTrue(docTerm.frequency == pDocUpdate.term_frequency_map[docTerm.term.term])
+
+        for termObj in TermLexicon.objects.all():
+            termDocs = [pDocUpdate] + pDocs[1:]
+            self.assertTrue(
+                termObj.frequency == sum(p.term_frequency_map.get(termObj.term, 0) for p in termDocs))
+            self.assertTrue(
+                termObj.document_frequency == sum(1 for p in termDocs if termObj.term in p.term_frequency_map))
+
+    def testRefreshDocumentNorms(self):
+        for pDoc, docContext in zip(self.params['pDocs'], self.params['contextObjs']):
+            index_document({
+                'documentContext': docContext,
+                'parsedDocument': pDoc
+            })
+        refresh_document_norms()
+
+        idf_corpus = compute_idf_corpus()
+        maxScores = {}
+        for docContext in self.params['contextObjs']:
+            tf_idf_doc = compute_tf_idf_document(docContext, idf_corpus)
+            expectedNorm = sum(weight * weight for weight in tf_idf_doc.values()) ** 0.5
+            self.assertAlmostEqual(Document.objects.get(pk=docContext.pk).norm, expectedNorm)
+            # max_score leaves idf out
+            for term, weight in tf_idf_doc.items():
+                maxScores[term] = max(maxScores.get(term, 0.0), weight / idf_corpus[term] / expectedNorm)
+        self.assertTrue(CorpusStatistics.get().changed_document_count == 0)
+
+        for termObj in TermLexicon.objects.all():
+            self.assertAlmostEqual(termObj.max_score, maxScores[termObj.term])
+
+    @override_settings(INDEXER_NORM_DRIFT_THRESHOLD=0.5)
+    def testNormsRefreshOnDrift(self):
+        pDocs = self.params['pDocs']
+        contextObjs = self.params['contextObjs']
+        index_document({
+            'documentContext': contextObjs[0],
+            'parsedDocument': pDocs[0]
+        })
+        # 1 of 5 documents changed: below the threshold, the first norm is left alone
+        index_document({
+            'documentContext': contextObjs[1],
+            'parsedDocument': pDocs[1]
+        })
+        self.assertTrue(CorpusStatistics.get().changed_document_count == 2)
+        staleNorm = Document.objects.get(pk=contextObjs[0].pk).norm
+
+        # 3 of 5: past the threshold, every norm is recomputed
+        index_document({
+            'documentContext': contextObjs[2],
+            'parsedDocument': pDocs[2]
+        })
+        self.assertTrue(CorpusStatistics.get().changed_document_count == 0)
+        idf_corpus = compute_idf_corpus()
+        tf_idf_doc = compute_tf_idf_document(contextObjs[0], idf_corpus)
+        expectedNorm = sum(weight * weight for weight in tf_idf_doc.values()) ** 0.5
+        self.assertAlmostEqual(Document.objects.get(pk=contextObjs[0].pk).norm, expectedNorm)
+        self.assertNotAlmostEqual(staleNorm, expectedNorm)
 
 class IndexerWrapperTestCase(TestCase):
     def setUp(self):
@@ -353,3 +521,88 @@ class IndexerWrapperTestCase(TestCase):
                 termStr = docTerm.term.term
                 pDocTermFreq = pDoc.term_frequency_map[termStr]
                 self.assertTrue(docTerm.frequency == pDocTermFreq)
+
+    def testIndexUnchangedDocumentIsSkipped(self):
+        docParts = self.params['docPartsList'][0]
+
+        self.assertTrue(index(docParts['wordList'], docParts['title'], docParts['url'], docParts['text']))
+        docLexiconIds = set(DocumentLexicon.objects.values_list('id', flat=True))
+
+        with CaptureQueriesContext(connection) as queries:
+            wasIndexed = index(
+                docParts['wordList'], 'New Title', docParts['url'], docParts['text'],
+                etag='"abc"', last_modified='Wed, 21 Oct 2015 07:28:00 GMT')
+
+        self.assertFalse(wasIndexed)
+        self.assertFalse(any('indexer_documentlexicon' in query['sql'] for query in queries))
+        self.assertTrue(set(DocumentLexicon.objects.values_list('id', flat=True)) == docLexiconIds)
+
+        doc = Document.objects.get(url=docParts['url'])
+        self.assertTrue(doc.title == 'New Title')
+        self.assertTrue(doc.etag == '"abc"')
+        self.assertTrue(doc.last_modified == 'Wed, 21 Oct 2015 07:28:00 GMT')
+
+    def testIndexChangedDocumentUpdatesFingerprint(self):
+        docParts = self.params['docPartsList'][0]
+        updatedParts = self.params['docPartsList'][1]
+
+        index(docParts['wordList'], docParts['title'], docParts['url'], docParts['text'])
+        oldHash = Document.objects.get(url=docParts['url']).content_hash
+
+        self.assertTrue(index(updatedParts['wordList'], docParts['title'], docParts['url'], updatedParts['text']))
+        self.assertTrue(Document.objects.get(url=docParts['url']).content_hash != oldHash)
+
+
+class DocumentDeletionTestCase(TestCase):
+    def setUp(self):
+        self.faker = Faker()
+        Faker.seed(0)
+        self.docPartsList = []
+        for num in range(6):
+            text = self.faker.paragraph(nb_sentences=10)
+            if num % 2 == 0:
+                text += ' persimmon'
+            docParts = {'url': self.faker.url(), 'text': text, 'title': self.faker.text(max_nb_chars=50).title()}
+            self.docPartsList.append(docParts)
+            index(text.split(' '), docParts['title'], docParts['url'], text)
+
+    def testDeleteDocuments(self):
+        deletedUrls = [docParts['url'] for docParts in self.docPartsList[:3]]
+        self.assertTrue(delete_documents(deletedUrls + ['http://notindexed.com']) == 3)
+        self.assertTrue(Document.objects.count() == 3)
+        self.assertTrue(not Document.objects.filter(url__in=deletedUrls).exists())
+        self.assertTrue(CorpusStatistics.get().document_count == 3)
+
+        # the lexicon is left as if only the remaining documents had been indexed
+        expectedFrequencies = {}
+        expectedDocumentFrequencies = {}
+        for docParts in self.docPartsList[3:]:
+            for term, frequency in ParsedDocument(docParts['text'].split(' ')).term_frequency_map.items():
+                expectedFrequencies[term] = expectedFrequencies.get(term, 0) + frequency
+                expectedDocumentFrequencies[term] = expectedDocumentFrequencies.get(term, 0) + 1
+        for term in TermLexicon.objects.all():
+            self.assertTrue(term.frequency == expectedFrequencies.get(term.term, 0))
+            self.assertTrue(term.document_frequency == expectedDocumentFrequencies.get(term.term, 0))
+        self.assertTrue(DocumentLexicon.objects.count() == sum(expectedDocumentFrequencies.values()))
+
+    def testDeleteIsSetBased(self):
+        deletedUrls = [docParts['url'] for docParts in self.docPartsList]
+        with CaptureQueriesContext(connection) as queries:
+            delete_documents(deletedUrls)
+        self.assertTrue(len(queries) < 40)
+        self.assertTrue(DocumentLexicon.objects.count() == 0)
+
+    def testVacuumLexicon(self):
+        delete_documents([self.docPartsList[0]['url']])
+        orphanTerms = set(TermLexicon.objects.filter(document_frequency=0).values_list('term', flat=True))
+        self.assertTrue(orphanTerms)
+        self.assertTrue(vacuum_lexicon() == len(orphanTerms))
+        self.assertTrue(not TermLexicon.objects.filter(term__in=orphanTerms).exists())
+        self.assertTrue(not TermLexicon.objects.filter(frequency__lte=0).exists())
+        self.assertTrue(all(term not in compute_idf_corpus() for term in orphanTerms))
+
+    def testDeleteCommand(self):
+        call_command('delete_documents', self.docPartsList[0]['url'], self.docPartsList[1]['url'])
+        call_command('vacuum_lexicon')
+        self.assertTrue(Document.objects.count() == 4)
+        self.assertTrue(TermLexicon.objects.filter(document_frequency=0).count() == 0)
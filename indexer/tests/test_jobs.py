@@ -0,0 +1,118 @@
+from datetime import timedelta
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from faker import Faker
+from indexer.jobs import claim_index_job, enqueue_index_job, retry_delay, run_index_job, work_index_queue
+from indexer.models import Document, IndexJob
+
+
+def scrape_result(text, status_code=200, page_title='A Page'):
+    """Returns what scrape returns for a page with the given text"""
+    return True, {
+        'status_code': status_code,
+        'word_list': text.split(' '),
+        'page_full_text': text,
+        'page_title': page_title,
+        'etag': '',
+        'last_modified': '',
+    }
+
+
+@override_settings(INDEXER_JOB_MAX_ATTEMPTS=3, INDEXER_JOB_RETRY_DELAY=10, INDEXER_JOB_MAX_RETRY_DELAY=15)
+class IndexJobTestCase(TestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        self.url = faker.url()
+        self.text = faker.paragraph(nb_sentences=5)
+
+    def testSubmissionOnlyQueues(self):
+        with mock.patch('indexer.jobs.scrape') as scrape:
+            response = self.client.post(reverse('indexer-home'), {'url': self.url})
+            self.assertTrue(response.status_code == 302)
+            self.assertTrue(not scrape.called)
+        job = IndexJob.objects.get()
+        self.assertTrue(job.url == self.url and job.status == IndexJob.QUEUED)
+        self.assertTrue(not Document.objects.exists())
+        # submitting the same URL again does not queue it twice
+        self.client.post(reverse('indexer-home'), {'url': self.url})
+        self.assertTrue(IndexJob.objects.count() == 1)
+
+    def testWorkerIndexesQueuedPages(self):
+        job = enqueue_index_job(self.url)
+        with mock.patch('indexer.jobs.scrape', return_value=scrape_result(self.text)):
+            self.assertTrue(work_index_queue(drain=True) == 1)
+        job.refresh_from_db()
+        self.assertTrue(job.status == IndexJob.DONE and job.page_was_indexed and job.attempts == 1)
+        self.assertTrue(Document.objects.filter(url=self.url).exists())
+
+    def testRetriesWithBackoff(self):
+        job = enqueue_index_job(self.url)
+        with mock.patch('indexer.jobs.scrape', return_value=(False, {'status_code': None})):
+            for attempt in (1, 2):
+                claimed = claim_index_job()
+                self.assertTrue(claimed.pk == job.pk and claimed.attempts == attempt)
+                before = timezone.now()
+                self.assertTrue(run_index_job(claimed) == IndexJob.QUEUED)
+                claimed.refresh_from_db()
+                self.assertTrue(claimed.run_after >= before + timedelta(seconds=retry_delay(attempt)))
+                # the job waits out its backoff
+                self.assertTrue(claim_index_job() is None)
+                IndexJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            self.assertTrue(run_index_job(claim_index_job()) == IndexJob.FAILED)
+        self.assertTrue([retry_delay(attempts) for attempts in (1, 2, 3)] == [10, 15, 15])
+
+    def testClientErrorsAreNotRetried(self):
+        enqueue_index_job(self.url)
+        with mock.patch('indexer.jobs.scrape', return_value=(True, {'status_code': 404})):
+            self.assertTrue(run_index_job(claim_index_job()) == IndexJob.FAILED)
+        with mock.patch('indexer.jobs.scrape', return_value=(True, {'status_code': 503})):
+            enqueue_index_job(self.url)
+            self.assertTrue(run_index_job(claim_index_job()) == IndexJob.QUEUED)
+
+    def testInvalidPagesAreNotRetried(self):
+        # a page without a title fails Document validation on every attempt
+        job = enqueue_index_job(self.url)
+        with mock.patch('indexer.jobs.scrape', return_value=scrape_result(self.text, page_title='')):
+            self.assertTrue(run_index_job(claim_index_job()) == IndexJob.FAILED)
+        job.refresh_from_db()
+        self.assertTrue(job.attempts == 1 and job.last_error.startswith('ValidationError'))
+
+        enqueue_index_job(self.url)
+        with mock.patch('indexer.jobs.index', side_effect=ValueError('bad page')):
+            with mock.patch('indexer.jobs.scrape', return_value=scrape_result(self.text)):
+                self.assertTrue(run_index_job(claim_index_job()) == IndexJob.FAILED)
+        self.assertTrue(not Document.objects.filter(url=self.url).exists())
+
+    def testJobIsClaimedOnce(self):
+        enqueue_index_job(self.url)
+        self.assertTrue(claim_index_job() is not None)
+        self.assertTrue(claim_index_job() is None)
+
+    @override_settings(INDEXER_JOB_LEASE=60)
+    def testAbandonedJobIsClaimedAgain(self):
+        job = enqueue_index_job(self.url)
+        claim_index_job()
+        IndexJob.objects.filter(pk=job.pk).update(claimed_at=timezone.now() - timedelta(seconds=61))
+        reclaimed = claim_index_job()
+        self.assertTrue(reclaimed.pk == job.pk and reclaimed.attempts == 2)
+
+    def testStatusEndpoint(self):
+        first = enqueue_index_job(self.url)
+        second = enqueue_index_job(self.url + 'other')
+        status = self.client.get(reverse('indexer-job-status', kwargs={'job_id': second.pk})).json()
+        self.assertTrue(status['status'] == IndexJob.QUEUED and status['jobs_ahead'] == 1)
+        with mock.patch('indexer.jobs.scrape', return_value=scrape_result(self.text)):
+            run_index_job(claim_index_job())
+        status = self.client.get(reverse('indexer-job-status', kwargs={'job_id': first.pk})).json()
+        self.assertTrue(status['status'] == IndexJob.DONE and status['page_was_indexed'] is True)
+        self.assertTrue(self.client.get(reverse('indexer-job-status', kwargs={'job_id': 0})).status_code == 404)
+
+    def testCommandDrainsQueue(self):
+        enqueue_index_job(self.url)
+        with mock.patch('indexer.jobs.scrape', return_value=scrape_result(self.text)):
+            call_command('run_index_workers', '--drain', '--workers', '1')
+        self.assertTrue(IndexJob.objects.get().status == IndexJob.DONE)
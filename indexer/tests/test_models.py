@@ -1,5 +1,5 @@
 from django.test import TestCase
-from indexer.models import  Document, DocumentLexicon, TermLexicon 
+from indexer.models import  CorpusStatistics, Document, DocumentLexicon, TermLexicon 
 from django.core.exceptions import ValidationError
 
 # Create your tests here.
@@ -67,3 +67,20 @@ class DocumentLexiconTestCase(TestCase):
             term=termObj, frequency=termObj.frequency, context=doc)
 
         self.assertTrue(str(docTerm) == f"{doc.title}: {termObj.term} ({docTerm.frequency})")
+
+class CorpusStatisticsTestCase(TestCase):
+    def test_document_count_tracks_created_documents(self):
+        self.assertTrue(CorpusStatistics.get().document_count == 0)
+        doc = Document.objects.create(title="Foo", url="http://foo.com", text="Foo Bar Spam")
+        Document.objects.create(title="Bar", url="http://bar.com", text="Bar Spam")
+        self.assertTrue(CorpusStatistics.get().document_count == 2)
+
+        doc.title = "Foo Updated"
+        doc.save()
+        self.assertTrue(CorpusStatistics.get().document_count == 2)
+
+    def test_adjust(self):
+        CorpusStatistics.adjust(document_count=3)
+        CorpusStatistics.adjust(document_count=-1)
+        self.assertTrue(CorpusStatistics.objects.count() == 1)
+        self.assertTrue(CorpusStatistics.get().document_count == 2)
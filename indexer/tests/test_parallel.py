@@ -0,0 +1,57 @@
+from django.db.models import Max
+from django.test import SimpleTestCase, TestCase, override_settings
+from faker import Faker
+from indexer.index import index
+from indexer.models import Document
+from indexer.parallel import get_scoring_pool, rank_parallel, score_partition
+from indexer.retrieve import gather_query_statistics, parse_query, rank_in_database
+
+
+# scoring workers connect to the configured database rather than the test database,
+# so rankings are checked with the partitions scored in the test's own thread
+@override_settings(INDEXER_SCORING_WORKERS=None, INDEXER_SCORING_PARTITION_SIZE=4)
+class PartitionedScoringTestCase(TestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        for num in range(25):
+            text = faker.paragraph(nb_sentences=10)
+            if num % 3 == 0:
+                text += ' persimmon' * (num % 4 + 1)
+            index(text.split(' '), faker.text(max_nb_chars=50).title(), faker.url(), text)
+
+    def testMatchesSinglePartition(self):
+        for query in ("persimmon", "better american food persimmon", "notaword"):
+            queryMap = parse_query(query)
+            self.assertTrue(rank_parallel(queryMap) == rank_in_database(queryMap))
+            for k, offset in ((1, 0), (3, 2), (10, 0), (100, 5)):
+                self.assertTrue(rank_parallel(queryMap, k=k, offset=offset) == rank_in_database(queryMap, k=k, offset=offset))
+
+    def testPartitionsAreDisjoint(self):
+        idfTerms, tfIdfQuery, shardTerms = gather_query_statistics(parse_query("persimmon"))
+        termIds, maxScores = shardTerms[None]
+        partitionStarts = range(0, Document.objects.aggregate(last=Max('id'))['last'] + 1, 4)
+        partitionRankings = [
+            score_partition(None, first, first + 4, tfIdfQuery, idfTerms, termIds, maxScores, None)
+            for first in partitionStarts]
+        seen = set()
+        for first, ranking in zip(partitionStarts, partitionRankings):
+            docIds = {doc_id for doc_id, _ in ranking}
+            self.assertTrue(all(first <= doc_id < first + 4 for doc_id in docIds))
+            self.assertTrue(not docIds & seen)
+            seen |= docIds
+        self.assertTrue(seen == set(rank_in_database(parse_query("persimmon"))))
+
+
+class ScoringPoolTestCase(SimpleTestCase):
+    @override_settings(INDEXER_SCORING_WORKERS=None)
+    def testNoPoolWithoutWorkers(self):
+        self.assertTrue(get_scoring_pool() is None)
+
+    @override_settings(INDEXER_SCORING_WORKERS=2)
+    def testPoolIsPersistent(self):
+        pool = get_scoring_pool()
+        self.assertTrue(pool is not None and get_scoring_pool() is pool)
+        with override_settings(INDEXER_SCORING_WORKERS=3):
+            self.assertTrue(get_scoring_pool() is not pool)
+        get_scoring_pool().shutdown()
@@ -0,0 +1,209 @@
+from io import BytesIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from faker import Faker
+from indexer.champions import rebuild_champion_lists
+from indexer.impacts import rebuild_impact_lists
+from indexer.index import ParsedDocument, delete_documents, index, refresh_document_norms
+from indexer.models import (ChampionPosting, Document, DocumentLexicon, DocumentTermList, ImpactList, PostingsList,
+                            TermLexicon)
+from indexer.parallel import rank_parallel
+from indexer.postings import (POSTINGS_BLOCK_SIZE, PostingsReader, append_posting, decode_term_frequencies,
+                              encode_postings, encode_term_frequencies, rank_compressed)
+from indexer.retrieve import count_matches, parse_query, rank_in_database, retrieve
+from indexer.snapshot import dump_index, load_index
+from indexer.sparse import SparseIndex, np
+
+class PostingsCodecTestCase(TestCase):
+    def setUp(self):
+        # a few blocks worth of postings with gaps of varying sizes
+        self.postings = [(doc_id * doc_id + 1, doc_id % 7 + 1) for doc_id in range(3 * POSTINGS_BLOCK_SIZE + 5)]
+
+    def testRoundTrip(self):
+        data, skips, docCount, lastDocId, lastBlockCount = encode_postings(self.postings)
+        self.assertTrue(list(PostingsReader(data, skips)) == self.postings)
+        self.assertTrue(docCount == len(self.postings))
+        self.assertTrue(lastDocId == self.postings[-1][0])
+        self.assertTrue(lastBlockCount == 5)
+        self.assertTrue(len(data) < 4 * len(self.postings))
+
+    def testLookup(self):
+        data, skips, _, _, _ = encode_postings(self.postings)
+        reader = PostingsReader(data, skips)
+        wanted = [self.postings[0][0], self.postings[200][0], self.postings[-1][0], 3, 10 ** 9]
+        self.assertTrue(list(reader.lookup(wanted)) == [self.postings[0], self.postings[200], self.postings[-1]])
+
+    def testAppendMatchesEncode(self):
+        postingsList = PostingsList()
+        for doc_id, frequency in self.postings:
+            append_posting(postingsList, doc_id, frequency)
+        encoded = encode_postings(self.postings)
+        self.assertTrue((postingsList.data, postingsList.skips, postingsList.doc_count,
+                         postingsList.last_doc_id, postingsList.last_block_count) == encoded)
+
+    def testTermFrequenciesRoundTrip(self):
+        termFrequencies = {doc_id: frequency for doc_id, frequency in self.postings}
+        data = encode_term_frequencies(termFrequencies)
+        self.assertTrue(decode_term_frequencies(data) == termFrequencies)
+        self.assertTrue(decode_term_frequencies(encode_term_frequencies({})) == {})
+
+
+def postings_from_table():
+    """Returns the postings of DocumentLexicon as a dict mapping term id to sorted postings"""
+    postings = {}
+    for term_id, doc_id, frequency in DocumentLexicon.objects.order_by('context_id').values_list(
+            'term_id', 'context_id', 'frequency'):
+        postings.setdefault(term_id, []).append((doc_id, frequency))
+    return postings
+
+def postings_from_documents():
+    """Returns the postings the indexed documents' texts analyze to, as a dict mapping term id to sorted postings"""
+    term_ids = dict(TermLexicon.objects.values_list('term', 'id'))
+    postings = {}
+    for doc_id, text in Document.objects.order_by('pk').values_list('pk', 'text'):
+        for term, frequency in ParsedDocument(text.split(' ')).term_frequency_map.items():
+            postings.setdefault(term_ids[term], []).append((doc_id, frequency))
+    return postings
+
+def postings_from_lists():
+    """Returns the postings of PostingsList as a dict mapping term id to sorted postings"""
+    return {postingsList.term_id: list(PostingsReader(postingsList.data, postingsList.skips))
+            for postingsList in PostingsList.objects.all()}
+
+def postings_from_term_lists():
+    """Returns the postings of DocumentTermList as a dict mapping term id to sorted postings"""
+    postings = {}
+    for termList in DocumentTermList.objects.order_by('pk'):
+        for term_id, frequency in decode_term_frequencies(termList.data).items():
+            postings.setdefault(term_id, []).append((termList.context_id, frequency))
+    return postings
+
+def table_bytes(*models):
+    """Returns the size of the SQLite pages holding the models' tables and their indexes"""
+    tables = [model._meta.db_table for model in models]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""SELECT SUM(pgsize) FROM dbstat WHERE name IN
+                (SELECT name FROM sqlite_master WHERE tbl_name IN ({', '.join(['%s'] * len(tables))}))""",
+            tables)
+        return cursor.fetchone()[0] or 0
+
+
+@override_settings(INDEXER_COMPRESSED_POSTINGS=True)
+class CompressedPostingsTestCase(TestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        self.urls = [faker.url() for _ in range(15)]
+        for num, url in enumerate(self.urls):
+            text = faker.paragraph(nb_sentences=10)
+            if num % 5 == 0:
+                text += ' persimmon'
+            index(text.split(' '), faker.text(max_nb_chars=50).title(), url, text)
+        refresh_document_norms()
+
+    def assertListsMatchDocuments(self):
+        expected = postings_from_documents()
+        self.assertTrue(postings_from_lists() == expected)
+        self.assertTrue(postings_from_term_lists() == expected)
+        self.assertTrue(DocumentLexicon.objects.count() == 0)
+
+    def testIndexingWritesOnlyCompressedLists(self):
+        self.assertListsMatchDocuments()
+
+    def testReindexingKeepsListsInSync(self):
+        index(['persimmon', 'persimmon', 'kumquat'], 'Fruit', self.urls[3], 'persimmon persimmon kumquat')
+        index(['kumquat'], 'Fruit', self.urls[0], 'kumquat')
+        self.assertListsMatchDocuments()
+        kumquat = TermLexicon.objects.get(term='kumquat')
+        self.assertTrue((kumquat.frequency, kumquat.document_frequency) == (2, 2))
+
+    def testDeletionKeepsListsInSync(self):
+        persimmonFrequency = TermLexicon.objects.get(term='persimmon').frequency
+        delete_documents(self.urls[:4])
+        self.assertListsMatchDocuments()
+        self.assertTrue(TermLexicon.objects.get(term='persimmon').frequency == persimmonFrequency - 1)
+
+    def testSnapshotRoundTrip(self):
+        expected = postings_from_lists()
+        ranking = rank_compressed(parse_query("persimmon food"))
+        snapshot = BytesIO()
+        dump_index(snapshot)
+        snapshot.seek(0)
+        load_index(snapshot)
+        self.assertTrue(postings_from_lists() == expected)
+        self.assertTrue(postings_from_term_lists() == expected)
+        self.assertTrue(DocumentLexicon.objects.count() == 0)
+        self.assertTrue(rank_compressed(parse_query("persimmon food")) == ranking)
+
+    def testMatchesDatabaseEngine(self):
+        for query in ("better american food", "persimmon day", "persimmon", "food", "zzzyzx"):
+            queryMap = parse_query(query)
+            fullRanking = rank_in_database(queryMap)
+            self.assertTrue(rank_compressed(queryMap) == fullRanking)
+            for k in (1, 3, 50):
+                self.assertTrue(rank_compressed(queryMap, k=k) == rank_in_database(queryMap, k=k))
+                self.assertTrue(rank_compressed(queryMap, k=k, offset=2) == rank_in_database(queryMap, k=k, offset=2))
+
+    @override_settings(INDEXER_RETRIEVAL_ENGINE='indexer.postings.rank_compressed')
+    def testSelectedThroughRetrieve(self):
+        self.assertTrue(retrieve("persimmon", k=2) == rank_in_database(parse_query("persimmon"), k=2))
+
+
+class PostingsConversionTestCase(TestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        # enough documents for the terms' lists to outgrow the per-row overhead, as they do in a real corpus
+        for num in range(150):
+            text = faker.paragraph(nb_sentences=10)
+            if num % 5 == 0:
+                text += ' persimmon'
+            index(text.split(' '), faker.text(max_nb_chars=50).title(), faker.url(), text)
+        refresh_document_norms()
+        self.queries = ("better american food", "persimmon day", "persimmon", "food")
+
+    def testCompressionShrinksPostingsTables(self):
+        expected = postings_from_table()
+        rankings = [rank_in_database(parse_query(query)) for query in self.queries]
+        uncompressedBytes = table_bytes(DocumentLexicon, PostingsList, DocumentTermList)
+        rebuild_champion_lists()
+        rebuild_impact_lists()
+        champions = sorted(ChampionPosting.objects.values_list('term_id', 'context_id', 'score'))
+        impacts = sorted(ImpactList.objects.values_list('term_id', 'data', 'segments'))
+
+        with override_settings(INDEXER_COMPRESSED_POSTINGS=True):
+            call_command('build_postings')
+            self.assertTrue(DocumentLexicon.objects.count() == 0)
+            self.assertTrue(postings_from_lists() == expected)
+            self.assertTrue(postings_from_term_lists() == expected)
+            compressedBytes = table_bytes(DocumentLexicon, PostingsList, DocumentTermList)
+            self.assertTrue(compressedBytes * 2 < uncompressedBytes)
+
+            for query, ranking in zip(self.queries, rankings):
+                queryMap = parse_query(query)
+                self.assertTrue(rank_in_database(queryMap) == ranking)
+                self.assertTrue(rank_compressed(queryMap) == ranking)
+                with override_settings(INDEXER_SCORING_WORKERS=None, INDEXER_SCORING_PARTITION_SIZE=7):
+                    self.assertTrue(rank_parallel(queryMap) == ranking)
+                if np is not None:
+                    self.assertTrue(SparseIndex.load().rank(queryMap) == ranking)
+            self.assertTrue(count_matches("persimmon") == len(rankings[2]))
+
+            rebuild_champion_lists()
+            rebuild_impact_lists()
+            self.assertTrue(sorted(ChampionPosting.objects.values_list('term_id', 'context_id', 'score')) == champions)
+            self.assertTrue(sorted(ImpactList.objects.values_list('term_id', 'data', 'segments')) == impacts)
+
+            # norms recomputed from the compressed lists are the ones they were computed with
+            norms = dict(Document.objects.values_list('pk', 'norm'))
+            refresh_document_norms()
+            for docId, norm in Document.objects.values_list('pk', 'norm'):
+                self.assertAlmostEqual(norm, norms[docId])
+
+    def testConversionNeedsCompressionEnabled(self):
+        postingCount = DocumentLexicon.objects.count()
+        call_command('build_postings')
+        self.assertTrue(DocumentLexicon.objects.count() == postingCount)
+        self.assertTrue(PostingsList.objects.count() == 0)
@@ -0,0 +1,73 @@
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.test import TransactionTestCase, override_settings
+from faker import Faker
+from indexer.index import delete_documents, index
+from indexer.query_cache import get_query_cache, get_query_cache_stats
+from indexer.retrieve import retrieve
+from indexer.shards import get_shard_aliases
+
+
+# rankings are only cached outside transactions, so these tests commit their documents
+class QueryCacheTestCase(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.faker = Faker()
+        Faker.seed(0)
+        # generations start over with every test's fresh database
+        get_query_cache().clear()
+        self.docPartsList = []
+        for num in range(4):
+            self.indexDocument(self.faker.paragraph(nb_sentences=10) + ' apple')
+
+    def indexDocument(self, text):
+        docParts = {'url': self.faker.url(), 'text': text, 'title': self.faker.text(max_nb_chars=50).title()}
+        self.docPartsList.append(docParts)
+        index(text.split(' '), docParts['title'], docParts['url'], text)
+
+    def testEquivalentQueriesShareEntry(self):
+        ranked = retrieve("Apples")
+        self.assertTrue(len(ranked) == 4)
+        self.assertTrue(retrieve("apple") == ranked)
+        self.assertTrue(retrieve("the apple!") == ranked)
+        stats = get_query_cache_stats()
+        self.assertTrue(stats['hits'] == 2)
+        self.assertTrue(stats['misses'] == 1)
+
+    def testPagesAreCachedSeparately(self):
+        self.assertTrue(len(retrieve("apple", k=2)) == 2)
+        self.assertTrue(len(retrieve("apple", k=2, offset=2)) == 2)
+        self.assertTrue(get_query_cache_stats()['misses'] == 2)
+
+    def testIndexingInvalidatesRankings(self):
+        self.assertTrue(len(retrieve("apple")) == 4)
+        self.indexDocument('apple apple apple')
+        self.assertTrue(len(retrieve("apple")) == 5)
+        self.assertTrue(get_query_cache_stats()['hits'] == 0)
+
+    def testDeletionInvalidatesRankings(self):
+        self.assertTrue(len(retrieve("apple")) == 4)
+        delete_documents([self.docPartsList[0]['url']])
+        self.assertTrue(len(retrieve("apple")) == 3)
+        self.assertTrue(get_query_cache_stats()['hits'] == 0)
+
+    def testNotCachedInsideTransaction(self):
+        # a transaction on any database holding the index disables the cache
+        with transaction.atomic(using=(get_shard_aliases() or [DEFAULT_DB_ALIAS])[0]):
+            retrieve("apple")
+            retrieve("apple")
+        stats = get_query_cache_stats()
+        self.assertTrue(stats['hits'] == 0 and stats['misses'] == 0)
+
+    @override_settings(INDEXER_QUERY_CACHE=None)
+    def testDisabled(self):
+        self.assertTrue(len(retrieve("apple")) == 4)
+        self.assertTrue(len(retrieve("apple")) == 4)
+        self.assertTrue(get_query_cache_stats()['hit_rate'] is None)
+
+    def testStatsCommand(self):
+        retrieve("apple")
+        retrieve("apple")
+        call_command('query_cache_stats', '--reset')
+        self.assertTrue(get_query_cache_stats()['misses'] == 0)
@@ -1,14 +1,19 @@
 # Authored by Kee Dong (yuqingd2)
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from unittest import mock
 from indexer.models import TermLexicon, DocumentLexicon, Document
 from faker import Faker
 from indexer.utils import is_stopword, stem
+from indexer.views import RetrievedDocumentView
 
 from indexer.index import (
     cleanup_indexed_document,
     index_document,
     index,
+    refresh_document_norms,
     ParsedDocument,
     )
 
@@ -19,7 +24,10 @@ from indexer.retrieve import (
     compute_idf_corpus,
     compute_tf_idf_query,
     compute_tf_idf_document,
+    count_matches,
     cosine_similarity_query_document,
+    hydrate_documents,
+    RankedDocuments,
     retrieve
     )
 
@@ -48,6 +56,10 @@ class ParsedQueryTestCase(TestCase):
         for parsedWord in parsedQuery.keys():
             self.assertTrue(parsedQuery[parsedWord] == baselineFreqMap[parsedWord])
 
+    def testPunctuatedInput(self):
+        parsedQuery = parse_query("Apples, apples... and pears?")
+        self.assertTrue(parsedQuery == {'appl': 2, 'pear': 1})
+
 
 class RetrieverHelpersTestCase(TestCase):
     def setUp(self):
@@ -189,5 +201,147 @@ class RetrieverHelpersTestCase(TestCase):
         query = "better american food"
         ranked_list = retrieve(query)
         # print (ranked_list)
-        self.assertTrue(len(ranked_list) == 5)
+        queryTerms = parse_query(query).keys()
+        matchingDocs = [
+            docContext for pDoc, docContext in zip(pDocs, contextObjs)
+            if set(queryTerms) & set(pDoc.get_unique_terms())
+        ]
+        self.assertTrue(len(ranked_list) == len(matchingDocs))
+        self.assertTrue(set(ranked_list) == {doc.pk for doc in matchingDocs})
+
+    def testRetrieveMatchesExhaustiveScoring(self):
+        pDocs = self.params['pDocs']
+        contextObjs = self.params['contextObjs']
+
+        for pDoc, docContext in zip(pDocs, contextObjs):
+            index_document({
+                'documentContext': docContext,
+                'parsedDocument': pDoc
+            })
 
+        refresh_document_norms()
+        query = "better american food"
+        idf_corpus = compute_idf_corpus()
+        tf_idf_query = compute_tf_idf_query(query, idf_corpus)
+        ranked_list = retrieve(query)
+
+        previous_sim = None
+        for doc_id in ranked_list:
+            doc = Document.objects.get(pk=doc_id)
+            doc_sim = cosine_similarity_query_document(
+                tf_idf_query, compute_tf_idf_document(doc, idf_corpus))
+            if previous_sim is not None:
+                self.assertTrue(doc_sim <= previous_sim + 1e-9)
+            previous_sim = doc_sim
+
+    def testCosineUsesWholeDocumentVector(self):
+        tf_idf_query = {'appl': 1.0}
+        self.assertAlmostEqual(cosine_similarity_query_document(tf_idf_query, {'appl': 2.0}), 1.0)
+        self.assertAlmostEqual(
+            cosine_similarity_query_document(tf_idf_query, {'appl': 3.0, 'pear': 4.0}), 0.6)
+        self.assertTrue(cosine_similarity_query_document(tf_idf_query, {}) == 0.0)
+
+    def testRetrieveUnknownTerms(self):
+        self.assertTrue(len(retrieve("zzzyzx")) == 0)
+
+
+
+class TopKRetrievalTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        faker = Faker()
+        Faker.seed(0)
+        numDocs = 30
+
+        for num in range(numDocs):
+            text = faker.paragraph(nb_sentences=10)
+            if num % 10 == 0:
+                text += ' persimmon persimmon'
+            index(text.split(' '), faker.text(max_nb_chars=50).title(), faker.url(), text)
+        refresh_document_norms()
+
+    def testTopKMatchesFullRanking(self):
+        for query in ("better american food", "persimmon day", "the say", "persimmon"):
+            fullRanking = retrieve(query)
+            for k in (1, 3, 10):
+                self.assertTrue(retrieve(query, k=k) == fullRanking[:k])
+                self.assertTrue(retrieve(query, k=k, offset=2) == fullRanking[2:2 + k])
+
+    def testTopKMatchesFullRankingWithStaleNorms(self):
+        faker = Faker()
+        Faker.seed(1)
+        # the new documents shift every IDF, the norms computed before them are stale
+        for _ in range(10):
+            text = faker.paragraph(nb_sentences=10) + ' persimmon'
+            index(text.split(' '), faker.text(max_nb_chars=50).title(), faker.url(), text)
+
+        for query in ("better american food", "persimmon day", "the say", "persimmon"):
+            fullRanking = retrieve(query)
+            self.assertTrue(len(fullRanking) == count_matches(query))
+            for k in (1, 3, 10):
+                self.assertTrue(retrieve(query, k=k) == fullRanking[:k])
+
+    def testKLargerThanMatches(self):
+        fullRanking = retrieve("persimmon")
+        self.assertTrue(len(fullRanking) == 3)
+        self.assertTrue(retrieve("persimmon", k=100) == fullRanking)
+        self.assertTrue(retrieve("persimmon", k=0) == ())
+
+    def testCommonTermPostingsArePruned(self):
+        commonTerm = TermLexicon.objects.order_by('-document_frequency').first()
+        query = f"persimmon persimmon persimmon {commonTerm.term}"
+        self.assertTrue(commonTerm.document_frequency > 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            topDocs = retrieve(query, k=1)
+
+        self.assertTrue(topDocs == retrieve(query)[:1])
+        # the common term was only looked up for the surviving candidates
+        self.assertTrue(any('"context_id" IN' in query['sql'] for query in queries))
+
+
+class RankedDocumentsTestCase(TestCase):
+    def setUp(self):
+        self.docs = [
+            Document.objects.create(title=f"Doc {num}", url=f"http://doc{num}.com", text="Spam " * 200)
+            for num in range(5)
+        ]
+        self.rankedIds = tuple(doc.pk for doc in reversed(self.docs))
+
+    def testHydrateKeepsRankOrder(self):
+        hydrated = hydrate_documents(self.rankedIds)
+        self.assertTrue([doc.pk for doc in hydrated] == list(self.rankedIds))
+        for doc in hydrated:
+            self.assertTrue(len(doc.preview) == 255)
+            self.assertTrue('text' in doc.get_deferred_fields())
+
+    def testSlicesOnlyLoadTheirDocuments(self):
+        rankedDocs = RankedDocuments(self.rankedIds)
+        self.assertTrue(len(rankedDocs) == 5)
+
+        with CaptureQueriesContext(connection) as queries:
+            page = rankedDocs[1:3]
+        self.assertTrue(len(queries) == 1)
+        self.assertTrue([doc.pk for doc in page] == list(self.rankedIds[1:3]))
+        self.assertTrue(rankedDocs[0].pk == self.rankedIds[0])
+
+    def testResultsView(self):
+        index(['spam', 'eggs'], 'Spam Page', 'http://spam.com', 'spam eggs')
+        response = self.client.get('/results/spam')
+        self.assertTrue(response.status_code == 200)
+        self.assertContains(response, 'Spam Page')
+        self.assertTrue(len(response.context['object_list']) == 1)
+
+    def testResultsViewCountsEveryPage(self):
+        for num in range(5):
+            index(['spam', 'eggs'], f'Spam Page {num}', f'http://spam{num}.com', 'spam eggs')
+        with mock.patch.object(RetrievedDocumentView, 'paginate_by', 2):
+            response = self.client.get('/results/spam')
+            self.assertTrue(response.context['paginator'].count == 5)
+            self.assertTrue(response.context['paginator'].num_pages == 3)
+            self.assertTrue(len(response.context['object_list']) == 2)
+
+            lastPage = self.client.get('/results/spam?page=last')
+            self.assertTrue(lastPage.context['page_obj'].number == 3)
+            self.assertTrue(len(lastPage.context['object_list']) == 1)
+            self.assertTrue(self.client.get('/results/spam?page=4').status_code == 404)
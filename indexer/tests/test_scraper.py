@@ -0,0 +1,152 @@
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import secrets
+import threading
+import time
+import tracemalloc
+from unittest import mock
+from django.test import SimpleTestCase, TestCase, override_settings
+from faker import Faker
+from indexer.jobs import claim_index_job, enqueue_index_job, run_index_job
+from indexer.models import Document, IndexJob
+from indexer.scraper import NOT_MODIFIED, scrape
+
+ETAG = '"v1"'
+LAST_MODIFIED = 'Wed, 21 Oct 2015 07:28:00 GMT'
+
+
+class ValidatingServer:
+    """
+    A local HTTP/1.1 server standing in for a site: it serves one page with validators,
+    answers conditional requests with 304, gzips its body when asked to and records the
+    headers and client port of every request
+    """
+    def __init__(self, body, response_delay=0.0):
+        server = self
+        self.body = body.encode('utf-8')
+        self.compressed_body = gzip.compress(self.body)
+        self.requests = []  # (headers, client port, status code)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+
+            def do_GET(self):
+                time.sleep(response_delay)
+                if self.headers.get('If-None-Match') == ETAG:
+                    server.requests.append((self.headers, self.client_address[1], NOT_MODIFIED))
+                    self.send_response(NOT_MODIFIED)
+                    self.send_header('ETag', ETAG)
+                    self.end_headers()
+                    return
+                body = server.body
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('ETag', ETAG)
+                self.send_header('Last-Modified', LAST_MODIFIED)
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = server.compressed_body
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                server.requests.append((self.headers, self.client_address[1], 200))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/page'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def html_page(text):
+    return f'<html><head><title>Persimmons</title><style>p {{}}</style></head><body><p>{text}</p></body></html>'
+
+
+class ScrapeTestCase(SimpleTestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        self.text = faker.paragraph(nb_sentences=20)
+
+    def testCompressedPageIsDecoded(self):
+        with ValidatingServer(html_page(self.text)) as server:
+            isScraped, results = scrape(server.url)
+        self.assertTrue(isScraped and results['status_code'] == 200)
+        self.assertTrue(results['page_title'] == 'Persimmons' and results['page_full_text'].endswith(self.text))
+        self.assertTrue(results['etag'] == ETAG and results['last_modified'] == LAST_MODIFIED)
+        self.assertTrue('gzip' in server.requests[0][0]['Accept-Encoding'])
+        self.assertTrue(results['page_bytes'] == len(html_page(self.text).encode('utf-8')))
+
+    def testConnectionIsReused(self):
+        with ValidatingServer(html_page(self.text)) as server:
+            scrape(server.url)
+            scrape(server.url)
+        self.assertTrue(len(server.requests) == 2 and server.requests[0][1] == server.requests[1][1])
+
+    def testConditionalRequest(self):
+        with ValidatingServer(html_page(self.text)) as server:
+            isScraped, results = scrape(server.url, ETAG, LAST_MODIFIED)
+        self.assertTrue(isScraped and results == {'status_code': NOT_MODIFIED})
+        headers = server.requests[0][0]
+        self.assertTrue(headers['If-None-Match'] == ETAG and headers['If-Modified-Since'] == LAST_MODIFIED)
+
+    def testBodySizeIsCapped(self):
+        with ValidatingServer(html_page(self.text)) as server:
+            # the limit applies to the decompressed body
+            with override_settings(INDEXER_HTTP_MAX_BODY_BYTES=len(self.text) // 2):
+                isScraped, results = scrape(server.url)
+            self.assertTrue(not isScraped and results['status_code'] == 200 and 'error' in results)
+            with override_settings(INDEXER_HTTP_MAX_BODY_BYTES=len(self.text) * 2):
+                self.assertTrue(scrape(server.url)[0])
+
+    def testBodyIsNotHeldWhole(self):
+        # about 4MiB of markup whose text the extractor drops
+        scripts = ''.join(f'<script>var key = "{secrets.token_hex(64)}";</script>\n' for _ in range(25000))
+        page = html_page(self.text).replace('</body>', scripts + '</body>')
+        with ValidatingServer(page) as server:
+            scrape(server.url)  # modules and connections set up on first use are not counted
+            tracemalloc.start()
+            try:
+                isScraped, results = scrape(server.url)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        self.assertTrue(isScraped and results['page_full_text'].endswith(self.text))
+        self.assertTrue(results['page_bytes'] == len(page.encode('utf-8')))
+        self.assertTrue(peak < results['page_bytes'] / 4)
+
+    @override_settings(INDEXER_HTTP_READ_TIMEOUT=0.2)
+    def testReadTimeout(self):
+        with ValidatingServer(html_page(self.text), response_delay=1.0) as server:
+            self.assertTrue(scrape(server.url) == (False, {'status_code': None}))
+
+
+class ConditionalReindexTestCase(TestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        self.text = faker.paragraph(nb_sentences=20)
+
+    def testNotModifiedPageIsSkipped(self):
+        with ValidatingServer(html_page(self.text)) as server:
+            enqueue_index_job(server.url)
+            self.assertTrue(run_index_job(claim_index_job()) == IndexJob.DONE)
+            doc = Document.objects.get(url=server.url)
+            self.assertTrue(doc.etag == ETAG and doc.last_modified == LAST_MODIFIED)
+
+            job = enqueue_index_job(server.url)
+            with mock.patch('indexer.jobs.index') as index:
+                self.assertTrue(run_index_job(claim_index_job()) == IndexJob.DONE)
+                self.assertTrue(not index.called)
+        job.refresh_from_db()
+        self.assertTrue(job.status_code == NOT_MODIFIED and job.page_was_indexed is False)
+        self.assertTrue([status for _, _, status in server.requests] == [200, NOT_MODIFIED])
@@ -0,0 +1,121 @@
+import os
+from tempfile import TemporaryDirectory
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from faker import Faker
+from indexer.index import ParsedDocument, index, refresh_document_norms
+from indexer.models import Document, TermLexicon
+from indexer.retrieve import parse_query, rank_in_database, retrieve
+from indexer.segments import (Segment, add_document, delete_document, get_segment_index, merge_segments,
+                              rank_segments, read_manifest, segment_batch, select_merges, write_segment)
+
+class SegmentTestCase(TestCase):
+    def setUp(self):
+        self.segmentDir = TemporaryDirectory()
+        self.settings = override_settings(INDEXER_SEGMENT_DIR=self.segmentDir.name)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.segmentDir.cleanup()
+
+class SegmentFileTestCase(SegmentTestCase):
+    def testRoundTrip(self):
+        documents = {3: {'appl': 2, 'pear': 1}, 1: {'pear': 5}, 8: {'fig': 1, 'appl': 1}}
+        path = os.path.join(self.segmentDir.name, 'test.seg')
+        write_segment(path, documents)
+        segment = Segment(1, path)
+        self.assertTrue(segment.doc_ids == (1, 3, 8))
+        self.assertTrue(list(segment.postings('appl')) == [(3, 2), (8, 1)])
+        self.assertTrue(list(segment.postings('pear')) == [(1, 5), (3, 1)])
+        self.assertTrue(segment.postings('plum') is None)
+        self.assertTrue(dict(segment.document_terms(1)) == documents[3])
+
+    def testSelectMerges(self):
+        sizes = {segmentId: 1 for segmentId in range(1, 13)}
+        sizes.update({20: 500, 21: 0})
+        self.assertTrue(select_merges(sizes, merge_factor=10) == [[21], list(range(1, 11))])
+        self.assertTrue(select_merges({1: 5, 2: 5}, merge_factor=10) == [])
+
+class SegmentIndexTestCase(SegmentTestCase):
+    def setUp(self):
+        super().setUp()
+        faker = Faker()
+        Faker.seed(0)
+        self.urls = []
+        self.texts = []
+        for num in range(15):
+            text = faker.paragraph(nb_sentences=10)
+            if num % 5 == 0:
+                text += ' persimmon'
+            self.urls.append(faker.url())
+            self.texts.append(text)
+            index(text.split(' '), faker.text(max_nb_chars=50).title(), self.urls[-1], text)
+        refresh_document_norms()
+
+        # the same documents written to three segments of five
+        doc_ids = Document.objects.order_by('pk').values_list('pk', flat=True)
+        for batch_start in range(0, 15, 5):
+            with segment_batch():
+                for doc_id, text in list(zip(doc_ids, self.texts))[batch_start:batch_start + 5]:
+                    add_document(doc_id, ParsedDocument(text.split(' ')).term_frequency_map)
+
+    def assertMatchesDatabaseEngine(self):
+        for query in ("better american food", "persimmon day", "persimmon", "food", "zzzyzx"):
+            queryMap = parse_query(query)
+            self.assertTrue(rank_segments(queryMap) == rank_in_database(queryMap))
+            self.assertTrue(get_segment_index().count_matches(list(queryMap)) == len(rank_in_database(queryMap)))
+            for k in (1, 3, 50):
+                self.assertTrue(rank_segments(queryMap, k=k, offset=2) == rank_in_database(queryMap, k=k, offset=2))
+
+    def testBatchesWriteOneSegmentEach(self):
+        self.assertTrue(len(read_manifest(self.segmentDir.name)['segments']) == 3)
+        self.assertTrue(get_segment_index().document_count == 15)
+
+    def testMatchesDatabaseEngine(self):
+        self.assertMatchesDatabaseEngine()
+
+    def testMergeKeepsRanking(self):
+        segmentIndex = get_segment_index()
+        self.assertTrue(merge_segments([1, 2, 3]))
+        manifest = read_manifest(self.segmentDir.name)
+        self.assertTrue([entry['id'] for entry in manifest['segments']] == [3])
+        self.assertTrue(len(os.listdir(self.segmentDir.name)) == 3)  # segment, manifest and lock
+        self.assertTrue(get_segment_index() is not segmentIndex)
+        self.assertMatchesDatabaseEngine()
+
+    def testTombstones(self):
+        persimmonDocs = rank_segments(parse_query("persimmon"))
+        delete_document(persimmonDocs[0])
+        self.assertTrue(rank_segments(parse_query("persimmon")) == persimmonDocs[1:])
+        self.assertTrue(get_segment_index().document_count == 14)
+        self.assertTrue(get_segment_index().count_matches(['persimmon']) == len(persimmonDocs) - 1)
+
+        call_command('merge_segments', '--full')
+        manifest = read_manifest(self.segmentDir.name)
+        self.assertTrue(len(manifest['segments']) == 1 and manifest['tombstones'] == {})
+        self.assertTrue(rank_segments(parse_query("persimmon")) == persimmonDocs[1:])
+
+    @override_settings(INDEXER_RETRIEVAL_ENGINE='indexer.segments.rank_segments')
+    def testSelectedThroughRetrieve(self):
+        self.assertTrue(retrieve("persimmon", k=2) == rank_in_database(parse_query("persimmon"), k=2))
+
+class SegmentIndexingTestCase(SegmentTestCase):
+    @override_settings(INDEXER_SEGMENTS=True)
+    def testIndexWritesSegments(self):
+        url = 'http://fruit.com'
+        with self.captureOnCommitCallbacks(execute=True):
+            index(['persimmon', 'fig'], 'Fruit', url, 'persimmon fig')
+        with self.captureOnCommitCallbacks(execute=True):
+            index(['kumquat'], 'Other fruit', 'http://otherfruit.com', 'kumquat')
+        self.assertTrue(TermLexicon.objects.count() == 0)
+        self.assertTrue(len(read_manifest(self.segmentDir.name)['segments']) == 2)
+        doc = Document.objects.get(url=url)
+        self.assertTrue(rank_segments(parse_query("persimmon")) == (doc.pk,))
+
+        # reindexing hides the document's old postings
+        with self.captureOnCommitCallbacks(execute=True):
+            index(['kumquat'], 'Fruit', url, 'kumquat')
+        self.assertTrue(rank_segments(parse_query("persimmon")) == ())
+        self.assertTrue(len(rank_segments(parse_query("kumquat"))) == 2)
+        self.assertTrue(get_segment_index().document_count == 2)
@@ -0,0 +1,207 @@
+from collections import Counter
+import math
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from faker import Faker
+from indexer.champions import rank_champions, rebuild_champion_lists
+from indexer.index import delete_documents, index, refresh_document_norms
+from indexer.jobs import enqueue_index_job
+from indexer.models import ChampionPosting, CorpusStatistics, Document, DocumentLexicon, IndexJob, TermLexicon
+from indexer.parallel import rank_parallel
+from indexer.retrieve import count_matches, hydrate_documents, idf, parse_query, rank_shards, retrieve, term_weight
+from indexer.shards import (SHARD_ALIAS_PREFIX, get_shard_aliases, map_shards, shard_for_url, shard_number,
+                            split_global_id, to_global_id, use_shard)
+
+TEST_SHARD_COUNT = 3
+
+
+def add_test_shards(shard_count):
+    """
+    Declares shard_0 ... shard_{shard_count - 1} as SQLite databases, as saveit/settings.py does
+    for INDEXER_SHARDS, and creates their in-memory test databases with the indexer tables.
+    Django does not support overriding DATABASES, so the shards are added to the connection
+    settings, which are the settings' DATABASES dict. Shards declared already, when the suite
+    runs with INDEXER_SHARDS set, are left as they are.
+
+    returns:
+        list of the aliases of the shards added
+    """
+    added = []
+    for shard in range(shard_count):
+        alias = f'{SHARD_ALIAS_PREFIX}{shard}'
+        if alias in connections.settings:
+            continue
+        connections.settings[alias] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+        connections[alias].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        added.append(alias)
+    return added
+
+
+def remove_test_shards(aliases):
+    """Destroys the test databases of shards declared by add_test_shards and forgets them"""
+    for alias in aliases:
+        connections[alias].creation.destroy_test_db(':memory:', verbosity=0)
+        del connections[alias]
+        del connections.settings[alias]
+
+
+class TestShardsMixin:
+    """Runs a test case against TEST_SHARD_COUNT shard databases of its own"""
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # declared before the test case validates its databases and opens their transactions
+        cls.testShardAliases = add_test_shards(TEST_SHARD_COUNT)
+        try:
+            super().setUpClass()
+        except Exception:
+            remove_test_shards(cls.testShardAliases)
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            remove_test_shards(cls.testShardAliases)
+
+
+class ShardNumberTestCase(SimpleTestCase):
+    def testStableAndSpread(self):
+        faker = Faker()
+        Faker.seed(0)
+        urls = [faker.url() + faker.uri_path() for _ in range(200)]
+        self.assertTrue([shard_number(url, 4) for url in urls] == [shard_number(url, 4) for url in urls])
+        self.assertTrue({shard_number(url, 4) for url in urls} == {0, 1, 2, 3})
+
+    def testUnsharded(self):
+        if not get_shard_aliases():
+            self.assertTrue(shard_for_url('http://test.com') is None)
+            self.assertTrue(map_shards(lambda alias: alias) == [None])
+
+
+def index_fruit_pages(testCase):
+    faker = Faker()
+    Faker.seed(0)
+    testCase.persimmonUrls = set()
+    for num in range(20):
+        text = faker.paragraph(nb_sentences=10)
+        url = faker.url() + faker.uri_path()
+        if num % 4 == 0:
+            text += ' persimmon'
+            testCase.persimmonUrls.add(url)
+        index(text.split(' '), faker.text(max_nb_chars=50).title(), url, text)
+
+
+@override_settings(INDEXER_SHARDS=TEST_SHARD_COUNT, INDEXER_SHARD_WORKERS=1)
+class ShardedIndexTestCase(TestShardsMixin, TestCase):
+    def setUp(self):
+        index_fruit_pages(self)
+
+    def testDocumentsArePartitioned(self):
+        counts = [Document.objects.using(alias).count() for alias in get_shard_aliases()]
+        self.assertTrue(sum(counts) == 20 and all(count > 0 for count in counts))
+        self.assertTrue(Document.objects.using('default').count() == 0)
+        for alias in get_shard_aliases():
+            for url in Document.objects.using(alias).values_list('url', flat=True):
+                self.assertTrue(shard_for_url(url) == alias)
+
+    def testJobQueueStaysOnDefault(self):
+        url = next(iter(self.persimmonUrls))
+        with use_shard(shard_for_url(url)):
+            job = enqueue_index_job(url)
+        self.assertTrue(job._state.db == 'default' and IndexJob.objects.using('default').filter(pk=job.pk).exists())
+
+    def testGlobalIds(self):
+        for alias in get_shard_aliases():
+            self.assertTrue(split_global_id(to_global_id(alias, 7)) == (alias, 7))
+
+    def testScatterGather(self):
+        ranking = retrieve("persimmon")
+        docs = hydrate_documents(ranking)
+        self.assertTrue({doc.url for doc in docs} == self.persimmonUrls)
+        queryMap = parse_query("better american food persimmon")
+        fullRanking = rank_shards(queryMap)
+        self.assertTrue(count_matches("better american food persimmon") == len(fullRanking))
+        for k in (1, 3, 50):
+            self.assertTrue(rank_shards(queryMap, k=k, offset=2) == fullRanking[2:2 + k])
+
+    @override_settings(INDEXER_SCORING_PARTITION_SIZE=2)
+    def testPartitionedShards(self):
+        queryMap = parse_query("better american food persimmon")
+        for k in (None, 1, 5, 50):
+            self.assertTrue(rank_parallel(queryMap, k=k) == rank_shards(queryMap, k=k))
+
+    @override_settings(INDEXER_CHAMPION_LISTS=True, INDEXER_CHAMPION_LIST_SIZE=2)
+    def testChampionsPerShard(self):
+        map_shards(lambda alias: rebuild_champion_lists())
+        queryMap = parse_query("persimmon")
+        # the best match of a one-term query is always in its shard's champion list
+        approximate = rank_champions(queryMap, k=1)
+        self.assertTrue(approximate == rank_shards(queryMap, k=1))
+
+    def testNormsUseGlobalStatistics(self):
+        map_shards(lambda alias: refresh_document_norms())
+        shardPostings = {
+            alias: list(DocumentLexicon.objects.using(alias).values_list('context_id', 'term__term', 'frequency'))
+            for alias in get_shard_aliases()}
+        documentFrequencies = Counter(term for postings in shardPostings.values() for _, term, _ in postings)
+        for alias, postings in shardPostings.items():
+            squaredNorms = Counter()
+            for docId, term, frequency in postings:
+                squaredNorms[docId] += term_weight(frequency, idf(20, documentFrequencies[term])) ** 2
+            norms = dict(Document.objects.using(alias).values_list('id', 'norm'))
+            maxScores = Counter()
+            for docId, term, frequency in postings:
+                self.assertAlmostEqual(norms[docId], math.sqrt(squaredNorms[docId]))
+                maxScores[term] = max(maxScores[term], term_weight(frequency, 1.0) / norms[docId])
+            for term, maxScore in TermLexicon.objects.using(alias).values_list('term', 'max_score'):
+                self.assertAlmostEqual(maxScore, maxScores[term])
+
+    @override_settings(INDEXER_CHAMPION_LISTS=True, INDEXER_CHAMPION_LIST_SIZE=100, INDEXER_IMPACT_ORDERED=True)
+    def testChampionsAndImpactsUseGlobalStatistics(self):
+        map_shards(lambda alias: refresh_document_norms())
+        shardPostings = {
+            alias: list(DocumentLexicon.objects.using(alias).values_list(
+                'context_id', 'term_id', 'term__term', 'frequency', 'context__norm'))
+            for alias in get_shard_aliases()}
+        documentFrequencies = Counter(term for postings in shardPostings.values() for _, _, term, _, _ in postings)
+        for alias, postings in shardPostings.items():
+            weights = {(docId, termId): term_weight(frequency, idf(20, documentFrequencies[term])) / norm
+                       for docId, termId, term, frequency, norm in postings}
+            champions = ChampionPosting.objects.using(alias).values_list('context_id', 'term_id', 'score')
+            self.assertTrue(len(champions) == len(weights))
+            for docId, termId, score in champions:
+                self.assertAlmostEqual(score, weights[docId, termId])
+            with use_shard(alias):
+                self.assertAlmostEqual(CorpusStatistics.get().impact_scale, max(weights.values()))
+
+    def testPruningIsExact(self):
+        # norms drift while pages are indexed, pruning must not depend on them being fresh
+        for query in ("better american food persimmon", "persimmon food", "the american dream"):
+            queryMap = parse_query(query)
+            fullRanking = rank_shards(queryMap)
+            for k in (1, 2, 5):
+                self.assertTrue(rank_shards(queryMap, k=k) == fullRanking[:k])
+
+    def testReindexStaysInShard(self):
+        url = next(iter(self.persimmonUrls))
+        index(['kumquat'], 'Kumquats', url, 'kumquat')
+        self.assertTrue(sum(Document.objects.using(alias).count() for alias in get_shard_aliases()) == 20)
+        self.assertTrue([doc.url for doc in hydrate_documents(retrieve("kumquat"))] == [url])
+
+    def testDeleteFromShards(self):
+        self.assertTrue(delete_documents(self.persimmonUrls) == len(self.persimmonUrls))
+        self.assertTrue(sum(Document.objects.using(alias).count() for alias in get_shard_aliases()) == 15)
+        self.assertTrue(retrieve("persimmon") == ())
+
+
+@override_settings(INDEXER_SHARDS=TEST_SHARD_COUNT)
+class ParallelShardsTestCase(TestShardsMixin, TransactionTestCase):
+    def testParallelMatchesSequential(self):
+        index_fruit_pages(self)
+        queryMap = parse_query("better american food persimmon")
+        parallelRanking = rank_shards(queryMap, k=5)
+        with override_settings(INDEXER_SHARD_WORKERS=1):
+            self.assertTrue(rank_shards(queryMap, k=5) == parallelRanking)
@@ -0,0 +1,84 @@
+import gzip
+from io import BytesIO
+import os
+from tempfile import TemporaryDirectory
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from faker import Faker
+from indexer.index import index
+from indexer.models import CorpusStatistics, Document, DocumentLexicon, TermLexicon
+from indexer.retrieve import PREVIEW_LENGTH, retrieve
+from indexer.snapshot import SnapshotFormatError, dump_index, load_index
+
+def index_contents():
+    """Returns the rows of the index tables, without DocumentLexicon ids"""
+    return (
+        list(Document.objects.order_by('pk').values_list('pk', 'title', 'url', 'content_hash', 'norm')),
+        list(TermLexicon.objects.order_by('pk').values_list(
+            'pk', 'term', 'frequency', 'document_frequency', 'max_score')),
+        sorted(DocumentLexicon.objects.values_list('context_id', 'term_id', 'frequency')),
+        CorpusStatistics.get().document_count,
+    )
+
+class SnapshotTestCase(TestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        for num in range(10):
+            text = faker.paragraph(nb_sentences=20)
+            if num % 3 == 0:
+                text += ' persimmon'
+            index(text.split(' '), faker.text(max_nb_chars=50).title(), faker.url(), text)
+
+    def dump(self, **kwargs):
+        snapshot = BytesIO()
+        dump_index(snapshot, **kwargs)
+        snapshot.seek(0)
+        return snapshot
+
+    def testRoundTrip(self):
+        contents = index_contents()
+        ranking = retrieve("persimmon food")
+        generation = CorpusStatistics.get().generation
+        snapshot = self.dump()
+
+        index(['kumquat'], 'Kumquats', 'http://kumquat.com', 'kumquat')
+        counts = load_index(snapshot)
+        self.assertTrue(counts['documents'] == 10 and counts['postings'] == len(contents[2]))
+        self.assertTrue(index_contents() == contents)
+        self.assertTrue(retrieve("persimmon food") == ranking)
+        self.assertTrue(CorpusStatistics.get().generation > generation)
+
+        # indexing keeps working on the loaded index
+        self.assertTrue(index(['kumquat'], 'Kumquats', 'http://kumquat.com', 'kumquat'))
+        self.assertTrue(len(retrieve("kumquat")) == 1)
+
+    def testTextIsTruncatedByDefault(self):
+        fullTexts = dict(Document.objects.values_list('pk', 'text'))
+        previewSnapshot = self.dump()
+        fullTextSnapshot = self.dump(full_text=True)
+        load_index(previewSnapshot)
+        for doc_id, text in Document.objects.values_list('pk', 'text'):
+            self.assertTrue(text == fullTexts[doc_id][:PREVIEW_LENGTH])
+        load_index(fullTextSnapshot)
+        self.assertTrue(dict(Document.objects.values_list('pk', 'text')) == fullTexts)
+
+    def testRejectsOtherFormats(self):
+        with self.assertRaises(SnapshotFormatError):
+            load_index(BytesIO(gzip.compress(b'not a snapshot')))
+        with self.assertRaises(SnapshotFormatError):
+            load_index(BytesIO(gzip.compress(b'SAVEITIX\x63')))
+        self.assertTrue(Document.objects.count() == 10)
+
+    def testCommands(self):
+        contents = index_contents()
+        with TemporaryDirectory() as snapshotDir:
+            path = os.path.join(snapshotDir, 'index.snapshot')
+            call_command('dump_index', path)
+            self.assertTrue(os.path.getsize(path) > 0)
+            call_command('load_index', path)
+            self.assertTrue(index_contents() == contents)
+            with open(path, 'wb') as snapshotFile:
+                snapshotFile.write(b'garbage')
+            with self.assertRaises(CommandError):
+                call_command('load_index', path)
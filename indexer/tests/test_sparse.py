@@ -0,0 +1,47 @@
+from unittest import skipIf
+from django.test import TestCase, override_settings
+from faker import Faker
+from indexer.index import index, refresh_document_norms
+from indexer.retrieve import parse_query, rank_in_database, retrieve
+from indexer.sparse import get_sparse_index, np, rank_in_memory
+
+@skipIf(np is None, "NumPy is not installed")
+class SparseIndexTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        faker = Faker()
+        Faker.seed(0)
+        numDocs = 20
+
+        for num in range(numDocs):
+            text = faker.paragraph(nb_sentences=10)
+            if num % 5 == 0:
+                text += ' persimmon'
+            index(text.split(' '), faker.text(max_nb_chars=50).title(), faker.url(), text)
+        refresh_document_norms()
+
+    def testMatchesDatabaseEngine(self):
+        for query in ("better american food", "persimmon day", "persimmon", "food"):
+            queryMap = parse_query(query)
+            fullRanking = rank_in_database(queryMap)
+            self.assertTrue(len(fullRanking) > 0)
+            self.assertTrue(rank_in_memory(queryMap) == fullRanking)
+            for k in (1, 3, 50):
+                self.assertTrue(rank_in_memory(queryMap, k=k) == fullRanking[:k])
+                self.assertTrue(rank_in_memory(queryMap, k=k, offset=2) == fullRanking[2:2 + k])
+
+    def testUnknownTerms(self):
+        self.assertTrue(rank_in_memory(parse_query("zzzyzx")) == ())
+
+    def testReloadsWhenIndexChanges(self):
+        sparseIndex = get_sparse_index()
+        self.assertTrue(get_sparse_index() is sparseIndex)
+        self.assertTrue(rank_in_memory(parse_query("kumquat")) == ())
+
+        index(['kumquat'], 'Kumquats', 'http://kumquat.com', 'kumquat')
+        self.assertTrue(get_sparse_index() is not sparseIndex)
+        self.assertTrue(len(rank_in_memory(parse_query("kumquat"))) == 1)
+
+    @override_settings(INDEXER_RETRIEVAL_ENGINE='indexer.sparse.rank_in_memory')
+    def testSelectedThroughRetrieve(self):
+        self.assertTrue(retrieve("persimmon", k=2) == rank_in_database(parse_query("persimmon"), k=2))
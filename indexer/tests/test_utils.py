@@ -0,0 +1,66 @@
+from django.test import SimpleTestCase
+from nltk.stem.snowball import SnowballStemmer
+from types import GeneratorType
+from indexer.scraper import get_full_page_text, get_words
+from indexer.utils import Analyzer, batched, get_analyzer, is_alpha, is_stopword, stem, tokenize
+
+class AnalyzerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.analyzer = Analyzer()
+
+    def testAnalyzeFrequencies(self):
+        tokens = ['Apples', 'apples', 'the', 'Banana', "wasn't", 'pear5', 'bananas']
+        termFrequencyMap = self.analyzer.analyze(tokens)
+        self.assertTrue(termFrequencyMap == {'appl': 2, 'banana': 2})
+        self.assertTrue(list(termFrequencyMap.keys()) == ['appl', 'banana'])
+
+    def testAnalyzeAcceptsGenerators(self):
+        termFrequencyMap = self.analyzer.analyze(word for word in 'oranges and oranges'.split())
+        self.assertTrue(termFrequencyMap == {'orang': 2})
+
+    def testStemMatchesSnowball(self):
+        stemmer = SnowballStemmer('english')
+        for word in ('running', 'generously', 'persimmons', 'indexing'):
+            self.assertTrue(self.analyzer.stem(word) == stemmer.stem(word))
+            self.assertTrue(stem(word) == stemmer.stem(word))
+
+    def testStemIsMemoized(self):
+        self.analyzer.stem('retrieval')
+        self.analyzer.stem('retrieval')
+        self.assertTrue(self.analyzer.stem.cache_info().hits >= 1)
+
+    def testSharedAnalyzer(self):
+        self.assertTrue(get_analyzer() is get_analyzer())
+
+    def testModuleHelpers(self):
+        self.assertTrue(is_stopword('the'))
+        self.assertFalse(is_stopword('apple'))
+        self.assertTrue(is_alpha("should've"))
+        self.assertFalse(is_alpha('abc1'))
+
+class TokenizerTestCase(SimpleTestCase):
+    def testTokenizeStripsPunctuation(self):
+        text = "Apples, bananas; and (pears)! It's a well-known fact -- 42 times."
+        self.assertTrue(list(tokenize(text)) == [
+            'apples', 'bananas', 'and', 'pears', "it's", 'a', 'well-known', 'fact', 'times'])
+
+    def testTokenizeKeepsNonAsciiWordsWhole(self):
+        text = "Zürich naïve café résumé abc1 rich"
+        self.assertTrue(list(tokenize(text)) == ['zürich', 'naïve', 'café', 'résumé', 'rich'])
+        # the analyzer only indexes ASCII words, no fragment of the others becomes a term
+        self.assertTrue(get_analyzer().analyze(tokenize(text)) == {'rich': 1})
+
+    def testTokenizeIsLazy(self):
+        self.assertTrue(isinstance(tokenize('foo bar'), GeneratorType))
+        self.assertTrue(list(tokenize('')) == [])
+
+    def testScraperHelpers(self):
+        rawText = "\n\n  Title  \n\tSome   text here.\n\n  More text  "
+        fullText = get_full_page_text(rawText)
+        self.assertTrue(fullText == "Title Some text here. More text")
+        self.assertTrue(list(get_words(fullText)) == ['title', 'some', 'text', 'here', 'more', 'text'])
+
+class BatchedTestCase(SimpleTestCase):
+    def testBatched(self):
+        self.assertTrue(list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]])
+        self.assertTrue(list(batched([], 2)) == [])
@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.core.exceptions import ValidationError
+from django.db import OperationalError
+from django.test import TransactionTestCase
+from faker import Faker
+from indexer.jobs import claim_index_job, enqueue_index_job, run_index_job
+from indexer.models import CorpusStatistics, Document, DocumentLexicon, IndexJob, TermLexicon
+from indexer.tests.test_jobs import scrape_result
+from indexer.writer import IndexWriter
+
+
+# the writer commits from its own thread, so the pages it writes must be visible across connections
+class IndexWriterTestCase(TransactionTestCase):
+    def setUp(self):
+        faker = Faker()
+        Faker.seed(0)
+        self.pages = [(faker.paragraph(nb_sentences=5), faker.text(max_nb_chars=50).title(), faker.url() + str(num))
+                      for num in range(40)]
+
+    def submit_all(self, writer, pages):
+        """Submits pages from eight producer threads, returns their futures"""
+        def submit(page):
+            text, title, url = page
+            return writer.submit(text.split(' '), title, url, text)
+
+        with ThreadPoolExecutor(max_workers=8) as producers:
+            return list(producers.map(submit, pages))
+
+    def testConcurrentProducersAreBatched(self):
+        with IndexWriter(batch_size=10, flush_interval=0.5) as writer:
+            futures = self.submit_all(writer, self.pages)
+        self.assertTrue(all(future.result() is True for future in futures))
+        self.assertTrue(writer.batches <= 10)
+        self.assertTrue(Document.objects.count() == len(self.pages))
+        self.assertTrue(CorpusStatistics.get().document_count == len(self.pages))
+        frequencies = sum(TermLexicon.objects.values_list('frequency', flat=True))
+        self.assertTrue(frequencies == sum(DocumentLexicon.objects.values_list('frequency', flat=True)))
+
+    def testFailingPageDoesNotFailBatch(self):
+        (text, _, invalidUrl), (validText, validTitle, validUrl) = self.pages[:2]
+        with IndexWriter(batch_size=10, flush_interval=0.5) as writer:
+            invalid = writer.submit(text.split(' '), '', invalidUrl, text)
+            valid = writer.submit(validText.split(' '), validTitle, validUrl, validText)
+        self.assertTrue(writer.batches == 1)
+        self.assertRaises(ValidationError, invalid.result)
+        self.assertTrue(valid.result() is True)
+        self.assertTrue(list(Document.objects.values_list('url', flat=True)) == [validUrl])
+
+    def testUnchangedPageIsSkipped(self):
+        text, title, url = self.pages[0]
+        with IndexWriter(batch_size=1, flush_interval=0) as writer:
+            self.assertTrue(writer.submit(text.split(' '), title, url, text).result() is True)
+            self.assertTrue(writer.submit(text.split(' '), title, url, text).result() is False)
+
+    def testFlushWaitsForCommit(self):
+        text, title, url = self.pages[0]
+        writer = IndexWriter(batch_size=10, flush_interval=60)
+        future = writer.submit(text.split(' '), title, url, text)
+        writer.flush()
+        self.assertTrue(future.done() and Document.objects.filter(url=url).exists())
+        writer.close()
+
+    def testLockedBatchIsRetried(self):
+        text, title, url = self.pages[0]
+        commitShard = IndexWriter.commit_shard
+        calls = []
+
+        def lock_first_commit(writer, pages):
+            calls.append(len(pages))
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return commitShard(writer, pages)
+
+        with mock.patch.object(IndexWriter, 'commit_shard', autospec=True, side_effect=lock_first_commit):
+            with IndexWriter(batch_size=1, flush_interval=0) as writer:
+                self.assertTrue(writer.submit(text.split(' '), title, url, text).result() is True)
+        self.assertTrue(calls == [1, 1])
+
+    def testJobsAreFinishedOnCommit(self):
+        text = self.pages[0][0]
+        job = enqueue_index_job(self.pages[0][2])
+        with mock.patch('indexer.jobs.scrape', return_value=scrape_result(text)):
+            with IndexWriter(batch_size=10, flush_interval=60) as writer:
+                self.assertTrue(run_index_job(claim_index_job(), writer) == IndexJob.RUNNING)
+                writer.flush()
+        job.refresh_from_db()
+        self.assertTrue(job.status == IndexJob.DONE and job.page_was_indexed)
+
+    def testInvalidPageFailsItsJob(self):
+        text = self.pages[0][0]
+        job = enqueue_index_job(self.pages[0][2])
+        with mock.patch('indexer.jobs.scrape', return_value=scrape_result(text, page_title='')):
+            with IndexWriter(batch_size=10, flush_interval=60) as writer:
+                run_index_job(claim_index_job(), writer)
+                writer.flush()
+        job.refresh_from_db()
+        self.assertTrue(job.status == IndexJob.FAILED and job.attempts == 1)
@@ -14,10 +14,11 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path
-from indexer.views import IndexDocumentView, QueryDocumentView, RetrievedDocumentView
+from indexer.views import IndexDocumentView, IndexJobStatusView, QueryDocumentView, RetrievedDocumentView
 
 urlpatterns = [
     path('', IndexDocumentView.as_view(), name="indexer-home"),
+    path('jobs/<int:job_id>', IndexJobStatusView.as_view(), name='indexer-job-status'),
     path('search', QueryDocumentView.as_view(), name='indexer-search'),
     path('results/<query>', RetrievedDocumentView.as_view(), name='indexer-results'),
 ]
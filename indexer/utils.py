@@ -1,18 +1,85 @@
+from functools import lru_cache
+from hashlib import sha256
+from itertools import islice
+import re
 from nltk.corpus import stopwords
 from nltk.stem.snowball import SnowballStemmer
 from nltk.stem.porter import PorterStemmer
 
+# a word is a run of letters, in any script, optionally joined by single apostrophes or
+# hyphens. A run touching digits or underscores is not a word, so no fragment of it is indexed.
+TOKEN_PATTERN = re.compile(r"(?<!\w)[^\W\d_]+(?:['-][^\W\d_]+)*(?!\w)")
+ALLOWED_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ-'")
+STEM_CACHE_SIZE = 100000
+
+def tokenize(text):
+    """
+    Lazily splits text into lowercased word tokens in a single pass, leaving out
+    punctuation, digits and whitespace
+    args:
+        text: String to tokenize
+
+    returns:
+        generator of str tokens
+    """
+    for match in TOKEN_PATTERN.finditer(text):
+        yield match.group().lower()
+
+class Analyzer:
+    """
+    Turns raw words into index terms: lowercases them, drops words with non-alphabetic
+    characters and stopwords, and stems the rest. Indexing and querying share one
+    instance (see get_analyzer) so the stopword set and stemmer are only loaded once.
+    """
+    def __init__(self, language='english', stem_cache_size=STEM_CACHE_SIZE):
+        self.stopwords = frozenset(stopwords.words(language))
+        self.stemmer = SnowballStemmer(language)
+        # bounded memo of stems, most pages reuse a small vocabulary
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+    def is_stopword(self, word):
+        """Returns True if word is in the analyzer's stopword set"""
+        return word in self.stopwords
+
+    @staticmethod
+    def is_alpha(word):
+        """Returns True if word only consists of alphabetic characters, hyphens and apostrophes"""
+        return ALLOWED_CHARS.issuperset(word)
+
+    def analyze(self, tokens):
+        """
+        Analyzes a batch of tokens
+        args:
+            tokens: iterable of raw words
+
+        returns:
+            dict: mapping of each term to its frequency, in order of first occurrence
+        """
+        term_frequency_map = {}
+        stopword_set = self.stopwords
+        stem_word = self.stem
+        for token in tokens:
+            word = token.lower()
+            if ALLOWED_CHARS.issuperset(word) and word not in stopword_set:
+                term = stem_word(word)
+                term_frequency_map[term] = term_frequency_map.get(term, 0) + 1
+
+        return term_frequency_map
+
+@lru_cache(maxsize=None)
+def get_analyzer():
+    """Returns the Analyzer shared by indexing and retrieval"""
+    return Analyzer()
+
 def stem(word):
-    """Stems a word based on NLTK's PorterStemmer
+    """Stems a word based on NLTK's SnowballStemmer
     args:
         word: String of word to be stemmed
 
     returns:
         str: String of stemmed word
     """
-    stemmer = SnowballStemmer('english')
-    # stemmer = PorterStemmer()
-    return stemmer.stem(word)
+    return get_analyzer().stem(word)
 
 def is_stopword(word):
     """
@@ -23,7 +90,7 @@ def is_stopword(word):
     returns:
         bool: True if word is stopword
     """
-    return word in stopwords.words('english')
+    return get_analyzer().is_stopword(word)
 
 def is_alpha(word):
     """
@@ -35,8 +102,33 @@ def is_alpha(word):
         bool: True if word only consists of alphabetic characters
     """
     # return word.isalpha()
-    allowed_chars = set(("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ-'"))
-    validation = set((word))
-    return validation.issubset(allowed_chars)
+    return Analyzer.is_alpha(word)
+
+def fingerprint(text):
+    """
+    Computes a content hash used to detect whether a page changed since it was indexed
+    args:
+        text: String of page text
+
+    returns:
+        str: hex digest of the text's SHA-256 hash
+    """
+    return sha256(text.encode('utf-8')).hexdigest()
+
+def batched(items, batch_size):
+    """
+    Splits an iterable into lists of at most batch_size items
+    args:
+        items: iterable to split
+        batch_size: maximum number of items per batch
+
+    returns:
+        generator of lists
+    """
+    iterator = iter(items)
+    batch = list(islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, batch_size))
 
 # Stem words.words() and check against it for verification?
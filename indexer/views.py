@@ -1,13 +1,15 @@
 # from django.shortcuts import render
-from django.views.generic import FormView, ListView
+import math
+from django.conf import settings
+from django.views.generic import FormView, ListView, View
 from django.urls import reverse
-from django.db.models import Case, When
+from django.http import Http404, JsonResponse
 # from django.http import HttpResponseServerError
+from indexer.champions import count_champion_union
 from indexer.forms import URLForm, QueryForm
-from indexer.scraper import scrape
-from indexer.retrieve import retrieve
-from indexer.index import index
-from indexer.models import Document
+from indexer.jobs import describe_index_job, enqueue_index_job
+from indexer.retrieve import RankedDocuments, count_matches, parse_query, retrieve
+from indexer.models import Document, IndexJob
 
 # Create your views here.
 class IndexDocumentView(FormView):
@@ -19,42 +21,33 @@ class IndexDocumentView(FormView):
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
         context['slug'] = 'indexer-index'
-        if 'scraped_url' in self.request.session.keys():
-            context['scraped_url'] = self.request.session['scraped_url']
-        if 'scraped_status_code' in self.request.session.keys():
-            context['scraped_status_code'] = self.request.session['scraped_status_code']
-        if 'page_was_scraped' in self.request.session.keys():
-            context['page_was_scraped'] = True
-        else:
-            context['page_was_scraped'] = False
+        if 'queued_url' in self.request.session.keys():
+            context['queued_url'] = self.request.session['queued_url']
+        if 'queued_job_id' in self.request.session.keys():
+            context['queued_job_id'] = self.request.session['queued_job_id']
         self.request.session.flush()
         return context
 
     def form_valid(self, form):
         if form.is_valid():
-            # print(f"Scraping {url}...")
+            # the page is scraped and indexed by the run_index_workers command, so the
+            # response never waits on the site being saved
             url = form.cleaned_data['url']
-            self.request.session['scraped_url'] = url
-            scrape_results = scrape(url)
-            page_is_scraped_successfully = scrape_results[0]
-            page_status_code = scrape_results[1]['status_code']
-            self.request.session['scraped_status_code'] = page_status_code
-            self.request.session['page_was_scraped'] = True
-            if page_is_scraped_successfully:
-                if page_status_code == 200:
-                    word_list = scrape_results[1]['word_list']
-                    page_full_text = scrape_results[1]['page_full_text']
-                    page_title = scrape_results[1]['page_title']
-                    index(word_list, page_title, url, page_full_text)
-                else:
-                    # print(f'error: {page_status_code}')
-                    pass
-            else:
-                # print('page not found')
-                pass
+            job = enqueue_index_job(url)
+            self.request.session['queued_url'] = url
+            self.request.session['queued_job_id'] = job.pk
 
         return super().form_valid(form)
 
+class IndexJobStatusView(View):
+    """Reports the progress of a queued indexing job as JSON"""
+    def get(self, request, *args, **kwargs):
+        try:
+            job = IndexJob.objects.get(pk=self.kwargs.get('job_id'))
+        except IndexJob.DoesNotExist:
+            raise Http404("No such indexing job")
+        return JsonResponse(describe_index_job(job))
+
 class QueryDocumentView(FormView):
     template_name = 'indexer/index_query.html'
     form_class = QueryForm
@@ -86,21 +79,33 @@ class RetrievedDocumentView(ListView):
         return context
 
     def get_queryset(self):
-        qs = super().get_queryset()
-        print(qs)
         self.query = self.kwargs.get('query')
-        ranked_docs = retrieve(self.query)
-        # doc_sims = retrieve(self.query)
-        # docs = [doc[0] for doc in doc_sims if doc[1] != 1.0]
-        # print(doc_sims)
-        # ordered_doc_ids = [doc_tuple[0] for doc_tuple in doc_sims]
-        # preserved = Case(*[When(pk=pk, then=pos) for pos, pk in enumerate(ordered_doc_ids)]) 
-        # print(preserved)
-        # if doc_sims:
-        #     qs = docs
-        # print(ranked_docs)
-        if ranked_docs:
-            qs = ranked_docs
+        page = self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg) or 1
+        # with INDEXER_APPROXIMATE_RESULTS set, every page is ranked from the union of the query
+        # terms' champion lists once it can fill a page, and the paginator counts that union
+        approximate = False
+        if getattr(settings, 'INDEXER_APPROXIMATE_RESULTS', False):
+            match_count = count_champion_union(parse_query(self.query))
+            approximate = match_count is not None and match_count >= self.paginate_by
+        if not approximate:
+            # the paginator counts every matching document, though only the pages up to the
+            # requested one are ranked
+            match_count = count_matches(self.query)
+        if page == 'last':
+            page_number = max(1, math.ceil(match_count / self.paginate_by))
+        else:
+            try:
+                page_number = int(page)
+            except ValueError:
+                page_number = 1
+        # rank just enough documents to fill the requested page, never more than the union
+        # holds so that the champion ranking does not fall back to every posting
+        depth = page_number * self.paginate_by
+        ranked_doc_ids = retrieve(self.query, k=min(depth, match_count) if approximate else depth,
+                                  approximate=approximate)
+        if ranked_doc_ids:
+            # documents are only loaded for the page being displayed
+            qs = RankedDocuments(ranked_doc_ids, match_count)
         else:
             qs = Document.objects.none()
 
@@ -0,0 +1,174 @@
+"""
+Group commit: SQLite lets one connection write at a time, and a transaction that finds
+another writer ahead of it fails with "database is locked" rather than waiting. An
+IndexWriter owns a single writer thread that is the only one to write the pages handed to
+it. Producer threads analyze their pages and submit them; the writer gathers up to
+INDEXER_WRITER_BATCH_SIZE pages, waiting at most INDEXER_WRITER_FLUSH_INTERVAL seconds after
+the first, and indexes the whole batch in one transaction per shard. Each page is indexed
+in its own savepoint, so a page that fails does not fail the others, and a batch that
+loses the write lock to another process is retried as a whole.
+"""
+
+from concurrent.futures import Future
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
+from indexer.index import ParsedDocument, index_page
+from indexer.segments import segment_batch
+from indexer.shards import get_current_database, shard_for_url, use_shard
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_FLUSH_INTERVAL = 0.5
+# producers block once this many batches are waiting for the writer
+QUEUED_BATCHES = 4
+# a batch that finds the database locked by another process is retried this many times,
+# after LOCK_RETRY_DELAY seconds doubling each time
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 0.1
+
+_STOP = object()
+
+
+def get_writer_batch_size():
+    return getattr(settings, 'INDEXER_WRITER_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def get_writer_flush_interval():
+    return getattr(settings, 'INDEXER_WRITER_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+
+
+def is_lock_error(error):
+    """Returns True if an OperationalError means another connection held the write lock"""
+    return 'locked' in str(error)
+
+
+class IndexWriter:
+    """
+    Single writer thread indexing the pages submitted by any number of producer threads,
+    committing them in batches. Use it as a context manager, or call close() when done.
+
+    batch_size:     most pages committed in one transaction, INDEXER_WRITER_BATCH_SIZE by default
+    flush_interval: longest wait in seconds for a batch to fill, INDEXER_WRITER_FLUSH_INTERVAL by default
+    write_lock:     lock held while a batch is committed, to share with the process's other
+                    database writers
+    """
+    def __init__(self, batch_size=None, flush_interval=None, write_lock=None):
+        self.batch_size = max(1, batch_size or get_writer_batch_size())
+        self.flush_interval = get_writer_flush_interval() if flush_interval is None else flush_interval
+        self.write_lock = write_lock or threading.Lock()
+        self.pending = queue.Queue(maxsize=self.batch_size * QUEUED_BATCHES)
+        self.batches = 0
+        self.thread = threading.Thread(target=self.run, name='index-writer', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, word_list, page_title, page_url, page_full_text, etag='', last_modified=''):
+        """
+        Analyzes a page in the calling thread and hands it to the writer, see
+        indexer.index.index for the arguments
+
+        returns:
+            concurrent.futures.Future resolved with index's result once the page's batch is
+            committed, or with the exception indexing the page raised
+        """
+        future = Future()
+        parsed_document = ParsedDocument(word_list)
+        self.pending.put((future, parsed_document, page_title, page_url, page_full_text, etag, last_modified))
+        return future
+
+    def flush(self):
+        """Waits until every page submitted so far is committed"""
+        flushed = Future()
+        self.pending.put(flushed)
+        flushed.result()
+
+    def close(self):
+        """Commits the pages submitted so far and stops the writer thread"""
+        if self.thread.is_alive():
+            self.pending.put(_STOP)
+            self.thread.join()
+
+    def run(self):
+        try:
+            stopping = False
+            while not stopping:
+                batch = [self.pending.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size and isinstance(batch[-1], tuple):
+                    try:
+                        batch.append(self.pending.get(timeout=max(0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                pages = [item for item in batch if isinstance(item, tuple)]
+                if pages:
+                    self.commit(pages)
+                for item in batch:
+                    if item is _STOP:
+                        stopping = True
+                    elif isinstance(item, Future):
+                        item.set_result(None)
+        finally:
+            # database connections are per thread, the writer's would otherwise leak
+            connections.close_all()
+
+    def commit(self, pages):
+        """Indexes a batch of submitted pages, in one transaction per shard"""
+        shard_pages = {}
+        for page in pages:
+            shard_pages.setdefault(shard_for_url(page[3]), []).append(page)
+        for alias, alias_pages in shard_pages.items():
+            with use_shard(alias):
+                for attempt in range(LOCK_RETRIES + 1):
+                    try:
+                        outcomes = self.commit_shard(alias_pages)
+                        break
+                    except OperationalError as error:
+                        if is_lock_error(error) and attempt < LOCK_RETRIES:
+                            time.sleep(LOCK_RETRY_DELAY * 2 ** attempt)
+                            continue
+                        outcomes = [(page[0], error) for page in alias_pages]
+                        break
+                    except Exception as error:
+                        outcomes = [(page[0], error) for page in alias_pages]
+                        break
+            # results are only handed out once the batch is committed
+            for future, outcome in outcomes:
+                if isinstance(outcome, BaseException):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+        self.batches += 1
+
+    def commit_shard(self, pages):
+        """
+        Indexes a batch of pages in the current shard in a single transaction
+
+        pages: list of submitted pages
+
+        returns:
+            list of tuples of each page's Future and index's result, or the exception that
+            indexing the page raised
+        """
+        outcomes = []
+        # with INDEXER_SEGMENTS enabled the whole batch is written to one segment on commit
+        with self.write_lock, segment_batch(), transaction.atomic(using=get_current_database()):
+            for future, parsed_document, page_title, page_url, page_full_text, etag, last_modified in pages:
+                try:
+                    # index_page runs in a savepoint, a failing page is rolled back on its own
+                    outcomes.append((future, index_page(
+                        None, page_title, page_url, page_full_text, etag, last_modified,
+                        parsed_document=parsed_document)))
+                except OperationalError as error:
+                    if is_lock_error(error):
+                        raise
+                    outcomes.append((future, error))
+                except Exception as error:
+                    outcomes.append((future, error))
+        return outcomes
@@ -94,6 +94,124 @@ DATABASES = {
     'default': dj_database_url.parse(SQLITE_URL)
 }
 
+# With INDEXER_SHARDS set, documents are hash-partitioned by URL across that many SQLite
+# databases, each with its own copy of the indexer tables (see indexer/shards.py);
+# run `python manage.py migrate --database shard_<n>` for each of them
+INDEXER_SHARDS = int(environ.get('INDEXER_SHARDS', 0))
+for shard in range(INDEXER_SHARDS):
+    DATABASES[f'shard_{shard}'] = dj_database_url.parse('sqlite:////' + str(BASE_DIR / f'shard_{shard}.sqlite3'))
+DATABASE_ROUTERS = ['indexer.shards.ShardRouter']
+# threads retrieval fans queries out to, one per shard when None
+INDEXER_SHARD_WORKERS = None
+
+
+# Indexer
+# Every document norm is recomputed once this fraction of the corpus
+# has been (re)indexed since the last time norms were computed
+INDEXER_NORM_DRIFT_THRESHOLD = 0.1
+
+# Engine used by indexer.retrieve.retrieve to rank documents:
+# 'indexer.retrieve.rank_in_database' scores against the database's postings,
+# 'indexer.sparse.rank_in_memory' scores against an in-memory NumPy matrix of the index
+# (requires numpy, for corpora that fit in RAM),
+# 'indexer.postings.rank_compressed' scores against the compressed postings lists
+# (requires INDEXER_COMPRESSED_POSTINGS),
+# 'indexer.parallel.rank_parallel' scores partitions of the document ids in worker processes
+# (requires INDEXER_SCORING_WORKERS),
+# 'indexer.impacts.rank_impacts' evaluates quantized impact-ordered postings score-at-a-time
+# with early termination (requires INDEXER_IMPACT_ORDERED)
+INDEXER_RETRIEVAL_ENGINE = environ.get('INDEXER_RETRIEVAL_ENGINE', 'indexer.retrieve.rank_in_database')
+
+# Processes in the persistent pool rank_parallel scores queries with, each worker ranks
+# partitions of INDEXER_SCORING_PARTITION_SIZE consecutive document ids of one shard;
+# None scores in the request thread. A sharded index scores with the pool whenever it is set
+INDEXER_SCORING_WORKERS = int(environ.get('INDEXER_SCORING_WORKERS', 0)) or None
+INDEXER_SCORING_PARTITION_SIZE = 50000
+
+# Store every term's postings as one delta + varint compressed PostingsList row, and every
+# document's terms as one DocumentTermList row, instead of a DocumentLexicon row per posting;
+# run the build_postings command to convert an existing index. Turning it off again needs the
+# index reloaded from a dump_index snapshot
+INDEXER_COMPRESSED_POSTINGS = environ.get('INDEXER_COMPRESSED_POSTINGS', 'False') == 'True'
+
+# Keep every term's postings quantized to INDEXER_IMPACT_BITS bit impacts and ordered by impact
+# up to date while indexing; they are requantized whenever norms are refreshed, run the
+# build_impact_lists command after enabling it on an existing index
+INDEXER_IMPACT_ORDERED = environ.get('INDEXER_IMPACT_ORDERED', 'False') == 'True'
+INDEXER_IMPACT_BITS = 8
+
+# Keep the INDEXER_CHAMPION_LIST_SIZE highest weighted postings of every term up to date while
+# indexing, for approximate top-k retrieval with retrieve(approximate=True); run the
+# build_champion_lists command after enabling it on an existing index
+INDEXER_CHAMPION_LISTS = environ.get('INDEXER_CHAMPION_LISTS', 'False') == 'True'
+INDEXER_CHAMPION_LIST_SIZE = 500
+# Show search results ranked from the query terms' champion lists rather than every posting
+INDEXER_APPROXIMATE_RESULTS = environ.get('INDEXER_APPROXIMATE_RESULTS', 'False') == 'True'
+
+# Write each batch of indexed documents to an immutable segment file under INDEXER_SEGMENT_DIR
+# instead of the TermLexicon and DocumentLexicon tables, query them with
+# INDEXER_RETRIEVAL_ENGINE = 'indexer.segments.rank_segments' and compact them with
+# the merge_segments command, which merges INDEXER_SEGMENT_MERGE_FACTOR segments of a tier at once
+INDEXER_SEGMENTS = environ.get('INDEXER_SEGMENTS', 'False') == 'True'
+INDEXER_SEGMENT_DIR = environ.get('INDEXER_SEGMENT_DIR', str(BASE_DIR / 'segments'))
+INDEXER_SEGMENT_MERGE_FACTOR = 10
+
+# Rankings returned by retrieve are cached in this cache, keyed on the analyzed query terms
+# and the index generation; None disables the cache. The local-memory backend evicts the
+# least recently used entry past MAX_ENTRIES and keeps each process's entries and hit/miss
+# counts to itself, point the alias at a shared backend to share them between processes
+INDEXER_QUERY_CACHE = 'query_results'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'query_results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'query-results',
+        'TIMEOUT': 600,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+# URLs submitted on the indexing page are queued as IndexJob rows and indexed by the
+# run_index_workers command with INDEXER_INDEX_WORKERS threads. A failed attempt is retried
+# after INDEXER_JOB_RETRY_DELAY seconds, doubling each time up to INDEXER_JOB_MAX_RETRY_DELAY,
+# until INDEXER_JOB_MAX_ATTEMPTS attempts have failed; a job running for longer than
+# INDEXER_JOB_LEASE seconds is assumed abandoned by its worker and run again
+INDEXER_INDEX_WORKERS = 4
+INDEXER_JOB_MAX_ATTEMPTS = 5
+INDEXER_JOB_RETRY_DELAY = 30
+INDEXER_JOB_MAX_RETRY_DELAY = 3600
+INDEXER_JOB_LEASE = 600
+
+# Pages indexed through an indexer.writer.IndexWriter, as the threads of run_index_workers do,
+# are committed by its single writer thread in batches of up to INDEXER_WRITER_BATCH_SIZE
+# pages, each batch waiting at most INDEXER_WRITER_FLUSH_INTERVAL seconds to fill
+INDEXER_WRITER_BATCH_SIZE = 50
+INDEXER_WRITER_FLUSH_INTERVAL = 0.5
+
+# The crawl command fetches up to INDEXER_CRAWL_CONCURRENCY pages at once, at most
+# INDEXER_CRAWL_HOST_CONCURRENCY of them from the same host, and starts requests to the
+# same host at least INDEXER_CRAWL_HOST_DELAY seconds apart
+INDEXER_CRAWL_CONCURRENCY = 16
+INDEXER_CRAWL_HOST_CONCURRENCY = 2
+INDEXER_CRAWL_HOST_DELAY = 1.0
+
+# Pages are scraped through a shared requests Session keeping up to INDEXER_HTTP_POOL_SIZE
+# connections to each host alive. Requests time out after INDEXER_HTTP_CONNECT_TIMEOUT seconds
+# waiting to connect and INDEXER_HTTP_READ_TIMEOUT seconds waiting for data, and pages whose
+# decompressed body is larger than INDEXER_HTTP_MAX_BODY_BYTES are abandoned
+INDEXER_HTTP_POOL_SIZE = 16
+INDEXER_HTTP_CONNECT_TIMEOUT = 5.0
+INDEXER_HTTP_READ_TIMEOUT = 30.0
+INDEXER_HTTP_MAX_BODY_BYTES = 10 * 1024 * 1024
+
+# Function scraped pages are parsed with: 'indexer.extractors.extract_streaming' pulls out the
+# title, visible text and links in one pass of html.parser callbacks, without building a tree,
+# 'indexer.extractors.extract_with_soup' parses the page into a BeautifulSoup tree first;
+# the benchmark_extractors command compares the two
+INDEXER_HTML_EXTRACTOR = environ.get('INDEXER_HTML_EXTRACTOR', 'indexer.extractors.extract_streaming')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators